@@ -0,0 +1,200 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import soundfile as sf
+
+
+# Default size limit of the decoded-audio cache, in bytes
+DEFAULT_MAX_CACHE_BYTES = 20 * 1024 ** 3
+
+# Samples are cached as 16-bit PCM decoded by libsndfile, like every uncached path decodes them,
+# so turning the cache on never moves a silence boundary
+CACHE_DTYPE = "int16"
+
+# Subfolder of the cache remembering the content hash of each (path, size, modification time)
+STAMPS_FOLDER = "stamps"
+
+
+def content_hash(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-256 of a file's content, so renamed or copied recordings share a cache entry.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_key(path, cache_dir):
+    """
+    Returns the content hash of a file, reading the file only if it changed since it was last hashed.
+
+    The hash is remembered in a stamp named after the path, size and modification time
+    of the file, so a recording used by several stages (or runs) is only hashed once.
+    """
+    stat = os.stat(path)
+    stamp = hashlib.sha256(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    stamp_path = os.path.join(cache_dir, STAMPS_FOLDER, stamp)
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            return f.read()
+
+    key = content_hash(path)
+    os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(stamp_path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    os.replace(tmp_path, stamp_path)
+    return key
+
+
+def cache_entry_path(cache_dir, key, sampling_rate=None):
+    """
+    Returns the .npy path of a cache entry, one per (content hash, sampling rate) pair.
+    """
+    suffix = f"_{sampling_rate}" if sampling_rate else "_native"
+    return os.path.join(cache_dir, f"{key}{suffix}_{CACHE_DTYPE}.npy")
+
+
+def decode_audio(path, sampling_rate=None):
+    """
+    Decodes a whole audio file with libsndfile to an int16 (frames, channels) array, optionally resampled.
+
+    Args:
+        path (str): Audio file to decode.
+        sampling_rate (int): Target sampling rate (None keeps the original rate).
+
+    Returns:
+        tuple: (samples, sampling rate).
+    """
+    samples, sample_rate = sf.read(path, dtype=CACHE_DTYPE, always_2d=True)
+    if sampling_rate and sampling_rate != sample_rate:
+        import librosa
+
+        resampled = librosa.resample(samples / 32768.0, orig_sr=sample_rate, target_sr=sampling_rate, axis=0)
+        samples = np.clip(np.rint(resampled * 32768), -32768, 32767).astype(CACHE_DTYPE)
+        sample_rate = sampling_rate
+    return samples, sample_rate
+
+
+def write_entry(entry_path, samples, sample_rate):
+    """
+    Atomically stores a decoded array and its sampling rate, so parallel workers never read a partial entry.
+    """
+    cache_dir = os.path.dirname(entry_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    fd, tmp_metadata_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"sampling_rate": int(sample_rate)}, f)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, samples)
+
+    # The metadata goes first: an entry is only visible once its .npy exists
+    os.replace(tmp_metadata_path, entry_path[:-len(".npy")] + ".json")
+    os.replace(tmp_path, entry_path)
+
+
+def read_entry(entry_path):
+    """
+    Memory-maps a cache entry and marks it as recently used.
+
+    Returns:
+        tuple: (read-only int16 memmap of shape (frames, channels), sampling rate), or None on a miss.
+    """
+    metadata_path = entry_path[:-len(".npy")] + ".json"
+    if not (os.path.exists(entry_path) and os.path.exists(metadata_path)):
+        return None
+
+    with open(metadata_path) as f:
+        sample_rate = json.load(f)["sampling_rate"]
+
+    # The modification time is the LRU clock
+    os.utime(entry_path)
+    return np.load(entry_path, mmap_mode="r"), sample_rate
+
+
+def evict(cache_dir, max_bytes=DEFAULT_MAX_CACHE_BYTES, keep=()):
+    """
+    Removes the least recently used entries until the cache fits in `max_bytes`.
+
+    Args:
+        cache_dir (str): Cache directory.
+        max_bytes (int): Size limit of the cache.
+        keep (Iterable[str]): Entry paths that must not be evicted.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npy"):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # Evicted by another worker
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        for stale in (path, path[:-len(".npy")] + ".json"):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def load_audio(path, cache_dir, sampling_rate=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Returns the decoded samples of an audio file, decoding it only if it is not cached yet.
+
+    Entries are keyed by the SHA-256 of the file content (see source_key) and the requested
+    sampling rate, stored as int16 .npy files and memory-mapped on later calls, so a second
+    run over the same recordings does not decode anything. The cache is kept under
+    `max_cache_bytes` by evicting the least recently used entries.
+
+    Args:
+        path (str): Audio file to load.
+        cache_dir (str): Cache directory, shared by all the scripts.
+        sampling_rate (int): Resample to this rate before caching (None keeps the original rate).
+        max_cache_bytes (int): Size limit of the cache.
+
+    Returns:
+        tuple: (int16 array of shape (frames, channels), sampling rate).
+    """
+    entry_path = cache_entry_path(cache_dir, source_key(path, cache_dir), sampling_rate)
+    cached = read_entry(entry_path)
+    if cached is not None:
+        return cached
+
+    samples, sample_rate = decode_audio(path, sampling_rate)
+    write_entry(entry_path, samples, sample_rate)
+    evict(cache_dir, max_cache_bytes, keep={entry_path})
+    return read_entry(entry_path) or (samples, sample_rate)
+
+
+def audio_info(path, cache_dir=None):
+    """
+    Returns the sampling rate and number of frames of an audio file.
+
+    A cached entry at the original rate answers without touching the audio decoder;
+    otherwise the file header is read with soundfile.
+
+    Returns:
+        tuple: (sampling rate, number of frames).
+    """
+    if cache_dir:
+        cached = read_entry(cache_entry_path(cache_dir, source_key(path, cache_dir)))
+        if cached is not None:
+            samples, sample_rate = cached
+            return sample_rate, len(samples)
+
+    info = sf.info(path)
+    return info.samplerate, info.frames
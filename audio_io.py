@@ -0,0 +1,153 @@
+import io
+import os
+import wave
+import numpy as np
+import soundfile as sf
+
+
+# Default duration (in seconds) of the blocks decoded at a time in streaming mode
+DEFAULT_BLOCK_DURATION = 30.0
+
+
+def audio_source(audio):
+    """
+    Returns something soundfile can open from a Hugging Face audio dict loaded with Audio(decode=False).
+
+    Args:
+        audio (dict): Audio entry with 'path' and/or 'bytes' keys.
+
+    Returns:
+        str or io.BytesIO: Path to the file, or an in-memory file for embedded bytes.
+    """
+    if audio.get("bytes"):
+        return io.BytesIO(audio["bytes"])
+    return audio["path"]
+
+
+def audio_blocks(sound_file, block_frames, dtype="int16"):
+    """
+    Yields consecutive (frames, channels) blocks from an open soundfile.SoundFile, then closes it.
+    """
+    with sound_file:
+        while True:
+            block = sound_file.read(block_frames, dtype=dtype, always_2d=True)
+            if not len(block):
+                break
+            yield block
+
+
+def audio_duration(audio):
+    """
+    Returns the duration in seconds of a Hugging Face audio entry, decoded or not, reading only the header of encoded audio.
+    """
+    if audio.get("array") is not None:
+        return len(audio["array"]) / audio["sampling_rate"]
+    return sf.info(audio_source(audio)).duration
+
+
+def open_audio_stream(source, block_duration=DEFAULT_BLOCK_DURATION, dtype="int16"):
+    """
+    Opens an audio file for block-by-block decoding, so it never has to be fully loaded in memory.
+
+    Args:
+        source (str or file-like): Audio file to decode (any format supported by libsndfile, including MP3).
+        block_duration (float): Duration of each decoded block in seconds.
+        dtype (str): Sample type of the decoded blocks.
+
+    Returns:
+        tuple: (sample_rate, generator of (frames, channels) blocks).
+    """
+    sound_file = sf.SoundFile(source)
+    block_frames = max(int(block_duration * sound_file.samplerate), 1)
+    return sound_file.samplerate, audio_blocks(sound_file, block_frames, dtype)
+
+
+def source_id(audio, index):
+    """
+    Returns a collision-free identifier for the recording of a dataset row.
+
+    The row index keeps two recordings with the same file name (or no path at all)
+    apart, so segments of different sources never overwrite each other.
+
+    Args:
+        audio (dict): Audio entry of the row, with a 'path' key.
+        index (int): Index of the row in the dataset.
+
+    Returns:
+        str: Identifier such as '00012_Conte_12_Pag_a_yembre_kibare'.
+    """
+    stem = os.path.splitext(os.path.basename(audio.get("path") or ""))[0] or "audio"
+    return f"{index:05d}_{stem}"
+
+
+def array_to_audiosegment(samples, sample_rate):
+    """
+    Wraps a (frames, channels) int16 or float array into a 16-bit pydub AudioSegment, e.g. to export it.
+    """
+    from pydub import AudioSegment
+
+    samples = samples.reshape(len(samples), -1)
+    if np.issubdtype(samples.dtype, np.floating):
+        samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    return AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2, channels=samples.shape[1])
+
+
+# Clip encodings written with soundfile, plus headerless 16-bit PCM
+CLIP_FORMATS = ("wav", "flac", "pcm")
+
+# libsndfile (format, subtype) of the compressed encodings; MP3 needs libsndfile >= 1.1
+SOUNDFILE_ENCODINGS = {
+    "flac": ("FLAC", "PCM_16"),
+    "mp3": ("MP3", "MPEG_LAYER_III"),
+}
+
+
+def write_clip(samples, sample_rate, clip_path, audio_format="wav"):
+    """
+    Encodes a (frames, channels) clip in-process, as 16-bit WAV, headerless little-endian 16-bit PCM, FLAC or MP3.
+    """
+    if audio_format not in ("wav", "pcm"):
+        file_format, subtype = SOUNDFILE_ENCODINGS[audio_format]
+        sf.write(clip_path, samples, sample_rate, format=file_format, subtype=subtype)
+        return
+
+    samples = samples.reshape(len(samples), -1)
+    if np.issubdtype(samples.dtype, np.floating):
+        samples = np.clip(samples, -1.0, 1.0) * 32767
+    samples = samples.astype("<i2")
+
+    if audio_format == "pcm":
+        samples.tofile(clip_path)
+    else:
+        # The wave module only writes a header in front of the samples, much faster than libsndfile for short clips
+        with wave.open(clip_path, "wb") as f:
+            f.setnchannels(samples.shape[1])
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(samples.tobytes())
+
+
+def read_pcm(clip_path, num_channels=1):
+    """
+    Reads a headerless 16-bit PCM clip written by write_clip as float32 samples, without any decoding.
+    """
+    samples = np.fromfile(clip_path, dtype="<i2").astype(np.float32) / 32768
+    return samples.reshape(-1, num_channels) if num_channels > 1 else samples
+
+
+def decode_pcm_clips(batch):
+    """
+    Dataset transform replacing the PCM clip path of each row by its samples.
+    """
+    batch["audio"] = [
+        {"path": path, "array": read_pcm(path, num_channels), "sampling_rate": sample_rate}
+        for path, sample_rate, num_channels in zip(batch["audio"], batch["sampling_rate"], batch["num_channels"])
+    ]
+    return batch
+
+
+def with_pcm_audio(dataset):
+    """
+    Returns a view of a dataset of PCM clips whose 'audio' entries hold their samples, read when rows are accessed.
+    """
+    return dataset.with_transform(decode_pcm_clips)
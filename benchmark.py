@@ -0,0 +1,332 @@
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import soundfile as sf
+
+
+# Recording lengths (in seconds) the stages are measured at
+SIZES = {"1m": 60, "10m": 600, "30m": 1800, "2h": 7200}
+DEFAULT_SIZES = ["1m", "10m"]
+
+STAGES = ["split_audio_on_silence", "process_row", "process_audio_and_transcripts", "process_audios"]
+
+# Baselines stored next to this file, one entry per '<stage>@<size>'
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines.json")
+
+# With --check_baselines, a stage regresses when the median of its runs gets this much slower,
+# or uses this much more memory, than its baseline
+DEFAULT_MAX_SLOWDOWN = 0.5
+DEFAULT_MAX_RSS_INCREASE = 0.25
+
+# Slowdowns smaller than this (in seconds) are timer and scheduler noise, whatever the ratio
+TIMING_NOISE_S = 0.1
+
+# Synthetic recordings: 16 kHz mono sentences of 2 to 8 s separated by 0.7 to 1.5 s of near-silence
+SAMPLE_RATE = 16000
+SENTENCE_DURATION = (2.0, 8.0)
+GAP_DURATION = (0.7, 1.5)
+CHARS_PER_SECOND = 12
+
+# Segmentation settings that find exactly one segment per synthetic sentence
+SILENCE_THRESH = -40
+MIN_SILENCE_LEN = 500
+
+# Recordings of the prepare_data.py corpus, which grows with the size instead of its recordings
+CORPUS_FILE_DURATION = 60
+
+# The corpus MP3s are 44.1 kHz, like the raw_data recordings: libmpg123 reports bit reservoir
+# errors when the 16 kHz (MPEG-2) MP3s written by libsndfile are decoded block by block
+CORPUS_SAMPLE_RATE = 44100
+
+# Bumped whenever the fixtures change, so fixtures generated by an older version are rebuilt
+FIXTURE_VERSION = 2
+
+# Mooré-like syllables the synthetic transcripts are made of
+SYLLABLES = ["ba", "bo", "ka", "kõ", "kɩ", "ga", "sa", "sẽ", "sʋ", "ta", "tɩ", "za", "zo", "ya", "wa", "we", "ra", "rã", "la", "lʋ", "da", "dẽ"]
+
+
+def speech_like(duration, rng, sample_rate=SAMPLE_RATE):
+    """
+    Returns a sentence-long float32 signal: a harmonic voice with syllable-rate amplitude modulation and no pause.
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    f0 = rng.uniform(100, 220)
+    phase = 2 * np.pi * f0 * t + 3 * np.sin(2 * np.pi * rng.uniform(3, 6) * t)
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6)) / 2.3
+    envelope = 0.35 + 0.65 * (0.5 - 0.5 * np.cos(2 * np.pi * rng.uniform(3, 6) * t))
+    fade = np.minimum(1.0, np.minimum(t, t[-1] - t) / 0.02)
+    signal = 0.25 * envelope * fade * voice + 0.02 * rng.standard_normal(len(t))
+    return signal.astype(np.float32)
+
+
+def near_silence(duration, rng, sample_rate=SAMPLE_RATE):
+    """
+    Returns background noise around -70 dBFS.
+    """
+    return (0.0003 * rng.standard_normal(int(duration * sample_rate))).astype(np.float32)
+
+
+def sentence_text(duration, rng):
+    """
+    Returns a capitalized sentence whose length matches its duration at CHARS_PER_SECOND.
+    """
+    words, length = [], 0
+    while length < duration * CHARS_PER_SECOND:
+        word = "".join(rng.choice(SYLLABLES, size=rng.integers(1, 4)))
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).capitalize() + "."
+
+
+def write_recording(audio_path, duration, seed, sample_rate=SAMPLE_RATE):
+    """
+    Writes a deterministic synthetic recording with known silence gaps, one sentence at a time.
+
+    Returns:
+        list: (start, end, sentence) of each sentence, in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    labels, position = [], 0.5
+    with sf.SoundFile(audio_path, "w", sample_rate, 1, format="MP3" if audio_path.endswith(".mp3") else "WAV") as f:
+        f.write(near_silence(0.5, rng, sample_rate))
+        while True:
+            sentence_duration = rng.uniform(*SENTENCE_DURATION)
+            gap = rng.uniform(*GAP_DURATION)
+            if labels and position + sentence_duration + gap > duration:
+                break
+            f.write(speech_like(sentence_duration, rng, sample_rate))
+            f.write(near_silence(gap, rng, sample_rate))
+            labels.append((position, position + sentence_duration, sentence_text(sentence_duration, rng)))
+            position += sentence_duration + gap
+    return labels
+
+
+def fixture(work_dir, size):
+    """
+    Generates (once) the synthetic fixtures of a size: a WAV recording with its transcript and
+    Audacity label file, and a raw_data-style corpus of 44.1 kHz MP3/TXT pairs of the same total length.
+
+    Returns:
+        dict: Paths of the fixtures and the number of sentences of the recording.
+    """
+    folder = os.path.join(work_dir, "fixtures", size)
+    paths = {
+        "audio_dir": os.path.join(folder, "audios"),
+        "transcript_dir": os.path.join(folder, "transcripts"),
+        "corpus_dir": os.path.join(folder, "corpus"),
+    }
+    paths["audio_path"] = os.path.join(paths["audio_dir"], f"recording_{size}.wav")
+    paths["labels_path"] = os.path.join(paths["transcript_dir"], f"recording_{size}.txt")
+    paths["text_path"] = os.path.join(folder, "transcription.txt")
+    done_path = os.path.join(folder, "fixture.json")
+
+    if load_fixture(done_path).get("version") != FIXTURE_VERSION:
+        shutil.rmtree(folder, ignore_errors=True)
+        for name in ("audio_dir", "transcript_dir", "corpus_dir"):
+            os.makedirs(paths[name])
+
+        labels = write_recording(paths["audio_path"], SIZES[size], seed=SIZES[size])
+        with open(paths["labels_path"], "w", encoding="utf-8") as f:
+            f.writelines(f"{start:.6f}\t{end:.6f}\t{text}\n" for start, end, text in labels)
+        with open(paths["text_path"], "w", encoding="utf-8") as f:
+            f.write(" ".join(text for _, _, text in labels))
+
+        for i in range(max(SIZES[size] // CORPUS_FILE_DURATION, 1)):
+            story = os.path.join(paths["corpus_dir"], f"story_{i:04d}")
+            story_labels = write_recording(
+                story + ".mp3", CORPUS_FILE_DURATION, seed=SIZES[size] * 10_000 + i, sample_rate=CORPUS_SAMPLE_RATE
+            )
+            with open(story + ".txt", "w", encoding="utf-8") as f:
+                f.write(" ".join(text for _, _, text in story_labels))
+
+        with open(done_path, "w", encoding="utf-8") as f:
+            json.dump({"version": FIXTURE_VERSION, "num_sentences": len(labels)}, f)
+
+    return {**paths, **load_fixture(done_path)}
+
+
+def load_fixture(done_path):
+    """
+    Loads the description of a generated fixture, or none if it was never generated.
+    """
+    if not os.path.exists(done_path):
+        return {}
+    with open(done_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def import_script(path):
+    """
+    Imports a script of the repository by path (their names are not always valid module names).
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, os.path.dirname(path))
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_stage(stage, paths, output_dir):
+    """
+    Runs one stage on its fixture and measures it. Meant to run in a fresh process, so peak RSS is its own.
+
+    Returns:
+        dict: {'wall_time_s', 'peak_rss_mb', 'segments'}.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Imports are not part of the measured time
+    if stage in ("split_audio_on_silence", "process_row"):
+        module = import_script(os.path.join(root, "process_and_push_to_hf.py"))
+        from row_segmentation import process_row
+    elif stage == "process_audio_and_transcripts":
+        module = import_script(os.path.join(root, "manual_labeling", "process_data.py"))
+    else:
+        module = import_script(os.path.join(root, "prepare_data.py"))
+
+    start = time.perf_counter()
+    if stage == "split_audio_on_silence":
+        segments = len(module.split_audio_on_silence(paths["audio_path"], SILENCE_THRESH, MIN_SILENCE_LEN, output_dir))
+    elif stage == "process_row":
+        with open(paths["text_path"], "r", encoding="utf-8") as f:
+            row = {"audio": {"path": paths["audio_path"], "bytes": None}, "transcription": f.read()}
+        result = process_row(
+            row, 0, SILENCE_THRESH, MIN_SILENCE_LEN, output_dir, module.split_row_audio, name_after_source=True,
+            output_mode="offsets", align=True
+        )
+        segments = len(result["segment_offsets"])
+    elif stage == "process_audio_and_transcripts":
+        segments = len(module.process_audio_and_transcripts(paths["audio_dir"], paths["transcript_dir"], output_dir, full_rebuild=True))
+    else:
+        module.process_audios(paths["corpus_dir"], output_dir, full_rebuild=True, shard_size=1000)
+        with open(os.path.join(output_dir, "hf_shards", "shards.json"), "r", encoding="utf-8") as f:
+            segments = json.load(f)["num_rows"]
+    wall_time = time.perf_counter() - start
+
+    return {
+        "wall_time_s": wall_time,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "segments": segments,
+    }
+
+
+def measure(stage, size, work_dir, repeat=1):
+    """
+    Measures a stage at a size `repeat` times, each in a spawned process on a clean output folder.
+
+    Returns:
+        dict: The median wall time and peak RSS of the runs, and their segment count
+            (the wrong one if a run found the wrong number of segments).
+    """
+    paths = fixture(work_dir, size)
+    output_dir = os.path.join(work_dir, "outputs", f"{stage}@{size}")
+    expected = len(os.listdir(paths["corpus_dir"])) // 2 if stage == "process_audios" else paths["num_sentences"]
+
+    runs = []
+    for _ in range(repeat):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            runs.append(executor.submit(run_stage, stage, paths, output_dir).result())
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    wall_time = float(np.median([run["wall_time_s"] for run in runs]))
+    segments = next((run["segments"] for run in runs if run["segments"] != expected), runs[0]["segments"])
+    return {
+        "wall_time_s": wall_time,
+        "peak_rss_mb": float(np.median([run["peak_rss_mb"] for run in runs])),
+        "segments": segments,
+        "segments_per_s": segments / wall_time,
+        "expected_segments": expected,
+    }
+
+
+def regressions(key, result, baseline, max_slowdown=DEFAULT_MAX_SLOWDOWN, max_rss_increase=DEFAULT_MAX_RSS_INCREASE):
+    """
+    Lists what got worse in a measurement: a wrong segment count, and with a baseline, a slowdown or a memory increase.
+
+    Wall times depend on the machine and its load, so the baseline is only given with --check_baselines.
+    """
+    problems = []
+    if result["segments"] != result["expected_segments"]:
+        problems.append(f"{key}: {result['segments']} segments instead of {result['expected_segments']}")
+    if baseline is None:
+        return problems
+    if result["wall_time_s"] > baseline["wall_time_s"] * (1 + max_slowdown) + TIMING_NOISE_S:
+        problems.append(f"{key}: {result['wall_time_s']:.2f} s, baseline {baseline['wall_time_s']:.2f} s")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + max_rss_increase):
+        problems.append(f"{key}: peak RSS {result['peak_rss_mb']:.0f} MB, baseline {baseline['peak_rss_mb']:.0f} MB")
+    return problems
+
+
+def load_baselines(path=BASELINES_PATH):
+    """
+    Loads the stored baselines, or none if they were never recorded.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic recordings and compare them with the stored baselines.")
+
+    parser.add_argument("--sizes", type=str, nargs="+", default=DEFAULT_SIZES, choices=list(SIZES), help="Recording lengths to measure (default: 1m 10m).")
+    parser.add_argument("--stages", type=str, nargs="+", default=STAGES, choices=STAGES, help="Stages to measure (default: all).")
+    parser.add_argument("--work_dir", type=str, default=os.path.join(tempfile.gettempdir(), "forced-alignment-moore-benchmark"), help="Folder of the generated fixtures, reused across runs.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs of each stage; their median is reported (default: 1).")
+    parser.add_argument("--check_baselines", action="store_true", help="Also fail when a stage gets slower or uses more memory than its baseline, or has no baseline (only meaningful on the machine the baselines were recorded on).")
+    parser.add_argument("--max_slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN, help="With --check_baselines, fail when a stage gets slower than its baseline by more than this fraction (default: 0.5).")
+    parser.add_argument("--max_rss_increase", type=float, default=DEFAULT_MAX_RSS_INCREASE, help="With --check_baselines, fail when the peak RSS of a stage grows by more than this fraction (default: 0.25).")
+    parser.add_argument("--update_baselines", action="store_true", help="Store the measurements as the new baselines instead of comparing with them.")
+    parser.add_argument("--report_path", type=str, default=None, help="Path to save the measurements (JSON).")
+
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    results, problems = {}, []
+    print(f"{'stage@size':<40} {'wall (s)':>10} {'peak RSS (MB)':>14} {'segments':>9} {'segments/s':>11} {'baseline (s)':>13}")
+    for size in args.sizes:
+        for stage in args.stages:
+            key = f"{stage}@{size}"
+            results[key] = measure(stage, size, args.work_dir, args.repeat)
+            baseline = baselines.get(key)
+            compared = baseline if args.check_baselines and not args.update_baselines else None
+            problems += regressions(key, results[key], compared, args.max_slowdown, args.max_rss_increase)
+            if args.check_baselines and not args.update_baselines and baseline is None:
+                # A stage without a baseline would otherwise never be checked for time or memory
+                problems.append(f"{key}: no baseline, record one with --update_baselines")
+            print(f"{key:<40} {results[key]['wall_time_s']:>10.2f} {results[key]['peak_rss_mb']:>14.0f} "
+                  f"{results[key]['segments']:>9} {results[key]['segments_per_s']:>11.1f} "
+                  f"{baseline['wall_time_s'] if baseline else float('nan'):>13.2f}")
+
+    if args.report_path:
+        with open(args.report_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+    if args.update_baselines:
+        baselines.update({
+            key: {"wall_time_s": round(result["wall_time_s"], 3), "peak_rss_mb": round(result["peak_rss_mb"]), "segments": result["segments"]}
+            for key, result in results.items()
+        })
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=1)
+            f.write("\n")
+        print(f"Baselines saved to {BASELINES_PATH}")
+
+    if problems:
+        print("\nRegressions:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
@@ -0,0 +1,114 @@
+import numpy as np
+
+from silence_detection import ENERGY_CHUNK_MS, audio_length_ms, max_possible_amplitude, ms_energy, ms_to_frame
+
+
+# Columns added next to the duration of every clip, all float64
+STATS_COLUMNS = ["rms_dbfs", "peak_dbfs", "clipping_ratio", "snr_db", "speech_ratio", "chars_per_second"]
+
+# Milliseconds louder than this (in dBFS) count as speech, as in the silence detection defaults
+DEFAULT_SPEECH_THRESH = -50
+
+# Samples at or above this fraction of full scale count as clipped
+CLIPPING_LEVEL = 0.999
+
+# Floor of every level in dBFS, so that digital silence gives finite, sortable values
+MIN_DBFS = -120.0
+
+# The noise floor of a clip is this percentile of its per-millisecond power
+NOISE_PERCENTILE = 10
+
+
+def to_dbfs(power, full_scale):
+    """
+    Converts mean squared sample values to dBFS, floored at MIN_DBFS.
+    """
+    power = np.maximum(np.asarray(power, dtype=np.float64) / full_scale ** 2, 10 ** (MIN_DBFS / 10))
+    return 10 * np.log10(power)
+
+
+def block_levels(samples, sample_rate, chunk_ms=ENERGY_CHUNK_MS):
+    """
+    Computes the per-millisecond mean power, the energy, the peak and the number of clipped samples of a block of audio.
+
+    The block is read in chunks of `chunk_ms`, so no full-size copy of it is ever made.
+
+    Args:
+        samples (np.ndarray): Audio samples, shape (frames,) or (frames, channels).
+        sample_rate (int): Sampling rate of the audio.
+        chunk_ms (int): Number of milliseconds read per chunk.
+
+    Returns:
+        tuple: (per-millisecond mean power, sum of squared samples, peak amplitude, number of clipped samples).
+    """
+    samples = samples.reshape(len(samples), -1)
+    bounds = np.minimum(ms_to_frame(np.arange(audio_length_ms(len(samples), sample_rate) + 1), sample_rate), len(samples))
+    counts = np.diff(bounds) * samples.shape[1]
+    energy = ms_energy(samples, sample_rate, chunk_ms)
+    power = energy / np.maximum(counts, 1)
+
+    level = CLIPPING_LEVEL * max_possible_amplitude(samples)
+    peak, clipped = 0.0, 0
+    chunk_frames = max(int(chunk_ms * sample_rate / 1000), 1)
+    for start in range(0, len(samples), chunk_frames):
+        chunk = samples[start:start + chunk_frames]
+        # max(-min) instead of abs(), which overflows on the most negative integer sample
+        chunk_peak = max(float(chunk.max()), -float(chunk.min()))
+        peak = max(peak, chunk_peak)
+        if chunk_peak >= level:
+            # Most chunks do not clip at all: only count the samples of the ones that do
+            clipped += int(np.count_nonzero(chunk >= level) + np.count_nonzero(chunk <= -level))
+    return power, float(energy.sum()), peak, clipped
+
+
+def clip_stats(blocks, sample_rate, text=None, speech_thresh=DEFAULT_SPEECH_THRESH):
+    """
+    Computes the quality statistics of a clip in one pass over its samples.
+
+    Args:
+        blocks (Iterable[np.ndarray]): Consecutive (frames, channels) blocks of the clip, e.g. [samples]
+            or the blocks of audio_io.open_audio_stream.
+        sample_rate (int): Sampling rate of the clip.
+        text (str): Transcription of the clip (None leaves chars_per_second empty).
+        speech_thresh (float): Milliseconds louder than this (in dBFS) count as speech.
+
+    Returns:
+        dict: The STATS_COLUMNS of the clip:
+            - rms_dbfs: loudness of the whole clip,
+            - peak_dbfs: level of its loudest sample,
+            - clipping_ratio: fraction of samples at full scale,
+            - snr_db: mean power of the speech milliseconds over the noise floor (NOISE_PERCENTILE of the milliseconds),
+            - speech_ratio: fraction of milliseconds louder than `speech_thresh`,
+            - chars_per_second: non-space characters of `text` per second, as the aligner counts them.
+    """
+    powers, energy, peak, clipped, num_samples, num_frames, full_scale = [], 0.0, 0.0, 0, 0, 0, 1.0
+    for samples in blocks:
+        if not len(samples):
+            continue
+        samples = samples.reshape(len(samples), -1)
+        full_scale = max_possible_amplitude(samples)
+        power, block_energy, block_peak, block_clipped = block_levels(samples, sample_rate)
+        powers.append(power)
+        energy += block_energy
+        peak, clipped = max(peak, block_peak), clipped + block_clipped
+        num_samples, num_frames = num_samples + samples.size, num_frames + len(samples)
+
+    power = np.concatenate(powers) if powers else np.zeros(0)
+    duration = num_frames / sample_rate
+    speech = to_dbfs(power, full_scale) > speech_thresh
+    if speech.any():
+        noise = max(np.percentile(power, NOISE_PERCENTILE), full_scale ** 2 * 10 ** (MIN_DBFS / 10))
+        snr = max(10 * np.log10(power[speech].mean() / noise), 0.0)
+    else:
+        snr = 0.0
+
+    return {
+        "rms_dbfs": float(to_dbfs(energy / num_samples, full_scale)) if num_samples else MIN_DBFS,
+        "peak_dbfs": float(to_dbfs(peak ** 2, full_scale)),
+        "clipping_ratio": clipped / num_samples if num_samples else 0.0,
+        "snr_db": float(snr),
+        "speech_ratio": float(speech.mean()) if len(speech) else 0.0,
+        "chars_per_second": (
+            sum(not c.isspace() for c in text) / duration if duration else 0.0
+        ) if text is not None else None,
+    }
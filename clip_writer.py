@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_io import write_clip
+from clip_stats import clip_stats
+
+
+# Default number of threads encoding clips
+DEFAULT_WRITER_THREADS = 4
+
+
+def write_clip_with_stats(samples, sample_rate, clip_path, audio_format, row=None, text=None):
+    """
+    Writes a clip, then adds its audio statistics to `row` (if any).
+    """
+    write_clip(samples, sample_rate, clip_path, audio_format)
+    if row is not None:
+        row.update(clip_stats([samples], sample_rate, text))
+
+
+class ClipWriter:
+    """
+    Encodes and writes clips from a pool of threads, without any subprocess.
+
+    Clips are encoded in-process by libsndfile, which releases the GIL, so writing
+    overlaps with decoding and slicing the next clips (or the next recording). The audio
+    statistics of a clip can be computed in the same thread, while its samples are at hand.
+    At most `max_pending` clips wait in memory, so a fast producer cannot outrun the writers.
+    """
+
+    def __init__(self, num_threads=DEFAULT_WRITER_THREADS, max_pending=None):
+        self.executor = ThreadPoolExecutor(max_workers=max(num_threads, 1))
+        self.slots = threading.BoundedSemaphore(max_pending or 4 * max(num_threads, 1))
+        self.futures = []
+
+    def submit(self, samples, sample_rate, clip_path, audio_format="wav", row=None, text=None):
+        """
+        Queues a (frames, channels) clip for writing, and returns its future.
+
+        With `row`, the clip_stats of the clip (`text` being its transcription) are added to
+        the row by the writing thread: they are only there once the future is done.
+        """
+        self.slots.acquire()
+        future = self.executor.submit(write_clip_with_stats, samples, sample_rate, clip_path, audio_format, row, text)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    def take(self):
+        """
+        Returns the futures of the clips submitted since the last call (or flush), without waiting for them.
+        """
+        futures, self.futures = self.futures, []
+        return futures
+
+    @staticmethod
+    def wait(futures):
+        """
+        Waits until the given clips are written, raising the first writing error.
+        """
+        for future in futures:
+            future.result()
+
+    def flush(self):
+        """
+        Waits until every submitted clip is written.
+        """
+        self.wait(self.take())
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+# Labels may end this many seconds past the end of the audio (MP3 padding, rounding in Audacity) and are clipped to it
+END_TOLERANCE = 0.05
+
+# Consecutive labels may overlap by this many seconds (rounding of hand-placed boundaries)
+OVERLAP_TOLERANCE = 0.01
+
+# Number of problems listed in the error of a bad label file
+MAX_REPORTED_PROBLEMS = 10
+
+
+def split_label_line(line):
+    """
+    Splits a label line into its (start, end, text) fields.
+
+    Audacity exports 'start<TAB>end<TAB>text', with a decimal comma in some locales; the
+    hand-written format of the README is 'start, end, "text"'. A line with a tab is read
+    as tab-separated, any other as comma-separated.
+
+    Returns:
+        tuple: (start, end, text) strings, or None if the line has fewer than three fields.
+    """
+    if "\t" in line:
+        parts = line.split("\t", 2)
+        if len(parts) < 3:
+            return None
+        start, end, text = parts
+        start, end = start.replace(",", "."), end.replace(",", ".")
+    else:
+        parts = line.split(",", 2)
+        if len(parts) < 3:
+            return None
+        start, end, text = parts
+
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        text = text[1:-1].replace('""', '"')
+    return start.strip(), end.strip(), text
+
+
+def load_labels(label_path, duration=None):
+    """
+    Parses a label file into NumPy arrays of start and end times.
+
+    Blank lines, '#' comments and the '\\' frequency lines of Audacity spectral labels
+    are skipped, and so are labels with an empty text. Every problem of the file is collected
+    before raising, so a single run lists everything to fix in it.
+
+    Args:
+        label_path (str): Path to the label file.
+        duration (float): Duration of the audio in seconds, to check that every label falls inside it.
+
+    Returns:
+        tuple: (start times, end times) as float64 arrays in seconds, and the list of texts, sorted by start time.
+
+    Raises:
+        ValueError: If a line does not have three fields or its times are not numbers, a label is reversed,
+            two labels overlap, or a label ends after the audio.
+    """
+    with open(label_path, "r", encoding="utf-8-sig") as f:
+        lines = f.read().splitlines()
+
+    numbers, starts, ends, texts, problems = [], [], [], [], []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip() or line.lstrip().startswith(("#", "\\")):
+            continue
+        fields = split_label_line(line)
+        if fields is None:
+            problems.append((number, "unparsable, expected start, end and text"))
+            continue
+        start, end, text = fields
+        if not text:
+            continue
+        numbers.append(number)
+        starts.append(start)
+        ends.append(end)
+        texts.append(text)
+
+    try:
+        start_times, end_times = np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+    except ValueError:
+        # Find the lines that are not numbers, only when there are some
+        for number, start, end in zip(numbers, starts, ends):
+            try:
+                float(start), float(end)
+            except ValueError:
+                problems.append((number, f"times '{start}' and '{end}' are not numbers"))
+        raise ValueError(label_error(label_path, problems))
+
+    order = np.argsort(start_times, kind="stable")
+    numbers = np.asarray(numbers, dtype=np.int64)[order]
+    start_times, end_times, texts = start_times[order], end_times[order], [texts[i] for i in order]
+
+    checks = [
+        (~np.isfinite(start_times) | ~np.isfinite(end_times) | (start_times < 0), "time out of range"),
+        (end_times <= start_times, "label ends before it starts"),
+        (np.concatenate(([False], start_times[1:] < end_times[:-1] - OVERLAP_TOLERANCE)), "overlaps the previous label"),
+    ]
+    if duration is not None:
+        checks.append((end_times > duration + END_TOLERANCE, f"ends after the end of the audio ({duration:.2f} s)"))
+    problems.extend((int(number), message) for invalid, message in checks for number in numbers[invalid])
+    if problems:
+        raise ValueError(label_error(label_path, problems))
+
+    if duration is not None:
+        end_times = np.minimum(end_times, duration)
+    return start_times, end_times, texts
+
+
+def label_error(label_path, problems):
+    """
+    Formats the (line number, message) problems of a label file into a single error message, in line order.
+    """
+    listed = "; ".join(f"line {number}: {message}" for number, message in sorted(problems)[:MAX_REPORTED_PROBLEMS])
+    more = f" (and {len(problems) - MAX_REPORTED_PROBLEMS} more)" if len(problems) > MAX_REPORTED_PROBLEMS else ""
+    return f"Invalid labels in {label_path}: {listed}{more}"
+
+
+def label_offsets(start_times, end_times, sample_rate):
+    """
+    Converts label times to (start_sample, end_sample) offsets, all at once.
+
+    Returns:
+        tuple: int64 arrays of the first frame and of the frame just past the end of each label.
+    """
+    return (
+        np.rint(start_times * sample_rate).astype(np.int64),
+        np.rint(end_times * sample_rate).astype(np.int64),
+    )
@@ -0,0 +1,103 @@
+import os
+import json
+import tempfile
+
+from audio_cache import content_hash
+
+
+# Name of the manifest file written next to the outputs of a build
+MANIFEST_NAME = "manifest.json"
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Returns the size, modification time and content hash of a file.
+
+    The hash of `previous` is reused when size and modification time did not change,
+    so unchanged files are not read again.
+
+    Args:
+        path (str): File to fingerprint.
+        previous (dict): Fingerprint of the same file from the last build.
+
+    Returns:
+        dict: {'size', 'mtime', 'sha256'}.
+    """
+    stat = os.stat(path)
+    if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns:
+        return dict(previous)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": content_hash(path)}
+
+
+def source_fingerprint(audio_path, transcript_path, previous=None):
+    """
+    Fingerprints the audio/transcript pair of a source, reusing the hashes of its previous manifest entry.
+    """
+    previous = previous or {}
+    return {
+        "audio": file_fingerprint(audio_path, previous.get("audio")),
+        "transcript": file_fingerprint(transcript_path, previous.get("transcript")),
+    }
+
+
+def empty_manifest():
+    """
+    Returns the manifest of a build that never ran, which makes every source new.
+    """
+    return {"params": None, "sources": {}}
+
+
+def load_manifest(path):
+    """
+    Loads a build manifest, or returns an empty one if there was no previous build.
+    """
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    """
+    Atomically writes a build manifest, so an interrupted build never leaves a truncated one.
+    """
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def same_content(old, new):
+    """
+    Tells whether two source fingerprints describe the same audio and transcript content.
+    """
+    return all(old.get(name, {}).get("sha256") == new[name]["sha256"] for name in ("audio", "transcript"))
+
+
+def plan_rebuild(manifest, fingerprints, params):
+    """
+    Compares the current sources with the last build and lists the work to do.
+
+    Every source is rebuilt when the build parameters changed.
+
+    Args:
+        manifest (dict): Manifest of the last build.
+        fingerprints (dict): Current fingerprint of each source, by source id.
+        params (dict): Parameters of the current build.
+
+    Returns:
+        tuple: (source ids to (re)process, source ids to remove, source ids to keep as they are).
+    """
+    previous = manifest["sources"] if manifest["params"] == params else {}
+
+    to_process, to_keep = [], []
+    for source, fingerprint in sorted(fingerprints.items()):
+        if source in previous and same_content(previous[source], fingerprint):
+            to_keep.append(source)
+        else:
+            to_process.append(source)
+
+    removed = sorted(set(manifest["sources"]) - set(fingerprints))
+    return to_process, removed, to_keep
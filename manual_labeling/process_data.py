@@ -1,82 +1,283 @@
 import os
+import sys
 import argparse
 import pandas as pd
 from pydub import AudioSegment
-from datasets import Dataset, Audio
+from datasets import Dataset, Audio, Features, Value
 
+# Shared modules live at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from virtual_segments import with_segment_audio
+from audio_cache import DEFAULT_MAX_CACHE_BYTES, audio_info, decode_audio, load_audio
+from audio_io import CLIP_FORMATS, with_pcm_audio
+from clip_writer import DEFAULT_WRITER_THREADS, ClipWriter
+from clip_stats import STATS_COLUMNS
+from label_loader import label_offsets, load_labels
+from silence_detection import audiosegment_to_array
+from manifest import MANIFEST_NAME, empty_manifest, load_manifest, plan_rebuild, save_manifest, source_fingerprint
+from shard_writer import DEFAULT_SHARD_SIZE, SHARD_FORMATS, load_shards, write_shards
+from run_report import add_report_arguments, file_context, report_from_args, save_report, stage
 
-def process_audio_and_transcripts(audio_dir, transcript_dir, output_dir):
+
+def process_recording(audio_path, transcript_path, output_dir, output_mode="wav", cache_dir=None,
+                      max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, sampling_rate=None, audio_format="wav", writer=None,
+                      report=None):
+    """
+    Cuts the labeled lines of a single recording into clips (or virtual segments).
+
+    The label file is parsed and validated whole (see label_loader.load_labels), and the
+    sample offsets of every label are computed at once, before any clip is cut. Clips are
+    slices of the decoded recording handed to `writer`, which encodes them and computes their
+    audio statistics in background threads: clips are only guaranteed to be on disk, and rows
+    to have their STATS_COLUMNS, once its futures are done.
+
+    Args:
+        audio_path (str): Path to the original audio file.
+        transcript_path (str): Path to its transcript file with timestamps.
+        output_dir (str): Directory where the processed audio clips will be saved.
+        output_mode (str): 'wav' to export a clip per line, or 'offsets' to only record the
+            (start_sample, end_sample) of each line in the original audio, without decoding it.
+        cache_dir (str): Decoded-audio cache shared with the other scripts (None decodes with pydub every time).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        sampling_rate (int): Resample the whole recording to this rate once, before cutting the clips.
+        audio_format (str): Encoding of the clips: 'wav', 'flac' or 'pcm' (headerless 16-bit samples).
+        writer (ClipWriter): Writer the clips are queued on (required unless output_mode is 'offsets').
+        report (RunReport): Run report the 'decode' and 'cut' stages and the counts of the recording are added to.
+
+    Raises:
+        ValueError: If the label file is malformed, or its labels overlap or fall outside the audio.
+
+    Returns:
+        List[Dict]: A list of dictionaries where each entry contains the path to an audio clip (or its offsets) and its transcription,
+            plus the STATS_COLUMNS of each clip (offsets get theirs when they are materialized).
+    """
+    audio_filename = os.path.splitext(os.path.basename(audio_path))[0]
+    data = []
+
+    with stage(report, "decode"):
+        if output_mode == "offsets":
+            # Only the header is read: clips are cut from the source when rows are accessed
+            sample_rate, num_frames = audio_info(audio_path, cache_dir)
+        elif cache_dir:
+            # Memory-map the decoded (and resampled) audio, decoding it only on the first run
+            samples, sample_rate = load_audio(audio_path, cache_dir, sampling_rate, max_cache_bytes)
+        elif sampling_rate or audio_format != "wav":
+            # Decode and resample the whole recording in one batch, so every clip is a plain slice at the target rate
+            samples, sample_rate = decode_audio(audio_path, sampling_rate)
+        else:
+            # Automatically detect the file type based on the extension
+            audio = AudioSegment.from_file(audio_path)  # Instead of from_wav(), use from_file() for format detection
+            samples, sample_rate = audiosegment_to_array(audio), audio.frame_rate
+        if output_mode != "offsets":
+            num_frames = len(samples)
+
+    with stage(report, "cut"):
+        start_times, end_times, transcriptions = load_labels(transcript_path, num_frames / sample_rate)
+        start_samples, end_samples = label_offsets(start_times, end_times, sample_rate)
+
+        if output_mode == "offsets":
+            source_path = os.path.abspath(audio_path)
+            data = [
+                {
+                    "source_id": audio_filename,
+                    "source_path": source_path,
+                    "start_sample": int(start_sample),
+                    "end_sample": int(end_sample),
+                    "sampling_rate": sample_rate,
+                    "transcription": transcription,
+                    "audio_duration": float(end_time - start_time)
+                }
+                for start_sample, end_sample, start_time, end_time, transcription
+                in zip(start_samples, end_samples, start_times, end_times, transcriptions)
+            ]
+        else:
+            for start_sample, end_sample, start_time, end_time, transcription in zip(
+                start_samples, end_samples, start_times, end_times, transcriptions
+            ):
+                # Queue the clip (a view on the decoded recording) for writing to the output directory
+                clip = samples[start_sample:end_sample]
+                clip_filename = f"{audio_filename}_{float(start_time) * 1000}_{float(end_time) * 1000}.{audio_format}"
+                clip_filepath = os.path.join(output_dir, clip_filename)
+
+                # Store the audio file path and its transcription; the writer adds the audio statistics of the clip
+                row = {
+                    "audio": clip_filepath,
+                    "transcription": transcription,
+                    "audio_duration": float(end_time - start_time),
+                }
+                if audio_format == "pcm":
+                    # Headerless clips need their format next to them
+                    row.update({"sampling_rate": sample_rate, "num_channels": samples.shape[1]})
+                writer.submit(clip, sample_rate, clip_filepath, audio_format, row, transcription)
+                data.append(row)
+
+    if report is not None:
+        report.record(audio_seconds=num_frames / sample_rate, segments=len(data))
+    return data
+
+
+def process_audio_and_transcripts(audio_dir, transcript_dir, output_dir, output_mode="wav", cache_dir=None,
+                                  max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, full_rebuild=False, sampling_rate=None,
+                                  audio_format="wav", writer_threads=DEFAULT_WRITER_THREADS, report=None):
     """
     Processes audio and corresponding transcript files to create audio clips and transcriptions.
+
+    A manifest of the audio/transcript fingerprints is kept in `output_dir`, so a rerun only
+    cuts the recordings that were added or changed since the last build, and deletes the
+    clips of changed or removed ones. The rows of unchanged recordings come from the manifest.
+
+    A recording without a transcript, with an invalid label file or that cannot be decoded
+    is reported and skipped (and retried by the next run) instead of stopping the run.
     
     Args:
         audio_dir (str): Directory where the original audio files are stored.
         transcript_dir (str): Directory where the transcript files with timestamps are stored.
         output_dir (str): Directory where the processed audio clips will be saved.
+        output_mode (str): 'wav' to export a clip per line, or 'offsets' to only record the
+            (start_sample, end_sample) of each line in the original audio, without decoding it.
+        cache_dir (str): Decoded-audio cache shared with the other scripts (None decodes with pydub every time).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        full_rebuild (bool): Ignore the manifest and process every recording.
+        sampling_rate (int): Resample each recording to this rate once, before cutting its clips.
+        audio_format (str): Encoding of the clips: 'wav', 'flac' or 'pcm'.
+        writer_threads (int): Number of threads encoding clips while the next recording is decoded.
+        report (RunReport): Run report the stages of every recording are timed in. Clips are encoded in
+            the background, so 'encode' is the time spent waiting for the clips of a recording.
     
     Returns:
-        List[Dict]: A list of dictionaries where each entry contains the path to an audio clip and its transcription.
+        List[Dict]: A list of dictionaries where each entry contains the path to an audio clip (or its offsets) and its transcription.
     """
-    audio_files = os.listdir(audio_dir)
-    data = []
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous_manifest = load_manifest(manifest_path)
+    manifest = empty_manifest() if full_rebuild else previous_manifest
 
-    for audio_file in audio_files:
+    fingerprints, paths, failures = {}, {}, {}
+    for audio_file in sorted(os.listdir(audio_dir)):
         audio_path = os.path.join(audio_dir, audio_file)
-        # Automatically detect the file type based on the extension
-        audio = AudioSegment.from_file(audio_path)  # Instead of from_wav(), use from_file() for format detection
         audio_filename = os.path.splitext(audio_file)[0]
-
         transcript_path = os.path.join(transcript_dir, f'{audio_filename}.txt')
+        if os.path.isdir(audio_path):
+            continue
+        if not os.path.exists(transcript_path):
+            report_failure(failures, report, audio_file, f"no transcript at {transcript_path}")
+            continue
+        paths[audio_file] = (audio_path, transcript_path)
+        with file_context(report, audio_file), stage(report, "fingerprint"):
+            fingerprints[audio_file] = source_fingerprint(audio_path, transcript_path, manifest["sources"].get(audio_file))
 
-        with open(transcript_path, 'r') as f:
-            for line in f:
-                # Parsing the start time, end time, and transcription from the .txt file
-                #print(f"\n\n==============DEBUGG=============> line: {line}")
-                #print(f"\n\n==============DEBUGG=============> file: {audio_file}")
+    # Rows built without the current statistics columns are rebuilt too
+    params = {"output_mode": output_mode, "stats": STATS_COLUMNS}
+    if sampling_rate or audio_format != "wav":
+        params.update({"sampling_rate": sampling_rate, "audio_format": audio_format})
+    to_process, removed, to_keep = plan_rebuild(manifest, fingerprints, params)
+    print(f"Processing {len(to_process)} new or changed recordings, removing {len(removed)}, keeping {len(to_keep)}")
 
-                start_time, end_time, transcription = line.strip().split('\t', 2)
+    # Delete the clips that no longer match their recording (all of them on a full rebuild)
+    for audio_file, entry in previous_manifest["sources"].items():
+        if audio_file not in to_keep:
+            for row in entry["rows"]:
+                if "audio" in row and os.path.exists(row["audio"]):
+                    os.remove(row["audio"])
 
-                # Convert start and end times from seconds to milliseconds
-                start_time_ms = float(start_time) * 1000
-                end_time_ms = float(end_time) * 1000
+    sources = {audio_file: {**manifest["sources"][audio_file], **fingerprints[audio_file]} for audio_file in to_keep}
+    with ClipWriter(writer_threads) as writer:
+        previous_file, previous_clips = None, []
+        for audio_file in to_process:
+            with file_context(report, audio_file):
+                try:
+                    rows = process_recording(
+                        *paths[audio_file], output_dir, output_mode, cache_dir, max_cache_bytes, sampling_rate, audio_format,
+                        writer, report
+                    )
+                except Exception as error:
+                    # Labels are validated before any clip is queued, so a bad recording leaves nothing behind
+                    report_failure(failures, report, audio_file, str(error))
+                    continue
+            sources[audio_file] = {**fingerprints[audio_file], "rows": rows}
 
-                # Extract audio clip
-                audio_clip = audio[start_time_ms:end_time_ms]
+            # The clips of the previous recording were written while this one was decoded and cut:
+            # save progress up to it, so an interrupted run resumes where it stopped
+            if previous_clips:
+                with file_context(report, previous_file), stage(report, "encode"):
+                    ClipWriter.wait(previous_clips)
+            previous_file, previous_clips = audio_file, writer.take()
+            with stage(report, "save_manifest"):
+                save_manifest(manifest_path, {
+                    "params": params,
+                    "sources": {source: entry for source, entry in sources.items() if source != audio_file}
+                })
+        if previous_clips:
+            with file_context(report, previous_file), stage(report, "encode"):
+                ClipWriter.wait(previous_clips)
+    with stage(report, "save_manifest"):
+        save_manifest(manifest_path, {"params": params, "sources": sources})
 
-                # Save the clipped audio segment to output directory
-                clip_filename = f"{audio_filename}_{start_time_ms}_{end_time_ms}.wav"
-                clip_filepath = os.path.join(output_dir, clip_filename)
-                audio_clip.export(clip_filepath, format="wav")
+    if failures:
+        print(f"Skipped {len(failures)} recordings, fix them and run again:")
+        for audio_file, error in failures.items():
+            print(f"  {audio_file}: {error}")
 
-                # Store the audio file path and its transcription
-                data.append({
-                    "audio": clip_filepath,
-                    "transcription": transcription.strip('"'),
-                    "audio_duration": float(end_time) - float(start_time)
-                })
+    return [row for audio_file in sorted(sources) for row in sources[audio_file]["rows"]]
 
-    return data
 
+def report_failure(failures, report, audio_file, error):
+    """
+    Records that a recording was skipped, and why, in `failures` and in the run report.
+    """
+    failures[audio_file] = error
+    print(f"Skipping {audio_file}: {error}")
+    if report is not None:
+        report.record(audio_file, error=error)
 
 
-def create_hf_dataset(data, output_dataset_path):
+def create_hf_dataset(data, output_dataset_path, shard_size=None, num_workers=1, shard_format="parquet",
+                      sampling_rate=16000, duration_buckets=None):
     """
     Creates a Hugging Face Dataset from the processed audio-transcription pairs.
     
     Args:
         data (List[Dict]): A list of dictionaries with keys 'audio' and 'transcription'.
         output_dataset_path (str): Path to save the Hugging Face dataset.
+        shard_size (int): Stream the clips into shards of this many rows with their WAV bytes
+            embedded, instead of going through pandas and save_to_disk.
+        num_workers (int): Number of processes writing shards in parallel.
+        shard_format (str): 'parquet' or 'arrow' shards.
+        sampling_rate (int): Rate the 'audio' column is decoded at (no resampling happens if the clips already are at this rate).
+        duration_buckets (list): Upper bounds in seconds of the duration buckets of the shards: clips are
+            written sorted by duration, one set of shards per bucket.
     
     Returns:
         Dataset: The Hugging Face Dataset object created from the data.
     """
+    pcm_clips = bool(data) and "num_channels" in data[0]
+    if shard_size and data and "audio" in data[0] and not pcm_clips:
+        features = Features({
+            "audio": Audio(sampling_rate=sampling_rate),
+            "transcription": Value("string"),
+            "audio_duration": Value("float64"),
+            **{name: Value("float64") for name in STATS_COLUMNS},
+        })
+        write_shards(
+            iter(data), output_dataset_path, features, shard_size, num_workers, shard_format,
+            duration_column="audio_duration", duration_buckets=duration_buckets
+        )
+        return load_shards(output_dataset_path)
 
     # Convert the list of dictionaries into a Pandas DataFrame
     df = pd.DataFrame(data)
 
     # Create the Hugging Face Dataset from the DataFrame
     dataset = Dataset.from_pandas(df)
-    dataset = dataset.cast_column("audio", Audio(sampling_rate=16000))
+    if "audio" not in dataset.column_names:
+        # Virtual segments: save the offsets, and decode them lazily when rows are accessed
+        dataset.save_to_disk(output_dataset_path)
+        return with_segment_audio(dataset)
+    if pcm_clips:
+        # Headerless clips: the samples are read as they are when rows are accessed
+        dataset.save_to_disk(output_dataset_path)
+        return with_pcm_audio(dataset)
+
+    dataset = dataset.cast_column("audio", Audio(sampling_rate=sampling_rate))
 
     # Save the dataset to the specified path
     dataset.save_to_disk(output_dataset_path)
@@ -84,7 +285,10 @@ def create_hf_dataset(data, output_dataset_path):
     return dataset
 
 
-def main(audio_dir, transcript_dir, output_dir, output_dataset_path):
+def main(audio_dir, transcript_dir, output_dir, output_dataset_path, output_mode="wav", cache_dir=None,
+         max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, full_rebuild=False, shard_size=None, num_workers=1,
+         shard_format="parquet", sampling_rate=None, audio_format="wav", writer_threads=DEFAULT_WRITER_THREADS,
+         report=None, duration_buckets=None):
     """
     Main function to process audio and transcripts, and generate a Hugging Face Dataset.
     
@@ -93,6 +297,20 @@ def main(audio_dir, transcript_dir, output_dir, output_dataset_path):
         transcript_dir (str): Directory containing the transcript files with timestamps.
         output_dir (str): Directory to save the clipped audio segments.
         output_dataset_path (str): Path to save the final Hugging Face dataset.
+        output_mode (str): 'wav' to export clips, or 'offsets' to store virtual segments
+            (write the clips later with virtual_segments.py before publishing).
+        cache_dir (str): Decoded-audio cache directory (None disables the cache).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        full_rebuild (bool): Reprocess every recording instead of only the ones changed since the last run.
+        shard_size (int): Write the dataset as shards of this many rows with embedded audio (None uses save_to_disk).
+        num_workers (int): Number of processes writing shards in parallel.
+        shard_format (str): 'parquet' or 'arrow' shards.
+        sampling_rate (int): Resample each recording once to this rate and store the clips at it
+            (None keeps the source rate and lets the dataset resample to 16 kHz on access).
+        audio_format (str): Encoding of the clips: 'wav', 'flac' or 'pcm' (headerless 16-bit samples).
+        writer_threads (int): Number of threads encoding clips in-process.
+        report (RunReport): Run report the stages of the run are timed in.
+        duration_buckets (list): Upper bounds in seconds of the duration buckets of the shards (shards only).
     """
     # Ensure output directory exists
     if not os.path.exists(output_dir):
@@ -100,11 +318,17 @@ def main(audio_dir, transcript_dir, output_dir, output_dataset_path):
 
     # Process audio and transcripts
     print(f"Processing audio files from '{audio_dir}' and corresponding transcripts from '{transcript_dir}'...")
-    data = process_audio_and_transcripts(audio_dir, transcript_dir, output_dir)
+    data = process_audio_and_transcripts(
+        audio_dir, transcript_dir, output_dir, output_mode, cache_dir, max_cache_bytes, full_rebuild,
+        sampling_rate, audio_format, writer_threads, report
+    )
 
     # Create Hugging Face dataset
     print(f"Creating Hugging Face dataset at '{output_dataset_path}'...")
-    dataset = create_hf_dataset(data, output_dataset_path)
+    with stage(report, "write_dataset"):
+        dataset = create_hf_dataset(
+            data, output_dataset_path, shard_size, num_workers, shard_format, sampling_rate or 16000, duration_buckets
+        )
 
     print("Dataset creation complete!")
     print(dataset)
@@ -117,8 +341,30 @@ if __name__ == "__main__":
     parser.add_argument('--transcript_dir', type=str, required=True, help="Directory containing the transcript files.")
     parser.add_argument('--output_dir', type=str, required=True, help="Directory to save the processed audio clips.")
     parser.add_argument('--output_dataset_path', type=str, required=True, help="Path to save the Hugging Face dataset.")
+    parser.add_argument('--output_mode', type=str, default="wav", choices=["wav", "offsets"], help="Export a WAV clip per line, or only store sample offsets into the original audio.")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Directory of the decoded-audio cache shared by all the scripts (default: no cache).")
+    parser.add_argument('--cache_size_gb', type=float, default=DEFAULT_MAX_CACHE_BYTES / 1024 ** 3, help="Size limit of the decoded-audio cache in GB (default: 20).")
+    parser.add_argument('--full_rebuild', action="store_true", help="Reprocess every recording instead of only the ones changed since the last run.")
+    parser.add_argument('--sampling_rate', type=int, default=None, help="Resample each recording once to this rate (e.g. 16000) and store the clips at it, so loading them never resamples (default: source rate).")
+    parser.add_argument('--audio_format', type=str, default="wav", choices=CLIP_FORMATS, help="Encoding of the clips: 16-bit WAV, FLAC or headerless PCM (default: wav).")
+    parser.add_argument('--writer_threads', type=int, default=DEFAULT_WRITER_THREADS, help=f"Number of threads encoding clips (default: {DEFAULT_WRITER_THREADS}).")
+    parser.add_argument('--shard_size', type=int, default=None, help=f"Write the dataset as shards of this many clips with embedded audio, e.g. {DEFAULT_SHARD_SIZE} (default: save_to_disk).")
+    parser.add_argument('--num_workers', type=int, default=1, help="Number of processes writing shards in parallel (default: 1).")
+    parser.add_argument('--shard_format', type=str, default="parquet", choices=SHARD_FORMATS, help="Format of the shards (default: parquet).")
+    parser.add_argument('--duration_buckets', type=float, nargs="+", default=None, help="With --shard_size, write the clips sorted by duration into one set of shards per bucket, given the upper bounds in seconds (e.g. 5 10 15 20).")
+
+    add_report_arguments(parser)
 
     args = parser.parse_args()
+    if args.duration_buckets and not args.shard_size:
+        parser.error("--duration_buckets needs --shard_size")
+    report = report_from_args(args)
 
     # Execute the main function with provided arguments
-    main(args.audio_dir, args.transcript_dir, args.output_dir, args.output_dataset_path)
\ No newline at end of file
+    main(
+        args.audio_dir, args.transcript_dir, args.output_dir, args.output_dataset_path, args.output_mode,
+        args.cache_dir, int(args.cache_size_gb * 1024 ** 3), args.full_rebuild,
+        args.shard_size, args.num_workers, args.shard_format, args.sampling_rate, args.audio_format,
+        args.writer_threads, report, args.duration_buckets
+    )
+    save_report(report, args)
\ No newline at end of file
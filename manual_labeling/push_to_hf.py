@@ -1,17 +1,23 @@
 import os
-from datasets import Dataset, DatasetDict
-from huggingface_hub import HfApi
+import sys
+import argparse
 from dotenv import load_dotenv
 
+# Shared modules live at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from publish import add_publish_arguments, publish_from_args
+
 load_dotenv()
 HF_TOKEN = os.getenv("HF_TOKEN")
 
-dataset_path = "./processed_data" 
-dataset = Dataset.load_from_disk(dataset_path)
-
-api = HfApi(token=HF_TOKEN)
+parser = argparse.ArgumentParser(description="Push a processed dataset to the Hugging Face Hub, uploading only the shards that changed.")
+parser.add_argument("--dataset_path", type=str, default="./processed_data", help="Dataset to push: save_to_disk or shard folder, e.g. the output of merge_datasets.py (default: ./processed_data).")
+add_publish_arguments(parser)
+args = parser.parse_args()
 
-repo_id = "ArissBandoss/bible-moore-audios"
-dataset.push_to_hub(repo_id)
+publish_from_args(args, HF_TOKEN)
 
-print(f"Dataset successfully pushed to Hugging Face Hub at: https://huggingface.co/{repo_id}")
+if args.local_dir:
+    print(f"Dataset successfully published to {args.local_dir}")
+else:
+    print(f"Dataset successfully pushed to Hugging Face Hub at: https://huggingface.co/datasets/{args.repo_id}")
@@ -0,0 +1,161 @@
+import os
+import hashlib
+import argparse
+from datasets import Audio, Dataset, concatenate_datasets
+
+from audio_cache import content_hash
+from shard_writer import is_sharded, load_shards
+
+
+# Column names used by the merged dataset for the columns each script names its own way
+COLUMN_ALIASES = {
+    "transcript": "transcription",
+    "duration": "audio_duration",
+}
+
+# Column holding the name of the corpus each row comes from
+SOURCE_COLUMN = "source"
+
+
+def load_corpus(dataset_path):
+    """
+    Loads a dataset saved by prepare_data.py or manual_labeling/process_data.py, memory-mapped.
+
+    Args:
+        dataset_path (str): save_to_disk folder or shard folder.
+
+    Returns:
+        Dataset: The dataset, backed by its Arrow files on disk.
+    """
+    if is_sharded(dataset_path):
+        return load_shards(dataset_path)
+    return Dataset.load_from_disk(dataset_path)
+
+
+def harmonize(dataset, source, sampling_rate=None):
+    """
+    Renames the columns of a corpus to the names of the merged dataset and adds its source column.
+
+    Only the schema changes: the audio column is cast to an Audio feature with
+    the same storage, so no audio is decoded or copied.
+
+    Args:
+        dataset (Dataset): Corpus to harmonize.
+        source (str): Name of the corpus, stored in the source column.
+        sampling_rate (int): Rate the merged 'audio' column is decoded at (None keeps the source rate).
+
+    Returns:
+        Dataset: The harmonized corpus.
+    """
+    if not isinstance(dataset.features.get("audio"), Audio):
+        raise ValueError(
+            f"Corpus '{source}' has no encoded 'audio' column: materialize virtual segments "
+            "or rebuild PCM clips as wav/flac before merging."
+        )
+
+    dataset = dataset.rename_columns({
+        old: new for old, new in COLUMN_ALIASES.items() if old in dataset.column_names and new not in dataset.column_names
+    })
+    dataset = dataset.cast_column("audio", Audio(sampling_rate=sampling_rate, decode=False))
+    if SOURCE_COLUMN in dataset.column_names:
+        dataset = dataset.remove_columns(SOURCE_COLUMN)
+    return dataset.add_column(SOURCE_COLUMN, [source] * len(dataset))
+
+
+def align_columns(datasets):
+    """
+    Gives every corpus the union of their columns, in the same order, with missing columns filled with nulls.
+    """
+    features = {}
+    for dataset in datasets:
+        for name, feature in dataset.features.items():
+            features.setdefault(name, feature)
+
+    aligned = []
+    for dataset in datasets:
+        for name, feature in features.items():
+            if name not in dataset.column_names:
+                dataset = dataset.add_column(name, [None] * len(dataset), feature=feature)
+        aligned.append(dataset.select_columns(list(features)))
+    return aligned
+
+
+def audio_hashes(dataset, batch_size=1000):
+    """
+    Yields the SHA-256 of the encoded audio of each row, reading the Arrow buffers without decoding them.
+
+    Rows whose audio is stored as a path are hashed from the file, so an embedded
+    clip and the file it was read from get the same hash. Rows without audio (no bytes
+    and no path, which the nullable audio column allows) yield None.
+    """
+    for batch in dataset.select_columns("audio").with_format("arrow").iter(batch_size):
+        audio = batch.column("audio").combine_chunks()
+        data, paths = audio.field("bytes"), audio.field("path")
+        for i in range(len(audio)):
+            if audio[i].is_valid and data[i].is_valid and len(data[i].as_buffer()):
+                yield hashlib.sha256(data[i].as_buffer()).hexdigest()
+            elif audio[i].is_valid and paths[i].as_py():
+                yield content_hash(paths[i].as_py())
+            else:
+                yield None
+
+
+def merge_datasets(dataset_paths, sources=None, dedup=True, sampling_rate=None):
+    """
+    Concatenates several corpora into one dataset at the Arrow-table level.
+
+    Columns are harmonized ('transcript' becomes 'transcription' and 'duration'
+    becomes 'audio_duration'), a 'source' column records the corpus of each row,
+    and rows whose audio has the same content hash as an earlier row are dropped.
+    No audio is decoded or re-encoded: the tables are memory-mapped and concatenated
+    as they are.
+
+    Args:
+        dataset_paths (list): Folders of the datasets to merge, in order.
+        sources (list): Name of each corpus (default: the folder names).
+        dedup (bool): Drop the rows whose audio is already in an earlier row.
+        sampling_rate (int): Rate the merged 'audio' column is decoded at (None keeps the source rates).
+
+    Returns:
+        Dataset: The merged dataset.
+    """
+    sources = sources or [os.path.basename(os.path.normpath(path)) for path in dataset_paths]
+    if len(sources) != len(dataset_paths):
+        raise ValueError("Give one source name per dataset")
+
+    datasets = [harmonize(load_corpus(path), source, sampling_rate) for path, source in zip(dataset_paths, sources)]
+    merged = concatenate_datasets(align_columns(datasets))
+
+    if dedup:
+        seen, keep, no_audio = set(), [], 0
+        for i, key in enumerate(audio_hashes(merged)):
+            if key is None:
+                # Nothing to compare: keep the row, it is not a duplicate of anything
+                no_audio += 1
+                keep.append(i)
+            elif key not in seen:
+                seen.add(key)
+                keep.append(i)
+        if no_audio:
+            print(f"Warning: {no_audio} rows have no audio (neither bytes nor path) and were not deduplicated")
+        if len(keep) < len(merged):
+            print(f"Dropping {len(merged) - len(keep)} duplicate clips")
+            merged = merged.select(keep)
+
+    return merged.cast_column("audio", Audio(sampling_rate=sampling_rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge datasets built by the different scripts into a single dataset.")
+
+    parser.add_argument("--dataset_paths", type=str, nargs="+", required=True, help="Folders of the datasets to merge (save_to_disk or shard folders).")
+    parser.add_argument("--sources", type=str, nargs="+", default=None, help="Name of each corpus in the 'source' column (default: the folder names).")
+    parser.add_argument("--output_path", type=str, required=True, help="Path to save the merged dataset.")
+    parser.add_argument("--no_dedup", action="store_true", help="Keep the rows whose audio is identical to an earlier row.")
+    parser.add_argument("--sampling_rate", type=int, default=None, help="Sampling rate the merged 'audio' column is decoded at (default: source rate).")
+
+    args = parser.parse_args()
+
+    dataset = merge_datasets(args.dataset_paths, args.sources, not args.no_dedup, args.sampling_rate)
+    dataset.save_to_disk(args.output_path)
+    print(f"{len(dataset)} rows from {len(args.dataset_paths)} corpora saved to {args.output_path}")
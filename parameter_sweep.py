@@ -0,0 +1,272 @@
+import os
+import json
+import argparse
+import numpy as np
+import soundfile as sf
+
+from audio_io import audio_source
+from audio_cache import DEFAULT_MAX_CACHE_BYTES, load_audio
+from sentence_splitter import split_sentences
+from silence_detection import dbfs_to_amplitude, max_possible_amplitude, ms_energy, window_rms, window_starts
+
+
+# Default grid: 10 thresholds x 10 minimum silence lengths
+DEFAULT_SILENCE_THRESHS = list(range(-65, -15, 5))
+DEFAULT_MIN_SILENCE_LENS = list(range(100, 1100, 100))
+
+# Upper bound on the (thresholds x windows) cells compared at once, to bound memory on long recordings
+MAX_GRID_CELLS = 1 << 24
+
+
+def count_chunks(rms, starts, thresholds, min_silence_len, seek_step, length_ms):
+    """
+    Counts the chunks split_on_silence returns for each threshold, given the RMS of every tested window.
+
+    Applies the range grouping of pydub.silence.detect_silence and the inversion of
+    detect_nonsilent to all the thresholds at once, without building any range list.
+
+    Args:
+        rms (np.ndarray): RMS of the windows starting at `starts`.
+        starts (np.ndarray): Window starts in milliseconds.
+        thresholds (np.ndarray): Silence thresholds as amplitudes.
+        min_silence_len (int): Window length in milliseconds.
+        seek_step (int): Step size in milliseconds between tested windows.
+        length_ms (int): Length of the audio in milliseconds.
+
+    Returns:
+        np.ndarray: Number of chunks for each threshold.
+    """
+    silent = rms[None, :] <= thresholds[:, None]
+    positions = np.arange(len(starts))
+
+    # Index of the previous silent window of each window, or -1
+    last_silent = np.maximum.accumulate(np.where(silent, positions, -1), axis=1)
+    previous = np.concatenate((np.full((len(thresholds), 1), -1), last_silent[:, :-1]), axis=1)
+
+    # A silent window opens a new range when it is neither contiguous with nor within reach of the previous one
+    gaps = starts[None, :] - starts[np.maximum(previous, 0)]
+    breaks = silent & (previous >= 0) & (gaps != seek_step) & (gaps > min_silence_len)
+    num_ranges = silent.any(axis=1) + breaks.sum(axis=1)
+
+    starts_at_zero = silent[:, 0]
+    ends_at_length = (last_silent[:, -1] >= 0) & (starts[np.maximum(last_silent[:, -1], 0)] + min_silence_len == length_ms)
+
+    # One chunk before each silent range (but the leading one) and one after the last range if it is not trailing
+    counts = num_ranges - starts_at_zero + ~ends_at_length
+    counts[num_ranges == 0] = 1
+    counts[(num_ranges == 1) & starts_at_zero & ends_at_length] = 0
+    return counts
+
+
+def sweep_chunk_counts(samples, sample_rate, silence_threshs, min_silence_lens, seek_step=1):
+    """
+    Counts the chunks split_on_silence would return for every (silence_thresh, min_silence_len) pair.
+
+    The per-millisecond energy envelope is computed once; each minimum silence length
+    then needs one pass over its windows, and all the thresholds are compared against
+    it at once, so the whole grid costs little more than a single segmentation.
+
+    Args:
+        samples (np.ndarray): Audio samples, shape (frames,) or (frames, channels).
+        sample_rate (int): Sampling rate of the audio.
+        silence_threshs (list): Silence thresholds in dBFS.
+        min_silence_lens (list): Minimum lengths of silence in milliseconds.
+        seek_step (int): Step size in milliseconds between tested windows.
+
+    Returns:
+        np.ndarray: Chunk counts of shape (len(silence_threshs), len(min_silence_lens)).
+    """
+    samples = samples.reshape(len(samples), -1)
+    integer_samples = np.issubdtype(samples.dtype, np.integer)
+    thresholds = dbfs_to_amplitude(silence_threshs, max_possible_amplitude(samples)).reshape(-1)
+
+    energy = ms_energy(samples, sample_rate)
+    cumulative = np.concatenate(([0], np.cumsum(energy)))
+
+    counts = np.ones((len(thresholds), len(min_silence_lens)), dtype=np.int64)
+    for j, min_silence_len in enumerate(min_silence_lens):
+        starts = window_starts(len(energy), min_silence_len, seek_step)
+        if len(starts) == 0:
+            continue  # Shorter than the window: a single chunk
+
+        rms = window_rms(cumulative, starts, sample_rate, samples.shape[1], integer_samples, min_silence_len)
+        step = max(MAX_GRID_CELLS // len(starts), 1)
+        for i in range(0, len(thresholds), step):
+            counts[i:i + step, j] = count_chunks(
+                rms, starts, thresholds[i:i + step], min_silence_len, seek_step, len(energy)
+            )
+    return counts
+
+
+def sweep_row(row, silence_threshs, min_silence_lens, text_column, cache_dir=None,
+              max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Evaluates the parameter grid on a single recording (loaded with Audio(decode=False)).
+
+    Returns:
+        dict: The source path, the number of sentences of the transcription and the chunk count of each grid point.
+    """
+    audio = row["audio"]
+    if cache_dir and not audio.get("bytes"):
+        samples, sample_rate = load_audio(audio["path"], cache_dir, max_cache_bytes=max_cache_bytes)
+    else:
+        samples, sample_rate = sf.read(audio_source(audio), dtype="int16", always_2d=True)
+
+    return {
+        "source": audio.get("path") or "",
+        "num_sentences": len(split_sentences(row[text_column])),
+        "segment_counts": sweep_chunk_counts(samples, sample_rate, silence_threshs, min_silence_lens).tolist(),
+    }
+
+
+def sweep_dataset(dataset, silence_threshs=DEFAULT_SILENCE_THRESHS, min_silence_lens=DEFAULT_MIN_SILENCE_LENS,
+                  text_column="transcription", num_workers=1, cache_dir=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Evaluates a grid of silence parameters on every recording of a dataset.
+
+    Args:
+        dataset (Dataset): Dataset with an 'audio' column and a transcription column.
+        silence_threshs (list): Silence thresholds in dBFS.
+        min_silence_lens (list): Minimum lengths of silence in milliseconds.
+        text_column (str): Name of the transcription column.
+        num_workers (int): Number of processes evaluating recordings in parallel.
+        cache_dir (str): Decoded-audio cache directory (None disables the cache).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+
+    Returns:
+        Dataset: One row per recording with 'source', 'num_sentences' and 'segment_counts' columns.
+    """
+    from datasets import Audio
+
+    dataset = dataset.cast_column("audio", Audio(decode=False))
+    return dataset.map(
+        sweep_row,
+        fn_kwargs={
+            "silence_threshs": list(silence_threshs),
+            "min_silence_lens": list(min_silence_lens),
+            "text_column": text_column,
+            "cache_dir": cache_dir,
+            "max_cache_bytes": max_cache_bytes,
+        },
+        remove_columns=dataset.column_names,
+        num_proc=num_workers if num_workers > 1 else None,
+    )
+
+
+def sweep_report(results, silence_threshs, min_silence_lens):
+    """
+    Ranks the grid points by how well their segment counts match the sentence counts.
+
+    Args:
+        results (Dataset): Output of sweep_dataset.
+        silence_threshs (list): Silence thresholds of the grid in dBFS.
+        min_silence_lens (list): Minimum silence lengths of the grid in milliseconds.
+
+    Returns:
+        dict: 'corpus' lists every grid point, best first (most exact matches, then smallest
+            total count error); 'files' gives the best grid point of each recording.
+    """
+    counts = np.array(results["segment_counts"], dtype=np.int64).reshape(len(results), len(silence_threshs), len(min_silence_lens))
+    sentences = np.array(results["num_sentences"], dtype=np.int64)
+    errors = np.abs(counts - sentences[:, None, None])
+
+    exact_matches = (errors == 0).sum(axis=0)
+    total_errors = errors.sum(axis=0)
+    order = np.lexsort((total_errors.ravel(), -exact_matches.ravel()))
+    corpus = []
+    for flat in order:
+        i, j = np.unravel_index(flat, exact_matches.shape)
+        corpus.append({
+            "silence_thresh": silence_threshs[i],
+            "min_silence_len": min_silence_lens[j],
+            "exact_matches": int(exact_matches[i, j]),
+            "total_abs_error": int(total_errors[i, j]),
+        })
+
+    files = []
+    for source, num_sentences, file_counts, file_errors in zip(results["source"], sentences, counts, errors):
+        i, j = np.unravel_index(np.argmin(file_errors), file_errors.shape)
+        files.append({
+            "source": source,
+            "num_sentences": int(num_sentences),
+            "silence_thresh": silence_threshs[i],
+            "min_silence_len": min_silence_lens[j],
+            "num_segments": int(file_counts[i, j]),
+            "abs_error": int(file_errors[i, j]),
+        })
+
+    return {"num_files": len(results), "corpus": corpus, "files": files}
+
+
+def load_folder(folder_path):
+    """
+    Loads the MP3 files of a folder and their .txt transcripts (the raw_data layout) as a dataset.
+    """
+    from datasets import Audio, Dataset
+
+    audio_paths, transcriptions = [], []
+    for filename in sorted(os.listdir(folder_path)):
+        transcript_path = os.path.join(folder_path, os.path.splitext(filename)[0] + ".txt")
+        if filename.endswith(".mp3") and os.path.exists(transcript_path):
+            with open(transcript_path, "r", encoding="utf-8") as f:
+                transcriptions.append(f.read().strip())
+            audio_paths.append(os.path.join(folder_path, filename))
+    return Dataset.from_dict({"audio": audio_paths, "transcription": transcriptions}).cast_column("audio", Audio(decode=False))
+
+
+def main():
+    """
+    Sweeps silence_thresh / min_silence_len over a corpus and reports the best settings.
+    """
+    parser = argparse.ArgumentParser(description="Find the silence parameters whose segments best match the sentence count")
+
+    # Either a local folder of MP3/TXT pairs or a Hugging Face dataset
+    parser.add_argument("--input_folder", type=str, default=None, help="Folder of MP3 files and their .txt transcripts (e.g. ./raw_data)")
+    parser.add_argument("--dataset_name", type=str, default=None, help="Name of a Hugging Face dataset with 'audio' and transcription columns")
+    parser.add_argument("--text_column", type=str, default="transcription", help="Transcription column of the Hugging Face dataset (default: transcription)")
+
+    # Grid to evaluate
+    parser.add_argument("--silence_threshs", type=int, nargs="+", default=DEFAULT_SILENCE_THRESHS, help="Silence thresholds in dBFS (default: -65 to -20 by 5)")
+    parser.add_argument("--min_silence_lens", type=int, nargs="+", default=DEFAULT_MIN_SILENCE_LENS, help="Minimum silence lengths in milliseconds (default: 100 to 1000 by 100)")
+
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes evaluating recordings in parallel (default: 1)")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of the decoded-audio cache shared by all the scripts (default: no cache)")
+    parser.add_argument("--cache_size_gb", type=float, default=DEFAULT_MAX_CACHE_BYTES / 1024 ** 3, help="Size limit of the decoded-audio cache in GB (default: 20)")
+    parser.add_argument("--report_path", type=str, default=None, help="Path to save the full report (JSON)")
+
+    args = parser.parse_args()
+    if bool(args.input_folder) == bool(args.dataset_name):
+        parser.error("exactly one of --input_folder and --dataset_name is required")
+
+    if args.input_folder:
+        dataset, text_column = load_folder(args.input_folder), "transcription"
+    else:
+        from datasets import load_dataset
+
+        dataset, text_column = load_dataset(args.dataset_name)["train"], args.text_column
+
+    print(f"Evaluating {len(args.silence_threshs) * len(args.min_silence_lens)} settings on {len(dataset)} recordings...")
+    results = sweep_dataset(
+        dataset, args.silence_threshs, args.min_silence_lens, text_column, args.num_workers,
+        args.cache_dir, int(args.cache_size_gb * 1024 ** 3)
+    )
+    report = sweep_report(results, args.silence_threshs, args.min_silence_lens)
+
+    print("\nBest setting per file:")
+    for entry in report["files"]:
+        print(f"  {os.path.basename(entry['source'])}: --silence_thresh {entry['silence_thresh']} --min_silence_len {entry['min_silence_len']} "
+              f"({entry['num_segments']} segments for {entry['num_sentences']} sentences)")
+
+    print("\nBest settings for the corpus:")
+    for entry in report["corpus"][:5]:
+        print(f"  --silence_thresh {entry['silence_thresh']} --min_silence_len {entry['min_silence_len']}: "
+              f"{entry['exact_matches']}/{report['num_files']} files match, total count error {entry['total_abs_error']}")
+
+    if args.report_path:
+        with open(args.report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"\nReport saved to {args.report_path}")
+
+
+if __name__ == "__main__":
+    main()
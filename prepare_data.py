@@ -1,54 +1,240 @@
 import os
+import csv
 import argparse
+from contextlib import nullcontext
 import pandas as pd
-import soundfile as sf
-from datasets import Dataset, Audio
+from datasets import Dataset, Audio, Features, Value
+from audio_cache import audio_info, load_audio
+from audio_io import open_audio_stream
+from clip_stats import STATS_COLUMNS, clip_stats
+from clip_writer import ClipWriter
+from segment_alignment import align_recording
+from segment_capping import pack_pairs
+from sentence_splitter import split_sentences
+from shard_writer import SHARD_FORMATS, same_layout, write_shards
+from virtual_segments import find_segment_offsets, read_segment
+from manifest import MANIFEST_NAME, empty_manifest, load_manifest, plan_rebuild, save_manifest, source_fingerprint
+from run_report import add_report_arguments, file_context, report_from_args, save_report, stage
 
 
-def process_audios(folder_path="./raw_data", output_path="./processed_data"):
-    data = []
+def process_audio(audio_path, transcript_path, cache_dir=None, report=None):
+    """
+    Builds the dataset row of a single story, with the audio statistics of clip_stats.
+    """
+    # Read transcript
+    with open(transcript_path, "r", encoding="utf-8") as f:
+        transcript = f.read().strip()
 
+    # Get audio metadata (duration, sampling rate, etc.), from the decoded-audio cache when available
+    with stage(report, "probe"):
+        sampling_rate, num_frames = audio_info(audio_path, cache_dir)
+
+    # Loudness, clipping, SNR and speaking rate, from the cache or decoded block by block
+    with stage(report, "stats"):
+        if cache_dir:
+            samples, sampling_rate = load_audio(audio_path, cache_dir)
+            blocks = [samples]
+        else:
+            sampling_rate, blocks = open_audio_stream(audio_path)
+        stats = clip_stats(blocks, sampling_rate, transcript)
+
+    return {
+        "audio": audio_path,
+        "transcript": transcript,
+        "sampling_rate": sampling_rate,
+        "duration": num_frames / sampling_rate,
+        **stats
+    }
+
+
+def process_story_clips(audio_path, transcript_path, clips_dir, max_duration, min_duration=None, cache_dir=None,
+                        writer=None, report=None):
+    """
+    Cuts a story into clips of at most `max_duration` seconds, each with its part of the transcript.
+
+    The story is split on silence, segments longer than `max_duration` are cut at their
+    lowest-energy point and fragments shorter than `min_duration` are merged, the segments
+    are aligned with the sentences of the transcript, and consecutive sentences are packed
+    into clips up to `max_duration` (a longer sentence stays whole).
+
+    Args:
+        audio_path (str): Path to the MP3 file of the story.
+        transcript_path (str): Path to its transcript.
+        clips_dir (str): Folder where the MP3 clips are written.
+        max_duration (float): Maximum duration of a clip in seconds.
+        min_duration (float): Minimum duration of a silence segment in seconds.
+        cache_dir (str): Decoded-audio cache directory (None disables the cache).
+        writer (ClipWriter): Writer the clips are queued to (None writes them before returning).
+        report (RunReport): Run report the 'decode', 'detect_silence', 'cap', 'align' and 'cut' stages are timed in.
+
+    Returns:
+        list: The dataset rows of the clips, which get their audio statistics once `writer` wrote them.
+    """
+    with open(transcript_path, "r", encoding="utf-8") as f:
+        sentences = split_sentences(f.read())
+
+    sampling_rate, segment_offsets = find_segment_offsets(audio_path, cache_dir=cache_dir, report=report)
+    pairs, _ = align_recording(
+        audio_path, segment_offsets, sentences, cache_dir, report=report, max_duration=max_duration, min_duration=min_duration
+    )
+
+    os.makedirs(clips_dir, exist_ok=True)
+    story = os.path.splitext(os.path.basename(audio_path))[0]
+    rows = []
+    with ClipWriter() if writer is None else nullcontext(writer) as clip_writer:
+        for i, clip in enumerate(pack_pairs(pairs, sampling_rate, max_duration)):
+            clip_path = os.path.join(clips_dir, f"{story}_{i}.mp3")
+            with stage(report, "cut"):
+                samples, _ = read_segment(audio_path, clip["start_sample"], clip["end_sample"], cache_dir)
+            row = {
+                "audio": clip_path,
+                "transcript": clip["sentence"],
+                "sampling_rate": sampling_rate,
+                "duration": (clip["end_sample"] - clip["start_sample"]) / sampling_rate,
+            }
+            # The audio statistics are computed by the writing thread, along with the MP3 encoding
+            clip_writer.submit(samples, sampling_rate, clip_path, "mp3", row, clip["sentence"])
+            rows.append(row)
+    return rows
+
+
+# Columns of the story dataset
+FEATURES = Features({
+    "audio": Audio(),
+    "transcript": Value("string"),
+    "sampling_rate": Value("int64"),
+    "duration": Value("float64"),
+    **{name: Value("float64") for name in STATS_COLUMNS},
+})
+
+
+def write_csv_rows(rows, csv_path):
+    """
+    Writes rows to a CSV file as they go by, and yields them on.
+    """
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(FEATURES))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            yield row
+
+
+def process_audios(folder_path="./raw_data", output_path="./processed_data", cache_dir=None, full_rebuild=False,
+                   shard_size=None, num_workers=1, shard_format="parquet", report=None, max_duration=None,
+                   min_duration=None, duration_buckets=None):
+    """
+    Builds the CSV file and the Hugging Face dataset of a folder of MP3 files and transcripts.
+
+    A manifest of the audio/transcript fingerprints is kept in the output folder, so a
+    rerun only processes the stories that were added or changed since the last build
+    and drops the removed ones. The shards are rewritten when their size, format or
+    duration buckets differ from the last build's, even if no story changed.
+
+    With `max_duration`, each story is cut into clips of at most that many seconds, in a
+    'clips' folder, with one row per clip (see process_story_clips), instead of one row
+    per story.
+
+    Args:
+        folder_path (str): Folder containing the MP3 files and their .txt transcripts.
+        output_path (str): Folder where the CSV file, the dataset and the manifest are saved.
+        cache_dir (str): Decoded-audio cache directory (None disables the cache).
+        full_rebuild (bool): Ignore the manifest and process every story.
+        shard_size (int): Stream the rows into shards of this many rows, with the MP3 bytes
+            embedded, in an 'hf_shards' folder instead of going through pandas and save_to_disk.
+        num_workers (int): Number of processes writing shards in parallel.
+        shard_format (str): 'parquet' or 'arrow' shards.
+        report (RunReport): Run report the 'fingerprint', 'probe', 'stats' and 'write_dataset' stages are timed in.
+        max_duration (float): Cut the stories into clips of at most this many seconds (None keeps whole stories).
+        min_duration (float): Merge the silence segments shorter than this (in seconds) before aligning them.
+        duration_buckets (list): Upper bounds in seconds of the duration buckets of the shards: rows are
+            written sorted by duration, one set of shards per bucket (shards only).
+    """
     # Ensure the output folder exists
     os.makedirs(output_path, exist_ok=True)
 
-    # Iterate through the files in the folder
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    previous_manifest = load_manifest(manifest_path)
+    manifest = empty_manifest() if full_rebuild else previous_manifest
+
+    # Fingerprint the audio/transcript pairs in the folder
+    fingerprints, paths = {}, {}
     for filename in os.listdir(folder_path):
         if filename.endswith(".mp3"):
             audio_path = os.path.join(folder_path, filename)
             transcript_path = os.path.join(folder_path, filename.replace(".mp3", ".txt"))
-            
-            # Read transcript
-            with open(transcript_path, "r", encoding="utf-8") as f:
-                transcript = f.read().strip()
-
-            # Get audio metadata (duration, sampling rate, etc.)
-            audio_info = sf.info(audio_path)
-            
-            data.append({
-                "audio": audio_path,
-                "transcript": transcript,
-                "sampling_rate": audio_info.samplerate,
-                "duration": audio_info.duration
-            })
-
-    # Convert to a pandas DataFrame
-    df = pd.DataFrame(data)
-
-    # Save the DataFrame to a CSV file
+            paths[filename] = (audio_path, transcript_path)
+            with file_context(report, filename), stage(report, "fingerprint"):
+                fingerprints[filename] = source_fingerprint(audio_path, transcript_path, manifest["sources"].get(filename))
+
+    # Rows built without the current statistics columns are rebuilt too
+    params = {"stats": STATS_COLUMNS}
+    if max_duration:
+        params.update({"max_duration": max_duration, "min_duration": min_duration})
+    to_process, removed, to_keep = plan_rebuild(manifest, fingerprints, params)
+
+    # Delete the clips that no longer match their story (all of them on a full rebuild or a parameter change)
+    clips_dir = os.path.join(output_path, "clips")
+    for filename, entry in previous_manifest["sources"].items():
+        if filename not in to_keep:
+            for row in entry.get("rows", []):
+                if row["audio"].startswith(clips_dir) and os.path.exists(row["audio"]):
+                    os.remove(row["audio"])
+    sources = {filename: {**manifest["sources"][filename], **fingerprints[filename]} for filename in to_keep}
+
+    dataset_path = os.path.join(output_path, "hf_shards" if shard_size else "hf_dataset")
+    up_to_date = same_layout(dataset_path, shard_size, shard_format, duration_buckets) if shard_size else os.path.exists(dataset_path)
+    if not to_process and not removed and up_to_date:
+        save_manifest(manifest_path, {"params": params, "sources": sources})
+        print(f"Nothing changed since the last build, {dataset_path} is up to date")
+        return
+    print(f"Processing {len(to_process)} new or changed stories, removing {len(removed)}, keeping {len(to_keep)}")
+
+    with ClipWriter() as writer:
+        for filename in to_process:
+            with file_context(report, filename):
+                if max_duration:
+                    rows = process_story_clips(*paths[filename], clips_dir, max_duration, min_duration, cache_dir, writer, report)
+                else:
+                    rows = [process_audio(*paths[filename], cache_dir, report)]
+            sources[filename] = {**fingerprints[filename], "rows": rows}
+            if report is not None:
+                report.record(filename, audio_seconds=sum(row["duration"] for row in rows), segments=len(rows))
+    rows = (row for filename in sorted(sources) for row in sources[filename]["rows"])
     df_csv_path = os.path.join(output_path, "processed_data.csv")
-    df.to_csv(df_csv_path, index=False)
-    print(f"DataFrame saved to {df_csv_path}")
 
-    # Convert the DataFrame into a Hugging Face Dataset
-    dataset = Dataset.from_pandas(df)
+    if shard_size:
+        # Stream the rows to the CSV file and the shards, without holding the corpus in memory
+        with stage(report, "write_dataset"):
+            index = write_shards(
+                write_csv_rows(rows, df_csv_path), dataset_path, FEATURES, shard_size, num_workers, shard_format,
+                duration_column="duration", duration_buckets=duration_buckets
+            )
+        print(f"CSV saved to {df_csv_path}")
+        print(f"{index['num_rows']} rows saved to {len(index['shards'])} shards in {dataset_path}")
+        save_manifest(manifest_path, {"params": params, "sources": sources})
+        return
+
+    with stage(report, "write_dataset"):
+        # Convert to a pandas DataFrame
+        df = pd.DataFrame(list(rows))
+
+        # Save the DataFrame to a CSV file
+        df.to_csv(df_csv_path, index=False)
+        print(f"DataFrame saved to {df_csv_path}")
+
+        # Convert the DataFrame into a Hugging Face Dataset
+        dataset = Dataset.from_pandas(df)
+
+        # Format the "audio" column to contain actual audio data
+        dataset = dataset.cast_column("audio", Audio())
 
-    # Format the "audio" column to contain actual audio data
-    dataset = dataset.cast_column("audio", Audio())
+        # Save the dataset to disk
+        dataset.save_to_disk(dataset_path)
+        print(f"Hugging Face dataset saved to {dataset_path}")
 
-    # Save the dataset to disk
-    dataset_path = os.path.join(output_path, "hf_dataset")
-    dataset.save_to_disk(dataset_path)
-    print(f"Hugging Face dataset saved to {dataset_path}")
+    # Record what was built, only once every output is written
+    save_manifest(manifest_path, {"params": params, "sources": sources})
 
 
 if __name__ == "__main__":
@@ -57,9 +243,26 @@ if __name__ == "__main__":
     
     parser.add_argument("--input_folder", type=str, required=True, help="Path to the folder containing MP3 files and transcripts.")
     parser.add_argument("--output_folder", type=str, required=True, help="Path to the folder where the processed data should be saved.")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of the decoded-audio cache shared by all the scripts (default: no cache).")
+    parser.add_argument("--full_rebuild", action="store_true", help="Reprocess every story instead of only the ones changed since the last build.")
+    parser.add_argument("--shard_size", type=int, default=None, help="Write the dataset as shards of this many rows with embedded audio, in an hf_shards folder (default: save_to_disk).")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of processes writing shards in parallel (default: 1).")
+    parser.add_argument("--shard_format", type=str, default="parquet", choices=SHARD_FORMATS, help="Format of the shards (default: parquet).")
+    parser.add_argument("--max_duration", type=float, default=None, help="Cut the stories into aligned clips of at most this many seconds, e.g. 20 (default: one row per story).")
+    parser.add_argument("--min_duration", type=float, default=None, help="With --max_duration, merge silence segments shorter than this many seconds before aligning (default: keep them).")
+    parser.add_argument("--duration_buckets", type=float, nargs="+", default=None, help="With --shard_size, write the rows sorted by duration into one set of shards per bucket, given the upper bounds in seconds (e.g. 5 10 15 20).")
+    add_report_arguments(parser)
     
     # Parse command-line arguments
     args = parser.parse_args()
+    if args.duration_buckets and not args.shard_size:
+        parser.error("--duration_buckets needs --shard_size")
+    report = report_from_args(args)
     
     # Call the processing function
-    process_audios(args.input_folder, args.output_folder)
+    process_audios(
+        args.input_folder, args.output_folder, args.cache_dir, args.full_rebuild,
+        args.shard_size, args.num_workers, args.shard_format, report,
+        args.max_duration, args.min_duration, args.duration_buckets
+    )
+    save_report(report, args)
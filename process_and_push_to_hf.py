@@ -1,14 +1,18 @@
-import os
 import argparse
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
-from datasets import load_dataset, Dataset
-import nltk
-from huggingface_hub import login  # To authenticate with Hugging Face Hub
+import soundfile as sf
+from silence_detection import audiosegment_to_array, split_on_silence, stream_split_on_silence
+from audio_io import DEFAULT_BLOCK_DURATION, audio_source, open_audio_stream
+from audio_cache import DEFAULT_MAX_CACHE_BYTES, load_audio
+from segment_alignment import DEFAULT_MIN_CONFIDENCE
+from row_segmentation import export_chunks, file_stem, process_dataset
+from run_report import add_report_arguments, report_from_args, save_report, stage, timed
 
-nltk.download('punkt')  # Download the tokenizer for sentence splitting
+# datasets, pydub and huggingface_hub are imported where they are used, so that the
+# CLI starts (and --help answers) without loading them
 
-def split_audio_on_silence(audio_path, silence_thresh=-50, min_silence_len=500, output_folder="segments"):
+def split_audio_on_silence(audio_path, silence_thresh=-50, min_silence_len=500, output_folder="segments",
+                           streaming=False, block_duration=DEFAULT_BLOCK_DURATION, source=None, cache_dir=None,
+                           max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, report=None, writer=None):
     """
     Splits a given audio file into segments based on periods of silence.
     
@@ -17,78 +21,80 @@ def split_audio_on_silence(audio_path, silence_thresh=-50, min_silence_len=500,
         silence_thresh (int): Silence threshold in dBFS. Default is -50 dBFS.
         min_silence_len (int): Minimum length of silence in milliseconds. Default is 500 ms.
         output_folder (str): Folder where the segmented audio files will be saved.
+        streaming (bool): Decode the file block by block and export each segment as soon as it closes,
+            so memory does not grow with the length of the recording.
+        block_duration (float): Duration in seconds of each decoded block in streaming mode.
+        source (str or file-like): What to decode in streaming mode, if not audio_path
+            (e.g. the bytes embedded in a Hugging Face dataset).
+        cache_dir (str): Decoded-audio cache shared with the other scripts (None decodes the file every time).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        report (RunReport): Run report the 'decode', 'detect_silence' and 'encode' stages are timed in.
+        writer (ClipWriter): Writer shared with the other recordings (None writes the segments before returning).
         
     Returns:
         list: A list of file paths to the segmented audio chunks.
     """
-    # Load the audio file
-    audio = AudioSegment.from_file(audio_path)
-    
-    # Split the audio based on silence
-    audio_chunks = split_on_silence(
-        audio, 
-        min_silence_len=min_silence_len,  # Minimum length of silence (in ms)
-        silence_thresh=silence_thresh     # Silence threshold (in dBFS)
-    )
-    
-    # Ensure output folder exists
-    os.makedirs(output_folder, exist_ok=True)
-    
-    # Save each audio segment and store their file paths
-    segment_paths = []
-    for i, chunk in enumerate(audio_chunks):
-        segment_name = f"segment_{os.path.basename(audio_path).split('.')[0]}_{i}.mp3"
-        segment_path = os.path.join(output_folder, segment_name)
-        chunk.export(segment_path, format="mp3")
-        segment_paths.append(segment_path)
-    
-    return segment_paths
+    if streaming:
+        sample_rate, blocks = open_audio_stream(source or audio_path, block_duration)
+        audio_chunks = (
+            (samples, sample_rate)
+            for _, _, samples in timed(report, "detect_silence", stream_split_on_silence(
+                timed(report, "decode", blocks),
+                sample_rate,
+                min_silence_len=min_silence_len,  # Minimum length of silence (in ms)
+                silence_thresh=silence_thresh     # Silence threshold (in dBFS)
+            ))
+        )
+        return export_chunks(audio_chunks, output_folder, file_stem(audio_path), report=report, writer=writer)
+
+    with stage(report, "decode"):
+        if cache_dir:
+            # Memory-map the decoded audio, decoding it only on the first run
+            samples, sample_rate = load_audio(audio_path, cache_dir, max_cache_bytes=max_cache_bytes)
+        else:
+            samples, sample_rate = decode_recording(audio_path)
+
+    # Find the (start, end) sample offsets of the chunks between silences
+    with stage(report, "detect_silence"):
+        chunk_offsets = split_on_silence(
+            samples,
+            sample_rate,
+            min_silence_len=min_silence_len,  # Minimum length of silence (in ms)
+            silence_thresh=silence_thresh     # Silence threshold (in dBFS)
+        )
+    audio_chunks = ((samples[start:end], sample_rate) for start, end in chunk_offsets)
+
+    return export_chunks(audio_chunks, output_folder, file_stem(audio_path), report=report, writer=writer)
 
 
-def process_row(row, silence_thresh, min_silence_len, output_folder):
+def decode_recording(audio_path):
     """
-    Processes a single row of the dataset by segmenting its audio based on silence,
-    and splitting its transcription by sentences.
-    
-    Args:
-        row (dict): A single row of the dataset, containing 'audio' and 'transcription' fields.
-        silence_thresh (int): Silence threshold in dBFS.
-        min_silence_len (int): Minimum length of silence in milliseconds.
-        output_folder (str): Folder to store the segmented audio files.
-    
+    Decodes a whole recording to int16 samples with libsndfile, like the decoded-audio cache
+    (so the cache never changes the segments), or with pydub for the formats libsndfile cannot read.
+
     Returns:
-        dict: A dictionary with segmented audio paths and corresponding transcription parts.
+        tuple: ((frames, channels) integer samples, sampling rate).
     """
-    # Split the audio into segments based on silence
-    audio_segments = split_audio_on_silence(row["audio"]["path"], silence_thresh, min_silence_len, output_folder)
-    
-    # Split the transcription into sentences
-    transcription_segments = nltk.tokenize.sent_tokenize(row["transcription"])  # Split transcription into sentences
-    
-    # If the number of audio segments and transcription segments don't match, we can flag it for manual review
-    if len(audio_segments) != len(transcription_segments):
-        print(f"Warning: Mismatch between number of audio segments and transcription segments for {row['audio']['path']}")
-    
-    return {
-        "audio_segments": audio_segments,
-        "segment_transcriptions": transcription_segments
-    }
+    try:
+        return sf.read(audio_path, dtype="int16", always_2d=True)
+    except sf.LibsndfileError:
+        from pydub import AudioSegment
 
+        audio = AudioSegment.from_file(audio_path)
+        return audiosegment_to_array(audio), audio.frame_rate
 
-def process_dataset(dataset, output_folder, silence_thresh, min_silence_len):
+
+def split_row_audio(row, source_folder, silence_thresh, min_silence_len, streaming, block_duration, cache_dir,
+                    max_cache_bytes, report=None, writer=None):
     """
-    Processes the entire dataset by segmenting all audio files based on silence.
-    
-    Args:
-        dataset (Dataset): Hugging Face dataset containing 'audio' and 'transcription' columns.
-        output_folder (str): Folder where segmented audio files will be saved.
-        silence_thresh (int): Silence threshold in dBFS.
-        min_silence_len (int): Minimum length of silence in milliseconds.
-    
-    Returns:
-        Dataset: A processed dataset with additional columns for segmented audio paths and corresponding transcriptions.
+    Exports the silence segments of a row with split_audio_on_silence: the split_audio hook of row_segmentation.
     """
-    return dataset.map(lambda row: process_row(row, silence_thresh, min_silence_len, output_folder))
+    return split_audio_on_silence(
+        row["audio"]["path"], silence_thresh, min_silence_len, source_folder,
+        streaming=streaming, block_duration=block_duration,
+        source=audio_source(row["audio"]) if streaming else None,
+        cache_dir=cache_dir, max_cache_bytes=max_cache_bytes, report=report, writer=writer
+    )
 
 
 def main():
@@ -108,22 +114,61 @@ def main():
     parser.add_argument("--silence_thresh", type=int, default=-50, help="Silence threshold in dBFS (default: -50)")
     parser.add_argument("--min_silence_len", type=int, default=500, help="Minimum silence length in milliseconds (default: 500)")
 
+    # Optional arguments for bounded-memory processing of long recordings
+    parser.add_argument("--streaming", action="store_true", help="Decode and segment audio block by block with constant memory")
+    parser.add_argument("--block_duration", type=float, default=DEFAULT_BLOCK_DURATION, help=f"Duration in seconds of each decoded block in streaming mode (default: {DEFAULT_BLOCK_DURATION})")
+
+    # Optional argument for parallel processing
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes segmenting recordings in parallel (default: 1)")
+
+    # Optional argument to keep segments as offsets into the source recordings
+    parser.add_argument("--output_mode", type=str, default="mp3", choices=["mp3", "offsets"], help="Export segments to MP3 files, or only store their sample offsets (default: mp3)")
+
+    # Optional arguments for the decoded-audio cache
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of the decoded-audio cache shared by all the scripts (default: no cache)")
+    parser.add_argument("--cache_size_gb", type=float, default=DEFAULT_MAX_CACHE_BYTES / 1024 ** 3, help="Size limit of the decoded-audio cache in GB (default: 20)")
+
+    # Optional arguments for the segment-to-sentence alignment
+    parser.add_argument("--align", action="store_true", help="Merge or split segments to get exactly one per sentence, with a confidence score")
+    parser.add_argument("--min_confidence", type=float, default=DEFAULT_MIN_CONFIDENCE, help=f"Alignments scoring below this are flagged for manual labeling (default: {DEFAULT_MIN_CONFIDENCE})")
+
+    # Optional arguments bounding the segment durations for training
+    parser.add_argument("--max_duration", type=float, default=None, help="Split segments longer than this (in seconds) at their lowest-energy point (default: no limit)")
+    parser.add_argument("--min_duration", type=float, default=None, help="Merge segments shorter than this (in seconds) with a neighbour (default: keep them)")
+
+    # Optional run report and profiling
+    add_report_arguments(parser)
+
     args = parser.parse_args()
+    report = report_from_args(args)
+
+    from datasets import load_dataset
+    from huggingface_hub import login  # To authenticate with Hugging Face Hub
 
     # Log in to Hugging Face using the provided token
     login(args.hf_token)
     
     # Load the dataset from Hugging Face Hub
     print(f"Loading dataset {args.dataset_name} from Hugging Face Hub...")
-    dataset = load_dataset(args.dataset_name)
+    with stage(report, "load_dataset"):
+        dataset = load_dataset(args.dataset_name)
     
     # Process the dataset by applying silence-based segmentation to each audio file
     print("Processing dataset and segmenting audio files...")
-    processed_dataset = process_dataset(dataset["train"], args.output_folder, args.silence_thresh, args.min_silence_len)
+    processed_dataset = process_dataset(
+        dataset["train"], args.output_folder, args.silence_thresh, args.min_silence_len, split_row_audio,
+        name_after_source=True,
+        streaming=args.streaming, block_duration=args.block_duration, num_workers=args.num_workers, output_mode=args.output_mode,
+        cache_dir=args.cache_dir, max_cache_bytes=int(args.cache_size_gb * 1024 ** 3),
+        align=args.align, min_confidence=args.min_confidence,
+        max_duration=args.max_duration, min_duration=args.min_duration, report=report
+    )
     
     # Save the processed dataset
     print(f"Saving processed dataset to {args.output_dataset}...")
-    processed_dataset.to_json(args.output_dataset)
+    with stage(report, "write_dataset"):
+        processed_dataset.to_json(args.output_dataset)
+    save_report(report, args)
     
     print("Audio segmentation completed and dataset saved successfully!")
 
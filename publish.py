@@ -0,0 +1,382 @@
+import os
+import json
+import math
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datasets import Audio
+from dotenv import load_dotenv
+
+from audio_cache import content_hash
+from merge_datasets import SOURCE_COLUMN, load_corpus
+from shard_writer import DEFAULT_SHARD_SIZE, SHARD_INDEX_NAME, write_shard
+
+
+# Folder of the shards in the published repository, named like the Hub's own parquet exports
+SHARD_FOLDER = "data"
+
+# Number of shards uploaded at the same time
+DEFAULT_UPLOAD_WORKERS = 4
+
+# Number of times a failed upload is retried, with exponential backoff, before the run gives up on it
+DEFAULT_MAX_RETRIES = 3
+
+# Shards uploaded since the last completed publication, kept in the staging folder so a rerun resumes
+UPLOAD_JOURNAL_NAME = "uploaded.json"
+
+
+def write_json(path, data):
+    """
+    Writes a JSON file atomically, so an interrupted run never leaves half of it behind.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+class LocalBackend:
+    """
+    Publishes to a local directory laid out like the Hub repository, e.g. an internal mirror or an offline test target.
+
+    Uploads go to a '.uploads' folder and only replace the published shards on commit, so the
+    mirror always matches its index. The mirror can be loaded with shard_writer.load_shards.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.name = f"local:{os.path.abspath(root)}"
+        self.uploads = os.path.join(root, ".uploads")
+
+    def read_index(self):
+        """
+        Returns the index of the last publication, or None.
+        """
+        path = os.path.join(self.root, SHARD_INDEX_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def upload(self, local_path, path_in_repo):
+        """
+        Copies a shard next to the published ones, without publishing it yet.
+        """
+        staged_path = os.path.join(self.uploads, path_in_repo)
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(staged_path), suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, staged_path)
+
+    def commit(self, uploaded, deleted, index, message):
+        """
+        Publishes the uploaded shards and the new index, and removes the deleted shards.
+        """
+        for path_in_repo in uploaded:
+            staged_path = os.path.join(self.uploads, path_in_repo)
+            # Shards moved by an interrupted commit are already in place
+            if os.path.exists(staged_path):
+                os.makedirs(os.path.dirname(os.path.join(self.root, path_in_repo)), exist_ok=True)
+                os.replace(staged_path, os.path.join(self.root, path_in_repo))
+        write_json(os.path.join(self.root, SHARD_INDEX_NAME), index)
+        for path_in_repo in deleted:
+            if os.path.exists(os.path.join(self.root, path_in_repo)):
+                os.remove(os.path.join(self.root, path_in_repo))
+        shutil.rmtree(self.uploads, ignore_errors=True)
+
+
+class HubBackend:
+    """
+    Publishes to a Hugging Face dataset repository.
+
+    Shards are uploaded as LFS blobs without committing them, and published together
+    in a single commit with the new index: blobs uploaded by an interrupted run stay on
+    the Hub, so a rerun does not send them again.
+    """
+
+    def __init__(self, repo_id, token=None, private=False):
+        from huggingface_hub import HfApi
+
+        self.api = HfApi(token=token)
+        self.repo_id = repo_id
+        self.name = f"hub:{repo_id}"
+        self.api.create_repo(repo_id, repo_type="dataset", private=private, exist_ok=True)
+
+    def read_index(self):
+        """
+        Returns the index of the last publication, or None.
+        """
+        from huggingface_hub import hf_hub_download
+        from huggingface_hub.utils import EntryNotFoundError
+
+        try:
+            path = hf_hub_download(self.repo_id, SHARD_INDEX_NAME, repo_type="dataset", token=self.api.token)
+        except EntryNotFoundError:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def upload(self, local_path, path_in_repo):
+        """
+        Uploads the content of a shard, without committing it.
+        """
+        from huggingface_hub import CommitOperationAdd
+
+        self.api.preupload_lfs_files(
+            self.repo_id, [CommitOperationAdd(path_in_repo, local_path)], repo_type="dataset", num_threads=1
+        )
+
+    def commit(self, uploaded, deleted, index, message):
+        """
+        Publishes the uploaded shards and the new index, and removes the deleted shards, in one commit.
+        """
+        from huggingface_hub import CommitOperationAdd, CommitOperationDelete
+
+        operations = [CommitOperationAdd(path, uploaded[path]) for path in uploaded]
+        operations.append(CommitOperationAdd(SHARD_INDEX_NAME, json.dumps(index, indent=1).encode("utf-8")))
+        operations.extend(CommitOperationDelete(path) for path in deleted)
+        self.api.create_commit(self.repo_id, operations, commit_message=message, repo_type="dataset")
+
+
+def shard_file(shard, num_shards):
+    """
+    Returns the path in the repository of a shard, e.g. 'data/train-00003-of-00008.parquet'.
+    """
+    return f"{SHARD_FOLDER}/train-{shard:05d}-of-{num_shards:05d}.parquet"
+
+
+def row_keys(dataset, batch_size=1000):
+    """
+    Yields a stable key per row: the file name of its audio, or the SHA-256 of its bytes if it has none,
+    prefixed with the corpus of the row in a merged dataset ('<source>/<name>').
+
+    The key does not depend on the position of the row or on its content, so a fixed
+    transcript or a re-encoded clip stays in the shard it was published in, and clips
+    with the same file name in different corpora keep keys of their own.
+    """
+    has_source = SOURCE_COLUMN in dataset.column_names
+    columns = ["audio", SOURCE_COLUMN] if has_source else ["audio"]
+    for batch in dataset.select_columns(columns).with_format("arrow").iter(batch_size):
+        audio = batch.column("audio").combine_chunks()
+        data, paths = audio.field("bytes"), audio.field("path")
+        sources = batch.column(SOURCE_COLUMN).to_pylist() if has_source else [None] * len(audio)
+        for i in range(len(audio)):
+            path = paths[i].as_py()
+            key = os.path.basename(path) if path else hashlib.sha256(data[i].as_buffer()).hexdigest()
+            yield key if sources[i] is None else f"{sources[i]}/{key}"
+
+
+def assign_shards(dataset, num_shards):
+    """
+    Splits the rows of a dataset into `num_shards` shards by the hash of their key.
+
+    Adding, removing or changing a row only changes the shard its key hashes to, and rows
+    are sorted by key within each shard, so unchanged shards are rebuilt byte for byte.
+
+    Returns:
+        list: The row indices of each shard.
+    """
+    shards = [[] for _ in range(num_shards)]
+    for index, key in enumerate(row_keys(dataset)):
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        shards[int.from_bytes(digest[:8], "big") % num_shards].append((key, index))
+    return [[index for _, index in sorted(shard)] for shard in shards]
+
+
+def build_shard(dataset, indices, staging_dir, path_in_repo, features):
+    """
+    Writes the rows of a shard as Parquet with their audio embedded, and returns its index entry with its SHA-256.
+    """
+    shard_path = os.path.join(staging_dir, path_in_repo)
+    entry = write_shard(list(dataset.select(indices)), shard_path, features)
+    return {**entry, "file": path_in_repo, "sha256": content_hash(shard_path)}
+
+
+def build_shards(dataset, staging_dir, num_shards, num_workers=1):
+    """
+    Writes the deterministic shards of a dataset to a staging folder.
+
+    Args:
+        dataset (Dataset): Dataset to publish, with an 'audio' column.
+        staging_dir (str): Folder the shards are written to, under SHARD_FOLDER.
+        num_shards (int): Number of shards.
+        num_workers (int): Number of processes writing shards in parallel.
+
+    Returns:
+        list: Index entries of the non-empty shards ({'file', 'num_rows', 'num_bytes', 'sha256'}), in order.
+    """
+    os.makedirs(os.path.join(staging_dir, SHARD_FOLDER), exist_ok=True)
+    features = dataset.features
+    # Rows are written with their encoded audio, never decoded
+    dataset = dataset.cast_column("audio", Audio(decode=False))
+
+    with ProcessPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+        futures = [
+            executor.submit(build_shard, dataset, indices, staging_dir, shard_file(i, num_shards), features)
+            for i, indices in enumerate(assign_shards(dataset, num_shards)) if indices
+        ]
+        shards = [future.result() for future in futures]
+
+    # Drop the shards of a previous build with another number of shards
+    current = {os.path.basename(shard["file"]) for shard in shards}
+    for name in os.listdir(os.path.join(staging_dir, SHARD_FOLDER)):
+        if name not in current:
+            os.remove(os.path.join(staging_dir, SHARD_FOLDER, name))
+    return shards
+
+
+def upload_with_retries(backend, local_path, path_in_repo, max_retries=DEFAULT_MAX_RETRIES, backoff=1.0):
+    """
+    Uploads a shard, retrying failures with exponential backoff.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return backend.upload(local_path, path_in_repo)
+        except Exception as error:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Upload of {path_in_repo} failed ({error}), retrying in {delay:.0f} s")
+            time.sleep(delay)
+
+
+def publish_dataset(dataset_path, backend, staging_dir=None, num_shards=None, shard_size=DEFAULT_SHARD_SIZE,
+                    upload_workers=DEFAULT_UPLOAD_WORKERS, max_retries=DEFAULT_MAX_RETRIES, num_workers=1,
+                    message="Update dataset"):
+    """
+    Publishes a dataset as deterministic Parquet shards, uploading only the shards that changed.
+
+    The index of the published shards (shards.json, with the SHA-256 of every shard) is
+    read back from the target and compared with the freshly built shards: only new or
+    changed shards are uploaded, by a pool of `upload_workers` threads, and shards that
+    no longer exist are deleted. Every finished upload is recorded in a journal in the
+    staging folder, and the shards and the new index are only published once every
+    upload succeeded, so an interrupted or failed run is resumed by running it again.
+
+    Args:
+        dataset_path (str): save_to_disk or shard folder of the dataset.
+        backend (LocalBackend or HubBackend): Where to publish.
+        staging_dir (str): Folder the shards are built in (default: '<dataset_path>_publish').
+        num_shards (int): Number of shards (default: the number of the last publication, so rows keep
+            their shard, or one per `shard_size` rows for a first publication).
+        shard_size (int): Rows per shard of a first publication.
+        upload_workers (int): Number of shards uploaded at the same time.
+        max_retries (int): Number of retries of a failed upload.
+        num_workers (int): Number of processes building shards in parallel.
+        message (str): Commit message.
+
+    Returns:
+        dict: The published index.
+    """
+    dataset = load_corpus(dataset_path)
+    if not isinstance(dataset.features.get("audio"), Audio):
+        raise ValueError(f"{dataset_path} has no encoded 'audio' column: materialize virtual segments before publishing")
+
+    previous = backend.read_index() or {"shards": []}
+    num_shards = num_shards or previous.get("num_shards") or max(math.ceil(len(dataset) / shard_size), 1)
+    staging_dir = staging_dir or f"{os.path.normpath(dataset_path)}_publish"
+
+    print(f"Building {num_shards} shards of {len(dataset)} rows in {staging_dir}...")
+    shards = build_shards(dataset, staging_dir, num_shards, num_workers)
+    index = {
+        "format": "parquet",
+        "features": dataset.features.to_dict(),
+        "num_rows": len(dataset),
+        "num_shards": num_shards,
+        "shards": shards,
+    }
+
+    published = {shard["file"]: shard["sha256"] for shard in previous["shards"]}
+    changed = [shard for shard in shards if published.get(shard["file"]) != shard["sha256"]]
+    deleted = sorted(set(published) - {shard["file"] for shard in shards})
+    if not changed and not deleted and previous.get("features") == index["features"]:
+        print(f"Nothing changed since the last publication to {backend.name}")
+        return index
+
+    # Shards uploaded by an interrupted run are not sent again
+    journal_path = os.path.join(staging_dir, UPLOAD_JOURNAL_NAME)
+    journal = {"target": backend.name, "uploaded": {}}
+    if os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["target"] == backend.name:
+            journal = saved
+    to_upload = [shard for shard in changed if journal["uploaded"].get(shard["file"]) != shard["sha256"]]
+    print(f"Uploading {len(to_upload)} new or changed shards ({len(changed) - len(to_upload)} already uploaded), "
+          f"deleting {len(deleted)}, keeping {len(shards) - len(changed)}")
+
+    lock, failures = threading.Lock(), []
+    with ThreadPoolExecutor(max_workers=max(upload_workers, 1)) as executor:
+        futures = {
+            executor.submit(upload_with_retries, backend, os.path.join(staging_dir, shard["file"]), shard["file"], max_retries): shard
+            for shard in to_upload
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            if future.exception() is not None:
+                failures.append(shard["file"])
+                print(f"Upload of {shard['file']} failed: {future.exception()}")
+                continue
+            with lock:
+                journal["uploaded"][shard["file"]] = shard["sha256"]
+                write_json(journal_path, journal)
+    if failures:
+        raise RuntimeError(f"{len(failures)} shards failed to upload; run the command again to resume")
+
+    backend.commit(
+        {shard["file"]: os.path.join(staging_dir, shard["file"]) for shard in changed}, deleted, index, message
+    )
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    print(f"Published {len(dataset)} rows in {len(shards)} shards to {backend.name}")
+    return index
+
+
+def add_publish_arguments(parser):
+    """
+    Adds the options of publish_dataset shared by publish.py and manual_labeling/push_to_hf.py.
+    """
+    parser.add_argument("--repo_id", type=str, default=None, help="Hugging Face dataset repository to publish to, e.g. ArissBandoss/proverbes-moore-vol2.")
+    parser.add_argument("--local_dir", type=str, default=None, help="Publish to this local directory instead of the Hub (offline tests, internal mirrors).")
+    parser.add_argument("--private", action="store_true", help="Create the Hub repository as private.")
+    parser.add_argument("--staging_dir", type=str, default=None, help="Folder the shards are built in before uploading (default: <dataset_path>_publish).")
+    parser.add_argument("--num_shards", type=int, default=None, help="Number of shards (default: as in the last publication, or one per 1000 rows). Changing it re-uploads every shard.")
+    parser.add_argument("--upload_workers", type=int, default=DEFAULT_UPLOAD_WORKERS, help=f"Number of shards uploaded at the same time (default: {DEFAULT_UPLOAD_WORKERS}).")
+    parser.add_argument("--max_retries", type=int, default=DEFAULT_MAX_RETRIES, help=f"Retries of a failed upload before giving up (default: {DEFAULT_MAX_RETRIES}).")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of processes building shards in parallel (default: 1).")
+    parser.add_argument("--message", type=str, default="Update dataset", help="Commit message of the publication.")
+
+
+def publish_from_args(args, token=None):
+    """
+    Publishes args.dataset_path to args.local_dir, or to the args.repo_id Hub repository.
+    """
+    if args.local_dir:
+        backend = LocalBackend(args.local_dir)
+    elif args.repo_id:
+        backend = HubBackend(args.repo_id, token, args.private)
+    else:
+        raise ValueError("Give a --repo_id or a --local_dir to publish to")
+    return publish_dataset(
+        args.dataset_path, backend, args.staging_dir, args.num_shards, upload_workers=args.upload_workers,
+        max_retries=args.max_retries, num_workers=args.num_workers, message=args.message
+    )
+
+
+if __name__ == "__main__":
+    # The token may come from a .env file, as in manual_labeling/push_to_hf.py
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Publish a dataset as Parquet shards, uploading only the shards that changed.")
+
+    parser.add_argument("--dataset_path", type=str, required=True, help="Dataset to publish: save_to_disk or shard folder.")
+    parser.add_argument("--hf_token", type=str, default=os.getenv("HF_TOKEN"), help="Hugging Face token (default: $HF_TOKEN, read from the environment or a .env file).")
+    add_publish_arguments(parser)
+
+    args = parser.parse_args()
+    publish_from_args(args, args.hf_token)
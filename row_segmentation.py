@@ -0,0 +1,328 @@
+import os
+import json
+from contextlib import nullcontext
+
+from audio_io import DEFAULT_BLOCK_DURATION, audio_duration, source_id
+from audio_cache import DEFAULT_MAX_CACHE_BYTES
+from clip_writer import DEFAULT_WRITER_THREADS, ClipWriter
+from virtual_segments import find_segment_offsets, local_source_path, read_segment
+from segment_alignment import DEFAULT_MIN_CONFIDENCE, align_recording
+from segment_capping import cap_recording
+from sentence_splitter import split_sentences
+from run_report import RunReport, file_context, stage, timed
+
+
+# Rows processed with one writer: enough for encoding to overlap the next decode, few
+# enough that the audio of a batch (decoded or embedded) fits in memory
+ROWS_PER_BATCH = 16
+
+
+def export_chunks(audio_chunks, output_folder, source_name=None, num_threads=DEFAULT_WRITER_THREADS, report=None,
+                  writer=None):
+    """
+    Exports (samples, sampling rate) audio chunks to MP3 files and returns their paths.
+
+    Chunks are encoded in-process by a pool of writer threads while the next ones are
+    being cut, instead of starting an ffmpeg process per chunk. With a shared `writer`,
+    the chunks are only queued: they keep encoding while the next recording is decoded,
+    and are written once the writer is flushed.
+
+    Args:
+        audio_chunks (Iterable[tuple]): (samples, sampling rate) of each chunk.
+        output_folder (str): Folder where the chunks are written.
+        source_name (str): Name of the recording, used to name the chunks 'segment_<name>_<i>.mp3'
+            (None names them 'segment_<i>.mp3').
+        num_threads (int): Number of writer threads (without `writer`).
+        report (RunReport): Run report the 'encode' stage is timed in (time spent producing the chunks excluded).
+        writer (ClipWriter): Writer shared with the other recordings (None writes the chunks before returning).
+
+    Returns:
+        list: A list of file paths to the segmented audio chunks.
+    """
+    # Ensure output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Save each audio segment and store their file paths
+    prefix = f"segment_{source_name}" if source_name else "segment"
+    segment_paths = []
+    with stage(report, "encode"), ClipWriter(num_threads) if writer is None else nullcontext(writer) as clip_writer:
+        for i, (samples, sample_rate) in enumerate(audio_chunks):
+            segment_path = os.path.join(output_folder, f"{prefix}_{i}.mp3")
+            clip_writer.submit(samples, sample_rate, segment_path, "mp3")
+            segment_paths.append(segment_path)
+
+    return segment_paths
+
+
+def file_stem(path):
+    """
+    Returns the file name of a path up to its first dot, e.g. 'chapter_01' for 'audio/chapter_01.mp3'.
+    """
+    return os.path.basename(path).split('.')[0]
+
+
+def process_row(row, index, silence_thresh, min_silence_len, output_folder, split_audio,
+                transcription_column="transcription", name_after_source=False, streaming=False,
+                block_duration=DEFAULT_BLOCK_DURATION, output_mode="mp3", cache_dir=None,
+                max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, align=False, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                max_duration=None, min_duration=None, instrument=False, trace_memory=False, writer=None):
+    """
+    Processes a single row of the dataset by segmenting its audio based on silence,
+    and splitting its transcription by sentences.
+
+    Args:
+        row (dict): A single row of the dataset, containing 'audio' and `transcription_column` fields.
+        index (int): Index of the row, used to give its segments a folder of their own.
+        silence_thresh (int): Silence threshold in dBFS.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        output_folder (str): Folder to store the segmented audio files.
+        split_audio (callable): Exports the segments of a row in 'mp3' mode without alignment or duration bounds:
+            split_audio(row, source_folder, silence_thresh, min_silence_len, streaming, block_duration, cache_dir,
+            max_cache_bytes, report, writer) returns their paths.
+        transcription_column (str): Column holding the transcription of the row.
+        name_after_source (bool): Name the exported segments after the audio file of the row.
+        streaming (bool): Decode and segment the audio block by block (the 'audio' column must not be decoded).
+        block_duration (float): Duration in seconds of each decoded block in streaming mode.
+        output_mode (str): 'mp3' to export every segment, or 'offsets' to only record the
+            (start_sample, end_sample) of each segment in the source (the 'audio' column must not be decoded).
+        cache_dir (str): Decoded-audio cache directory (None disables the cache).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        align (bool): Merge or split the silence segments so that there is exactly one per sentence,
+            and score each pair (the 'audio' column must not be decoded).
+        min_confidence (float): Alignments scoring below this are flagged for manual labeling.
+        max_duration (float): Cut the segments longer than this (in seconds) at their lowest-energy point
+            (the 'audio' column must not be decoded).
+        min_duration (float): Merge the segments shorter than this (in seconds) with a neighbour.
+        instrument (bool): Time and memory-track the stages of the row, in a 'run_report' entry (JSON).
+        trace_memory (bool): Also trace the allocations of each stage with tracemalloc.
+        writer (ClipWriter): Writer shared with the other rows (None writes the segments before returning).
+
+    Returns:
+        dict: A dictionary with the source id, segmented audio paths (or offsets) and corresponding transcription parts,
+            plus the confidence of each pair and of the whole alignment with `align`.
+    """
+    # Each source gets its own folder so that parallel workers never write the same file
+    row_source_id = source_id(row["audio"], index)
+    source_folder = os.path.join(output_folder, row_source_id)
+
+    # Rows may be processed in worker processes: their stages are collected in a report of their own
+    report = RunReport(trace_memory) if instrument else None
+    with file_context(report, row_source_id):
+        # Split the transcription into sentences
+        with stage(report, "tokenize"):
+            sentences = split_sentences(row[transcription_column])
+
+        options = {
+            "silence_thresh": silence_thresh, "min_silence_len": min_silence_len, "streaming": streaming,
+            "block_duration": block_duration, "output_mode": output_mode, "cache_dir": cache_dir,
+            "max_cache_bytes": max_cache_bytes, "max_duration": max_duration, "min_duration": min_duration,
+            "name_after_source": name_after_source, "report": report, "writer": writer,
+        }
+        if align:
+            result = align_row(row, row_source_id, source_folder, sentences, min_confidence=min_confidence, **options)
+        else:
+            result = segment_row(row, row_source_id, source_folder, sentences, split_audio, **options)
+
+    if report is not None:
+        report.record(
+            row_source_id, audio_seconds=audio_duration(row["audio"]),
+            segments=len(result.get("segment_offsets", result.get("audio_segments"))),
+            sentences=len(result["segment_transcriptions"]), mismatch=result["mismatch"]
+        )
+        result["run_report"] = json.dumps(report.files)
+    result.pop("mismatch")
+    return result
+
+
+def segment_row(row, row_source_id, source_folder, sentences, split_audio, silence_thresh, min_silence_len, streaming,
+                block_duration, output_mode, cache_dir, max_cache_bytes, max_duration, min_duration, name_after_source,
+                report=None, writer=None):
+    """
+    Segments the audio of a row on silence, next to the sentences of its transcription.
+
+    See process_row for the arguments.
+
+    Returns:
+        dict: The output of process_row, plus whether segments and sentences mismatch.
+    """
+    if output_mode == "offsets" or max_duration or min_duration:
+        source_path = local_source_path(row["audio"], source_folder)
+        sampling_rate, segment_offsets = find_segment_offsets(
+            source_path, silence_thresh, min_silence_len, streaming, block_duration, cache_dir, max_cache_bytes, report
+        )
+        if max_duration or min_duration:
+            # Bound the segment durations for training: split long ones at their quietest point, merge fragments
+            segment_offsets = cap_recording(
+                source_path, segment_offsets, max_duration, min_duration, cache_dir, max_cache_bytes, block_duration, report
+            )
+
+        if output_mode == "offsets":
+            segments = {
+                "source_path": source_path,
+                "sampling_rate": sampling_rate,
+                "segment_offsets": [list(offsets) for offsets in segment_offsets]
+            }
+        else:
+            audio_chunks = timed(report, "decode", (read_segment(source_path, start, end, cache_dir, max_cache_bytes) for start, end in segment_offsets))
+            source_name = file_stem(row["audio"]["path"] or source_path) if name_after_source else None
+            segments = {"audio_segments": export_chunks(audio_chunks, source_folder, source_name, report=report, writer=writer)}
+    else:
+        segments = {
+            "audio_segments": split_audio(
+                row, source_folder, silence_thresh, min_silence_len, streaming, block_duration, cache_dir, max_cache_bytes,
+                report, writer
+            )
+        }
+    num_segments = len(segments.get("segment_offsets", segments.get("audio_segments")))
+
+    # If the number of audio segments and transcription segments don't match, we can flag it for manual review
+    mismatch = num_segments != len(sentences)
+    if mismatch:
+        print(f"Warning: Mismatch between number of audio segments and transcription segments for {row['audio']['path']}")
+
+    return {
+        "source_id": row_source_id,
+        **segments,
+        "segment_transcriptions": sentences,
+        "mismatch": mismatch
+    }
+
+
+def align_row(row, row_source_id, source_folder, sentences, silence_thresh, min_silence_len, streaming, block_duration,
+              output_mode, cache_dir, max_cache_bytes, max_duration, min_duration, name_after_source,
+              min_confidence=DEFAULT_MIN_CONFIDENCE, report=None, writer=None):
+    """
+    Segments the audio of a row on silence, then aligns the segments with the sentences of its transcription.
+
+    See process_row for the arguments.
+
+    Returns:
+        dict: One segment (path or offsets) per sentence, with the confidence of each pair and of the alignment,
+            plus whether the alignment scored below `min_confidence`.
+    """
+    source_path = local_source_path(row["audio"], source_folder)
+    sampling_rate, segment_offsets = find_segment_offsets(
+        source_path, silence_thresh, min_silence_len, streaming, block_duration, cache_dir, max_cache_bytes, report
+    )
+    pairs, confidence = align_recording(
+        source_path, segment_offsets, sentences, cache_dir, max_cache_bytes, block_duration, report,
+        max_duration, min_duration
+    )
+
+    if output_mode == "offsets":
+        segments = {
+            "source_path": source_path,
+            "sampling_rate": sampling_rate,
+            "segment_offsets": [[pair["start_sample"], pair["end_sample"]] for pair in pairs]
+        }
+    else:
+        audio_chunks = timed(report, "decode", (read_segment(source_path, pair["start_sample"], pair["end_sample"], cache_dir, max_cache_bytes) for pair in pairs))
+        source_name = file_stem(row["audio"]["path"] or source_path) if name_after_source else None
+        segments = {"audio_segments": export_chunks(audio_chunks, source_folder, source_name, report=report, writer=writer)}
+
+    # Only the files the aligner is unsure about need manual labeling
+    if confidence < min_confidence:
+        print(f"Warning: Low alignment confidence ({confidence:.2f}) for {row['audio']['path']}, flag it for manual labeling")
+
+    return {
+        "source_id": row_source_id,
+        **segments,
+        "segment_transcriptions": [pair["sentence"] for pair in pairs],
+        "segment_confidences": [pair["confidence"] for pair in pairs],
+        "alignment_confidence": confidence,
+        "mismatch": confidence < min_confidence
+    }
+
+
+def process_rows(batch, indices, writer_threads=DEFAULT_WRITER_THREADS, **kwargs):
+    """
+    Processes a batch of rows with process_row, queuing the segments of every row on a
+    single writer, so that they keep encoding while the next recording is decoded.
+
+    Args:
+        batch (dict): Columns of the rows.
+        indices (list): Index of each row.
+        writer_threads (int): Number of threads encoding segments.
+        **kwargs: The other arguments of process_row.
+
+    Returns:
+        dict: The columns process_row adds, once every segment of the batch is written.
+    """
+    rows = [dict(zip(batch, values)) for values in zip(*batch.values())]
+    with ClipWriter(writer_threads) as writer:
+        results = [process_row(row, index, writer=writer, **kwargs) for row, index in zip(rows, indices)]
+    return {column: [result[column] for result in results] for column in (results[0] if results else {})}
+
+
+def process_dataset(dataset, output_folder, silence_thresh, min_silence_len, split_audio,
+                    transcription_column="transcription", name_after_source=False, streaming=False,
+                    block_duration=DEFAULT_BLOCK_DURATION, num_workers=1, output_mode="mp3", cache_dir=None,
+                    max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, align=False, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                    max_duration=None, min_duration=None, report=None):
+    """
+    Processes the entire dataset by segmenting all audio files based on silence.
+
+    Rows are processed in batches of ROWS_PER_BATCH, each with one clip writer (see process_rows).
+
+    Args:
+        dataset (Dataset): Hugging Face dataset containing 'audio' and `transcription_column` columns.
+        output_folder (str): Folder where segmented audio files will be saved.
+        silence_thresh (int): Silence threshold in dBFS.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        split_audio (callable): Exports the segments of a row in plain 'mp3' mode (see process_row).
+        transcription_column (str): Column holding the transcription of each row.
+        name_after_source (bool): Name the exported segments after the audio file of their row.
+        streaming (bool): Segment each recording block by block instead of decoding it whole.
+        block_duration (float): Duration in seconds of each decoded block in streaming mode.
+        num_workers (int): Number of processes segmenting rows in parallel. Rows keep their order
+            and segment names only depend on the row, so the output is the same for any value.
+        output_mode (str): 'mp3' to export segment files, or 'offsets' to store virtual segments
+            that virtual_segments.py reads lazily or materializes later.
+        cache_dir (str): Decoded-audio cache directory (None disables the cache).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        align (bool): Align the segments of each recording with its sentences, one segment per sentence.
+        min_confidence (float): Alignments scoring below this are flagged for manual labeling.
+        max_duration (float): Split the segments longer than this (in seconds) at their lowest-energy point.
+        min_duration (float): Merge the segments shorter than this (in seconds) with a neighbour.
+        report (RunReport): Run report the stages of every row are added to, whichever process ran them.
+
+    Returns:
+        Dataset: A processed dataset with additional columns for segmented audio paths and corresponding transcriptions.
+    """
+    from datasets import Audio
+
+    if streaming or output_mode == "offsets" or align or max_duration or min_duration:
+        # Keep the encoded audio so that rows are never decoded whole
+        dataset = dataset.cast_column("audio", Audio(decode=False))
+    dataset = dataset.map(
+        process_rows,
+        with_indices=True,
+        batched=True,
+        batch_size=ROWS_PER_BATCH,
+        fn_kwargs={
+            "silence_thresh": silence_thresh,
+            "min_silence_len": min_silence_len,
+            "output_folder": output_folder,
+            "split_audio": split_audio,
+            "transcription_column": transcription_column,
+            "name_after_source": name_after_source,
+            "streaming": streaming,
+            "block_duration": block_duration,
+            "output_mode": output_mode,
+            "cache_dir": cache_dir,
+            "max_cache_bytes": max_cache_bytes,
+            "align": align,
+            "min_confidence": min_confidence,
+            "max_duration": max_duration,
+            "min_duration": min_duration,
+            "instrument": report is not None,
+            "trace_memory": report is not None and report.trace_memory,
+        },
+        num_proc=num_workers if num_workers > 1 else None,
+    )
+
+    if report is not None:
+        for row_report in dataset["run_report"]:
+            report.merge(json.loads(row_report))
+        dataset = dataset.remove_columns("run_report")
+    return dataset
@@ -0,0 +1,244 @@
+import os
+import csv
+import json
+import time
+import cProfile
+import resource
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+# Key of the stages that do not belong to a single file (e.g. writing the dataset)
+RUN = "<run>"
+
+# Per-file counters written to the report, before the stage columns of the CSV
+FILE_FIELDS = ["audio_seconds", "segments", "sentences", "mismatch", "error"]
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the process so far, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RunReport:
+    """
+    Times and memory-tracks the stages of a pipeline run, per file, and writes them as a JSON or CSV report.
+
+    Stages nest: the time a stage spends in the stages it opens is charged to them, so
+    every second of a file is counted once. The peak RSS of the process is recorded at
+    the end of each stage; with `trace_memory`, tracemalloc also records the peak of
+    the Python and NumPy allocations made during the stage. With `profile_path`, the
+    whole run is profiled with cProfile and the stats are dumped there on save.
+    """
+
+    def __init__(self, trace_memory=False, profile_path=None):
+        self.trace_memory = trace_memory
+        self.profile_path = profile_path
+        self.files = {}
+        self.current_file = RUN
+        self.frames = []
+        self.start_time = time.perf_counter()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profiler = cProfile.Profile() if profile_path else None
+        if self.profiler:
+            self.profiler.enable()
+
+    def entry(self, file=None):
+        """
+        Returns the report entry of a file, creating it on first use.
+        """
+        return self.files.setdefault(file or self.current_file, {"stages": {}})
+
+    @contextmanager
+    def file(self, name):
+        """
+        Charges the stages opened inside the block to `name`.
+        """
+        previous, self.current_file = self.current_file, name
+        self.entry(name)
+        try:
+            yield self
+        finally:
+            self.current_file = previous
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a stage of the current file, excluding the stages nested in it.
+        """
+        frame = {"start": time.perf_counter(), "children": 0.0, "traced_peak": 0}
+        if self.trace_memory:
+            if self.frames:
+                self.frames[-1]["traced_peak"] = max(self.frames[-1]["traced_peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.frames.append(frame)
+        try:
+            yield
+        finally:
+            self.frames.pop()
+            elapsed = time.perf_counter() - frame["start"]
+            stats = self.entry()["stages"].setdefault(name, {"seconds": 0.0, "calls": 0, "peak_rss_mb": 0.0})
+            stats["seconds"] += elapsed - frame["children"]
+            stats["calls"] += 1
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], peak_rss_mb())
+            if self.trace_memory:
+                frame["traced_peak"] = max(frame["traced_peak"], tracemalloc.get_traced_memory()[1])
+                stats["traced_peak_mb"] = max(stats.get("traced_peak_mb", 0.0), frame["traced_peak"] / 1024 ** 2)
+            if self.frames:
+                self.frames[-1]["children"] += elapsed
+                self.frames[-1]["traced_peak"] = max(self.frames[-1]["traced_peak"], frame["traced_peak"])
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of an iterable, charging the time spent producing them to a stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self, file=None, **counts):
+        """
+        Sets counters of a file (audio_seconds, segments, sentences, mismatch, error, ...).
+        """
+        self.entry(file).update(counts)
+
+    def merge(self, files):
+        """
+        Adds the entries of a report made elsewhere, e.g. in a worker process (see RunReport.to_dict).
+        """
+        for file, entry in files.items():
+            stages = self.entry(file)["stages"]
+            for name, stats in entry.get("stages", {}).items():
+                total = stages.setdefault(name, {"seconds": 0.0, "calls": 0, "peak_rss_mb": 0.0})
+                total["seconds"] += stats["seconds"]
+                total["calls"] += stats["calls"]
+                for key in ("peak_rss_mb", "traced_peak_mb"):
+                    if key in stats:
+                        total[key] = max(total.get(key, 0.0), stats[key])
+            self.record(file, **{key: value for key, value in entry.items() if key != "stages"})
+
+    def to_dict(self):
+        """
+        Returns the report: a summary of the run, the total of each stage, and every file entry.
+        """
+        wall_seconds = time.perf_counter() - self.start_time
+        files = {file: entry for file, entry in self.files.items() if file != RUN}
+        audio_seconds = sum(entry.get("audio_seconds", 0.0) for entry in files.values())
+
+        stages = {}
+        for entry in self.files.values():
+            for name, stats in entry["stages"].items():
+                total = stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+                total["seconds"] += stats["seconds"]
+                total["calls"] += stats["calls"]
+
+        return {
+            "summary": {
+                "files": len(files),
+                "wall_seconds": wall_seconds,
+                "audio_seconds": audio_seconds,
+                "audio_seconds_per_wall_second": audio_seconds / wall_seconds if wall_seconds else 0.0,
+                "segments": sum(entry.get("segments", 0) for entry in files.values()),
+                "mismatches": sum(bool(entry.get("mismatch")) for entry in files.values()),
+                "errors": sum(bool(entry.get("error")) for entry in files.values()),
+                "peak_rss_mb": peak_rss_mb(),
+            },
+            "stages": stages,
+            "files": self.files,
+        }
+
+    def save(self, path):
+        """
+        Writes the report to `path`: the whole report as JSON, or one row per file as CSV
+        (with a `<stage>_seconds` column per stage). Also dumps the cProfile stats, if profiling.
+        """
+        report = self.to_dict()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        if path.endswith(".csv"):
+            stage_names = list(report["stages"])
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=["file"] + FILE_FIELDS + [f"{name}_seconds" for name in stage_names])
+                writer.writeheader()
+                for file, entry in report["files"].items():
+                    row = {"file": file, **{field: entry.get(field) for field in FILE_FIELDS}}
+                    row.update({f"{name}_seconds": stats["seconds"] for name, stats in entry["stages"].items()})
+                    writer.writerow(row)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=1)
+
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler.enable()
+
+        summary = report["summary"]
+        print(f"Run report saved to {path}: {summary['files']} files, {summary['audio_seconds']:.0f} s of audio "
+              f"in {summary['wall_seconds']:.1f} s ({summary['audio_seconds_per_wall_second']:.1f}x real time), "
+              f"{summary['segments']} segments, {summary['mismatches']} mismatches, {summary['errors']} errors")
+
+
+def stage(report, name):
+    """
+    Returns report.stage(name), or a no-op context when there is no report.
+    """
+    return report.stage(name) if report is not None else nullcontext()
+
+
+def file_context(report, name):
+    """
+    Returns report.file(name), or a no-op context when there is no report.
+    """
+    return report.file(name) if report is not None else nullcontext()
+
+
+def timed(report, name, iterable):
+    """
+    Returns report.timed(name, iterable), or the iterable itself when there is no report.
+    """
+    return report.timed(name, iterable) if report is not None else iterable
+
+
+def add_report_arguments(parser):
+    """
+    Adds the --report_path, --profile_path and --trace_memory options shared by the entry points.
+    """
+    parser.add_argument("--report_path", type=str, default=None, help="Save a run report with the time and memory of each stage per file (.json, or .csv for one row per file)")
+    parser.add_argument("--profile_path", type=str, default=None, help="Profile the run with cProfile and dump the stats to this file (e.g. run.prof)")
+    parser.add_argument("--trace_memory", action="store_true", help="Also record the peak allocations of each stage with tracemalloc (slower)")
+
+
+def report_from_args(args):
+    """
+    Returns the RunReport the options of add_report_arguments ask for, or None.
+    """
+    if not (args.report_path or args.profile_path or args.trace_memory):
+        return None
+    return RunReport(trace_memory=args.trace_memory, profile_path=args.profile_path)
+
+
+def save_report(report, args):
+    """
+    Saves the report of a run to --report_path (and its profile to --profile_path), if any.
+    """
+    if report is None:
+        return
+    if args.report_path:
+        report.save(args.report_path)
+    elif report.profiler:
+        report.profiler.disable()
+        report.profiler.dump_stats(report.profile_path)
+    if report.profiler:
+        print(f"Profile saved to {report.profile_path} (python -m pstats {report.profile_path})")
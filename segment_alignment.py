@@ -0,0 +1,258 @@
+import numpy as np
+
+from audio_io import DEFAULT_BLOCK_DURATION, open_audio_stream
+from audio_cache import DEFAULT_MAX_CACHE_BYTES, load_audio
+from silence_detection import ms_energy, ms_to_frame
+from run_report import stage
+
+
+# Files whose weakest aligned pair scores below this are flagged for manual labeling
+DEFAULT_MIN_CONFIDENCE = 0.3
+
+# Spread (in log of duration ratio) of sentence durations around their expected duration
+DURATION_SIGMA = 0.35
+
+# Cost of cutting a segment at an energy minimum instead of at a silence between segments
+SPLIT_PENALTY = 1.0
+
+# Split points are at least this far (in ms) from each other and from the segment edges
+MIN_SPLIT_PART_MS = 500
+
+# Maximum number of candidate split points per segment
+MAX_SPLITS_PER_SEGMENT = 4
+
+# Width (in ms) of the moving average applied to the energy before looking for split points
+SMOOTHING_MS = 50
+
+# A sentence may end at most this far (in voiced ms) from where the transcript predicts, so the
+# cost of aligning a sentence does not grow with the recording (multi-hour chapters stay linear)
+BAND_MS = 60_000
+
+
+def recording_energy(source_path, cache_dir=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES,
+                     block_duration=DEFAULT_BLOCK_DURATION):
+    """
+    Computes the per-millisecond energy envelope of a recording in bounded memory.
+
+    Without a cache the file is decoded in blocks of whole seconds, which start on
+    millisecond boundaries, so the envelope is the same as for the whole array.
+
+    Returns:
+        tuple: (per-millisecond energy, sampling rate).
+    """
+    if cache_dir:
+        samples, sample_rate = load_audio(source_path, cache_dir, max_cache_bytes=max_cache_bytes)
+        return ms_energy(samples, sample_rate), sample_rate
+
+    sample_rate, blocks = open_audio_stream(source_path, max(round(block_duration), 1))
+    energy = [ms_energy(block, sample_rate) for block in blocks]
+    return (np.concatenate(energy) if energy else np.empty(0)), sample_rate
+
+
+def smooth(energy, window_ms=SMOOTHING_MS):
+    """
+    Returns the centered moving average of a per-millisecond energy envelope.
+    """
+    cumulative = np.concatenate(([0.0], np.cumsum(energy, dtype=np.float64)))
+    positions = np.arange(len(energy))
+    lo = np.maximum(positions - window_ms // 2, 0)
+    hi = np.minimum(positions + window_ms - window_ms // 2, len(energy))
+    return (cumulative[hi] - cumulative[lo]) / np.maximum(hi - lo, 1)
+
+
+def split_points(smoothed, start_ms, end_ms, max_splits=MAX_SPLITS_PER_SEGMENT, min_part_ms=MIN_SPLIT_PART_MS):
+    """
+    Finds the lowest-energy points a segment can be cut at, lowest first.
+
+    Args:
+        smoothed (np.ndarray): Smoothed per-millisecond energy of the recording.
+        start_ms (int): Start of the segment in milliseconds.
+        end_ms (int): End of the segment in milliseconds.
+        max_splits (int): Maximum number of points returned.
+        min_part_ms (int): Minimum distance between two points, and from a point to the segment edges.
+
+    Returns:
+        list: Split positions in milliseconds.
+    """
+    lo, hi = start_ms + min_part_ms, min(end_ms - min_part_ms, len(smoothed) - 1)
+    if hi - lo < 2:
+        return []
+
+    region = smoothed[lo - 1:hi + 1]
+    minima = np.flatnonzero((region[1:-1] <= region[:-2]) & (region[1:-1] < region[2:])) + lo
+    if len(minima) == 0:
+        minima = np.array([lo + int(np.argmin(smoothed[lo:hi]))])
+
+    points = []
+    for position in minima[np.argsort(smoothed[minima], kind="stable")].tolist():
+        if all(abs(position - point) >= min_part_ms for point in points):
+            points.append(position)
+            if len(points) == max_splits:
+                break
+    return points
+
+
+def sentence_weights(sentences):
+    """
+    Returns the number of spoken characters of each sentence (at least 1), its expected duration weight.
+    """
+    return np.array([max(sum(not c.isspace() for c in sentence), 1) for sentence in sentences], dtype=np.float64)
+
+
+def candidate_boundaries(segment_offsets, sample_rate, smoothed, max_splits=MAX_SPLITS_PER_SEGMENT,
+                        min_part_ms=MIN_SPLIT_PART_MS):
+    """
+    Lists the places where a sentence may end: the silences between segments and the split points inside them.
+
+    Returns:
+        tuple: Arrays (end sample of the previous sentence, start sample of the next sentence,
+            voiced ms before the boundary, whether it cuts a segment), with the start and end of the audio first and last.
+    """
+    left, right, voiced, is_split = [segment_offsets[0][0]], [segment_offsets[0][0]], [0.0], [False]
+    total = 0.0
+    for i, (start, end) in enumerate(segment_offsets):
+        start_ms, end_ms = start * 1000 / sample_rate, end * 1000 / sample_rate
+        for point in sorted(split_points(smoothed, int(start_ms), int(end_ms), max_splits, min_part_ms)):
+            frame = int(ms_to_frame(point, sample_rate))
+            left.append(frame)
+            right.append(frame)
+            voiced.append(total + point - start_ms)
+            is_split.append(True)
+        total += end_ms - start_ms
+
+        left.append(end)
+        right.append(segment_offsets[i + 1][0] if i + 1 < len(segment_offsets) else end)
+        voiced.append(total)
+        is_split.append(False)
+    return np.array(left), np.array(right), np.array(voiced), np.array(is_split)
+
+
+def align_segments(energy, sample_rate, segment_offsets, sentences, sigma=DURATION_SIGMA, split_penalty=SPLIT_PENALTY,
+                   max_splits=MAX_SPLITS_PER_SEGMENT, min_part_ms=MIN_SPLIT_PART_MS, band_ms=BAND_MS):
+    """
+    Maps N silence-delimited segments onto M sentences by dynamic programming.
+
+    Each sentence gets a contiguous run of audio that ends either at a silence between
+    segments (merging the segments in between) or at one of the lowest-energy points
+    inside a segment (splitting it). The cost of a sentence is the squared log ratio of
+    its voiced duration to the duration its character count predicts at the speaking
+    rate of the recording, plus a penalty for every split. All the (start, end)
+    boundary pairs of a sentence are scored at once with NumPy, within `band_ms` of
+    where the sentence is predicted to end: the end of the best alignment of the
+    previous sentences plus its expected duration, so the prediction follows changes of
+    speaking rate instead of drifting away over a long recording.
+
+    Args:
+        energy (np.ndarray): Per-millisecond energy envelope of the recording.
+        sample_rate (int): Sampling rate of the recording.
+        segment_offsets (list): (start_sample, end_sample) of each segment, in order.
+        sentences (list): Sentences of the transcription, in order.
+        sigma (float): Spread of the log duration ratio of a sentence.
+        split_penalty (float): Cost of cutting a segment, in the same units as the duration cost.
+        max_splits (int): Maximum number of candidate split points per segment.
+        min_part_ms (int): Minimum duration of the parts of a split segment.
+        band_ms (float): Maximum distance (in voiced ms) between the end of a sentence and its predicted end.
+
+    Returns:
+        tuple: (list of {'start_sample', 'end_sample', 'sentence', 'confidence'} pairs,
+            confidence of the whole alignment, i.e. of its weakest pair).
+    """
+    if not sentences:
+        return [], 0.0
+    if not segment_offsets:
+        return [{"start_sample": 0, "end_sample": 0, "sentence": sentence, "confidence": 0.0} for sentence in sentences], 0.0
+
+    left, right, voiced, is_split = candidate_boundaries(
+        segment_offsets, sample_rate, smooth(energy), max_splits, min_part_ms
+    )
+    num_boundaries = len(voiced)
+
+    weights = sentence_weights(sentences)
+    expected = weights * voiced[-1] / weights.sum()
+    penalties = np.where(is_split, split_penalty, 0.0)
+
+    # Best cost of sentences [0, j) ending at each boundary of `ends`, and the boundary each one started at
+    ends, costs = np.array([0]), np.array([0.0])
+    backpointers = []
+    for j in range(len(sentences)):
+        if j == len(sentences) - 1:
+            candidates = np.array([num_boundaries - 1])
+        else:
+            # Boundaries are sorted by voiced time: take the ones around the predicted end by bisection
+            predicted_end = voiced[ends[np.argmin(costs)]] + expected[j]
+            lo, hi = np.searchsorted(voiced, [predicted_end - band_ms, predicted_end + band_ms], side="left")
+            candidates = np.arange(max(lo, 1), min(hi, num_boundaries - 1))
+
+        durations = voiced[candidates][None, :] - voiced[ends][:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            duration_costs = np.log(durations / expected[j]) ** 2 / (2 * sigma ** 2)
+        valid = (candidates[None, :] > ends[:, None]) & (durations > 0)
+        total = np.where(valid, costs[:, None] + duration_costs, np.inf)
+
+        best_start = np.argmin(total, axis=0)
+        best = total[best_start, np.arange(len(candidates))] + penalties[candidates]
+        reachable = np.isfinite(best)
+        backpointers.append((candidates[reachable], ends[best_start[reachable]]))
+        ends, costs = candidates[reachable], best[reachable]
+        if len(ends) == 0:
+            break
+
+    if len(ends) == 0:
+        # Not enough boundaries in reach: spread the sentences over the audio by character count
+        bounds = np.round(np.concatenate(([0.0], np.cumsum(weights) / weights.sum())) * (segment_offsets[-1][1] - segment_offsets[0][0]))
+        bounds = (bounds + segment_offsets[0][0]).astype(np.int64)
+        return [
+            {"start_sample": int(start), "end_sample": int(end), "sentence": sentence, "confidence": 0.0}
+            for start, end, sentence in zip(bounds[:-1], bounds[1:], sentences)
+        ], 0.0
+
+    # Walk back from the end of the audio
+    path = [num_boundaries - 1]
+    for candidates, starts in reversed(backpointers):
+        path.append(int(starts[np.searchsorted(candidates, path[-1])]))
+    path.reverse()
+
+    pairs = []
+    for j, (start, end) in enumerate(zip(path[:-1], path[1:])):
+        cost = np.log((voiced[end] - voiced[start]) / expected[j]) ** 2 / (2 * sigma ** 2)
+        cost += (penalties[start] + penalties[end]) / 2
+        pairs.append({
+            "start_sample": int(right[start]),
+            "end_sample": int(left[end]),
+            "sentence": sentences[j],
+            "confidence": float(np.exp(-cost)),
+        })
+
+    return pairs, min(pair["confidence"] for pair in pairs)
+
+
+def align_recording(source_path, segment_offsets, sentences, cache_dir=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES,
+                    block_duration=DEFAULT_BLOCK_DURATION, report=None, max_duration=None, min_duration=None):
+    """
+    Aligns the silence segments of a recording with the sentences of its transcription.
+
+    See align_segments for the alignment itself.
+
+    Args:
+        source_path (str): Path to the recording.
+        segment_offsets (list): (start_sample, end_sample) of each segment.
+        sentences (list): Sentences of the transcription.
+        cache_dir (str): Decoded-audio cache directory (None decodes the file block by block).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        block_duration (float): Duration in seconds of each decoded block without a cache.
+        report (RunReport): Run report the 'decode' (energy envelope) and 'align' stages are timed in.
+        max_duration (float): Cut segments longer than this (in seconds) at their lowest-energy point before aligning.
+        min_duration (float): Merge segments shorter than this (in seconds) with a neighbour before aligning.
+
+    Returns:
+        tuple: (aligned pairs, confidence of the alignment).
+    """
+    with stage(report, "decode"):
+        energy, sample_rate = recording_energy(source_path, cache_dir, max_cache_bytes, block_duration)
+    if max_duration or min_duration:
+        from segment_capping import cap_segments
+
+        with stage(report, "cap"):
+            segment_offsets = cap_segments(energy, sample_rate, segment_offsets, max_duration, min_duration)
+    with stage(report, "align"):
+        return align_segments(energy, sample_rate, segment_offsets, sentences)
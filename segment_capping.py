@@ -0,0 +1,147 @@
+import numpy as np
+
+from audio_io import DEFAULT_BLOCK_DURATION
+from audio_cache import DEFAULT_MAX_CACHE_BYTES
+from segment_alignment import recording_energy, smooth
+from silence_detection import ms_to_frame
+from run_report import stage
+
+
+# Parts of a split segment are at least this long (in ms), or a quarter of the segment if it is shorter
+MIN_SPLIT_PART_MS = 500
+
+
+def split_long_segment(smoothed, sample_rate, start, end, max_ms, min_part_ms=MIN_SPLIT_PART_MS):
+    """
+    Recursively cuts a segment at its lowest-energy point until no part is longer than `max_ms`.
+
+    Args:
+        smoothed (np.ndarray): Smoothed per-millisecond energy of the recording.
+        sample_rate (int): Sampling rate of the recording.
+        start (int): First frame of the segment.
+        end (int): Frame just past the end of the segment.
+        max_ms (float): Maximum duration of a part in milliseconds.
+        min_part_ms (int): Minimum duration of a part in milliseconds.
+
+    Returns:
+        list: (start, end) frames of the parts, in order.
+    """
+    parts, pending = [], [(start, end)]
+    while pending:
+        start, end = pending.pop()
+        start_ms, end_ms = int(start * 1000 / sample_rate), int(end * 1000 / sample_rate)
+        margin = min(min_part_ms, (end_ms - start_ms) // 4)
+        lo, hi = start_ms + margin, min(end_ms - margin, len(smoothed))
+        if end_ms - start_ms <= max_ms or hi - lo < 1:
+            parts.append((start, end))
+            continue
+
+        point = int(ms_to_frame(lo + int(np.argmin(smoothed[lo:hi])), sample_rate))
+        # Right part first, so that the left one is popped (and emitted) first
+        pending.extend([(point, end), (start, point)])
+    return parts
+
+
+def merge_short_segments(segment_offsets, sample_rate, min_ms, max_ms=None):
+    """
+    Merges every segment shorter than `min_ms` with its previous (or, for the first one, next) neighbour,
+    silence in between included, as long as the merged segment is not longer than `max_ms`.
+    """
+    merged = []
+    for start, end in segment_offsets:
+        if merged:
+            previous_ms = (merged[-1][1] - merged[-1][0]) * 1000 / sample_rate
+            current_ms = (end - start) * 1000 / sample_rate
+            merged_ms = (end - merged[-1][0]) * 1000 / sample_rate
+            if min(previous_ms, current_ms) < min_ms and (not max_ms or merged_ms <= max_ms):
+                merged[-1] = (merged[-1][0], end)
+                continue
+        merged.append((start, end))
+    return merged
+
+
+def cap_segments(energy, sample_rate, segment_offsets, max_duration=None, min_duration=None,
+                 min_part_ms=MIN_SPLIT_PART_MS):
+    """
+    Bounds the durations of silence segments for training.
+
+    Segments longer than `max_duration` are cut at their lowest-energy point, recursively,
+    so narration without pauses still ends up in short clips; fragments shorter than
+    `min_duration` are then merged with a neighbour when the result fits in `max_duration`.
+
+    Args:
+        energy (np.ndarray): Per-millisecond energy envelope of the recording.
+        sample_rate (int): Sampling rate of the recording.
+        segment_offsets (list): (start_sample, end_sample) of each segment, in order.
+        max_duration (float): Maximum duration of a segment in seconds (None keeps long segments).
+        min_duration (float): Minimum duration of a segment in seconds (None keeps short segments).
+        min_part_ms (int): Minimum duration of the parts of a split segment in milliseconds.
+
+    Returns:
+        list: The capped (start_sample, end_sample) offsets.
+    """
+    max_ms = max_duration * 1000 if max_duration else None
+    if max_ms:
+        smoothed = smooth(energy)
+        segment_offsets = [
+            part for start, end in segment_offsets
+            for part in split_long_segment(smoothed, sample_rate, start, end, max_ms, min_part_ms)
+        ]
+    if min_duration:
+        segment_offsets = merge_short_segments(segment_offsets, sample_rate, min_duration * 1000, max_ms)
+    return [(int(start), int(end)) for start, end in segment_offsets]
+
+
+def cap_recording(source_path, segment_offsets, max_duration=None, min_duration=None, cache_dir=None,
+                  max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, block_duration=DEFAULT_BLOCK_DURATION, report=None):
+    """
+    Bounds the durations of the silence segments of a recording (see cap_segments).
+
+    Args:
+        source_path (str): Path to the recording.
+        segment_offsets (list): (start_sample, end_sample) of each segment.
+        max_duration (float): Maximum duration of a segment in seconds.
+        min_duration (float): Minimum duration of a segment in seconds.
+        cache_dir (str): Decoded-audio cache directory (None decodes the file block by block).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        block_duration (float): Duration in seconds of each decoded block without a cache.
+        report (RunReport): Run report the 'decode' (energy envelope) and 'cap' stages are timed in.
+
+    Returns:
+        list: The capped (start_sample, end_sample) offsets.
+    """
+    with stage(report, "decode"):
+        energy, sample_rate = recording_energy(source_path, cache_dir, max_cache_bytes, block_duration)
+    with stage(report, "cap"):
+        return cap_segments(energy, sample_rate, segment_offsets, max_duration, min_duration)
+
+
+def pack_pairs(pairs, sample_rate, max_duration):
+    """
+    Groups consecutive aligned sentences into clips of at most `max_duration` seconds.
+
+    A sentence longer than `max_duration` on its own stays a clip of its own, since
+    cutting it would cut its text too.
+
+    Args:
+        pairs (list): {'start_sample', 'end_sample', 'sentence', 'confidence'} pairs from align_recording, in order.
+        sample_rate (int): Sampling rate of the recording.
+        max_duration (float): Maximum duration of a clip in seconds.
+
+    Returns:
+        list: Pairs of the same form, one per clip, with the sentences joined by spaces
+            and the confidence of their weakest sentence.
+    """
+    max_samples = max_duration * sample_rate
+    clips = []
+    for pair in pairs:
+        if clips and pair["end_sample"] - clips[-1]["start_sample"] <= max_samples:
+            clips[-1] = {
+                "start_sample": clips[-1]["start_sample"],
+                "end_sample": pair["end_sample"],
+                "sentence": f"{clips[-1]['sentence']} {pair['sentence']}",
+                "confidence": min(clips[-1]["confidence"], pair["confidence"]),
+            }
+        else:
+            clips.append(dict(pair))
+    return clips
@@ -0,0 +1,77 @@
+import re
+
+
+# A run of sentence-final punctuation, the closing quotes/brackets after it (French-style spaced guillemets
+# included), and the space before the next sentence.
+# Tokens are delimited by whitespace only, so elisions (t’a, b’a), ʋ, ɩ and nasal vowels, precomposed or
+# written with a combining tilde, always stay inside the word they belong to.
+SENTENCE_END = re.compile(r"(?P<word>\S*?)(?P<end>[.!?…]+)(?:[\"'”’»)\]]|\s+[»”])*(?:\s+|$)")
+
+# Blank lines end a sentence (and a paragraph) even without punctuation
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# Quotes and brackets that may open a word, ignored when looking it up in ABBREVIATIONS
+OPENING = "\"'“‘«(["
+
+# Words (lowercased, without their final period) after which a period does not end a sentence, mostly the
+# French abbreviations found in Burkinabè transcripts and Bible references. Mooré words such as 'm' or 'me'
+# are left out, since sentences often end with them.
+ABBREVIATIONS = frozenset({
+    "mm", "mme", "mmes", "mlle", "dr", "pr", "st", "ste", "cf", "ex",
+    "p", "pp", "v", "vv", "ch", "chap", "art", "no", "n°", "vol", "av", "apr", "j.-c",
+})
+
+
+def is_sentence_end(word, end, following):
+    """
+    Tells whether punctuation closes a sentence, given the word it ends and the text after it.
+
+    Args:
+        word (str): Token the punctuation is attached to, e.g. 'Wẽnnaam' or '(Mat'.
+        end (str): The run of final punctuation, e.g. '.', '?!' or '...'.
+        following (str): First character of the next sentence ('' at the end of the text).
+
+    Returns:
+        bool: Whether to split after the punctuation.
+    """
+    if "?" in end or "!" in end:
+        return True
+    if end != ".":
+        # Ellipsis: the sentence goes on when the next word is not capitalized
+        return not following.islower()
+
+    word = word.lstrip(OPENING)
+    if word.lower() in ABBREVIATIONS:
+        return False
+    # Initials (A. Ouédraogo) and numbered items (1. kõn-tẽnga) do not end a sentence
+    if len(word) == 1 and word.isupper():
+        return False
+    if word.isdigit() and following.islower():
+        return False
+    return True
+
+
+def split_sentences(text):
+    """
+    Splits a Mooré transcription into sentences, without any model or download.
+
+    A sentence ends at '.', '!', '?' or an ellipsis followed by whitespace (closing
+    quotes and brackets stay with it), or at a blank line. Periods after the
+    abbreviations of ABBREVIATIONS, after initials and after list numbers followed by
+    a lowercase word do not end a sentence.
+
+    Args:
+        text (str): Text to split.
+
+    Returns:
+        list: The sentences, stripped, in order.
+    """
+    sentences = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        start = 0
+        for match in SENTENCE_END.finditer(paragraph):
+            if is_sentence_end(match.group("word"), match.group("end"), paragraph[match.end():match.end() + 1]):
+                sentences.append(paragraph[start:match.end()].strip())
+                start = match.end()
+        sentences.append(paragraph[start:].strip())
+    return [sentence for sentence in sentences if sentence]
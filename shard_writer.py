@@ -0,0 +1,345 @@
+import os
+import json
+import bisect
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datasets import Audio, Dataset, Features, concatenate_datasets
+from datasets.features.features import encode_nested_example
+
+
+# Default number of rows per shard
+DEFAULT_SHARD_SIZE = 1000
+
+# Name of the index listing the shards of a dataset, written next to them
+SHARD_INDEX_NAME = "shards.json"
+
+SHARD_FORMATS = ("parquet", "arrow")
+
+
+def embed_audio(value):
+    """
+    Returns the Arrow storage of an audio file with its encoded bytes embedded, so the shard is self-contained.
+
+    Args:
+        value (str or dict): Path to an audio file, or an audio dict with 'path' and/or 'bytes' keys.
+
+    Returns:
+        dict: {'bytes', 'path'} with the file name only as path.
+    """
+    if isinstance(value, str):
+        value = {"path": value, "bytes": None}
+    data = value.get("bytes")
+    if data is None:
+        with open(value["path"], "rb") as f:
+            data = f.read()
+    return {"bytes": data, "path": os.path.basename(value.get("path") or "")}
+
+
+def shard_table(rows, features):
+    """
+    Encodes a list of rows into an Arrow table, reading and embedding the bytes of their audio files.
+    """
+    encoded = []
+    for row in rows:
+        # Audio columns are stored as they are, without decoding them
+        encoded.append({
+            name: embed_audio(row[name]) if isinstance(feature, Audio) and row.get(name) is not None
+            else encode_nested_example(feature, row.get(name))
+            for name, feature in features.items()
+        })
+    return pa.Table.from_pylist(encoded, schema=features.arrow_schema)
+
+
+def rows_digest(rows, features):
+    """
+    Returns the SHA-256 of the content of a shard: its rows, with the size and modification
+    time of their audio files (or the hash of their embedded bytes) instead of the audio itself.
+    """
+    digest = hashlib.sha256()
+    for row in rows:
+        values = []
+        for name, feature in features.items():
+            value = row.get(name)
+            if isinstance(feature, Audio) and value is not None:
+                if isinstance(value, str):
+                    value = {"path": value, "bytes": None}
+                if value.get("bytes") is not None:
+                    value = [value.get("path"), hashlib.sha256(value["bytes"]).hexdigest()]
+                else:
+                    stat = os.stat(value["path"])
+                    value = [value["path"], stat.st_size, stat.st_mtime_ns]
+            values.append(value)
+        digest.update(json.dumps(values, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def previous_shards(output_dir, features):
+    """
+    Returns the index entries of the shards of the previous build in `output_dir` by file name,
+    if they were written with the same features (and are still there).
+    """
+    index_path = os.path.join(output_dir, SHARD_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    if index.get("features") != features.to_dict():
+        return {}
+    return {
+        shard["file"]: shard for shard in index["shards"]
+        if "rows_sha256" in shard and os.path.exists(os.path.join(output_dir, shard["file"]))
+    }
+
+
+def write_shard(rows, shard_path, features, shard_format="parquet", duration_column=None):
+    """
+    Writes a list of rows to a single Parquet or Arrow shard, atomically.
+
+    With `duration_column`, rows are sorted by duration and the index entry also
+    records the shortest and longest duration of the shard.
+
+    Returns:
+        dict: Index entry of the shard ({'file', 'num_rows', 'num_bytes'}).
+    """
+    entry = {}
+    if duration_column:
+        rows = sorted(rows, key=lambda row: row[duration_column])
+        entry = {"min_duration": rows[0][duration_column], "max_duration": rows[-1][duration_column]}
+    table = shard_table(rows, features)
+
+    folder = os.path.dirname(shard_path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    os.close(fd)
+    if shard_format == "parquet":
+        pq.write_table(table, tmp_path)
+    else:
+        # Same IPC stream format as the files written by save_to_disk
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, shard_path)
+
+    return {"file": os.path.basename(shard_path), "num_rows": len(rows), "num_bytes": os.path.getsize(shard_path), **entry}
+
+
+def batched(rows, size):
+    """
+    Groups an iterable of rows into lists of `size` rows (the last one may be shorter).
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bucketed(rows, size, duration_column, duration_buckets):
+    """
+    Routes rows to duration buckets, sorts each bucket by duration and cuts it into lists of `size` rows.
+
+    A bucket is sorted whole before it is cut, so its shards cover consecutive duration
+    ranges. Only the rows are held until then: their audio is read by the shard writers.
+
+    Args:
+        rows (Iterable[dict]): Rows with a duration in `duration_column`.
+        size (int): Number of rows per group.
+        duration_column (str): Column holding the duration of each row in seconds.
+        duration_buckets (list): Upper bounds of the buckets in seconds, in increasing order. Rows
+            longer than the last bound go to an extra, last bucket.
+
+    Yields:
+        tuple: (bucket index, rows), bucket by bucket, in increasing duration.
+    """
+    buckets = [[] for _ in range(len(duration_buckets) + 1)]
+    for row in rows:
+        buckets[bisect.bisect_left(duration_buckets, row[duration_column])].append(row)
+    for bucket, bucket_rows in enumerate(buckets):
+        # Stable: rows of equal duration keep their order
+        bucket_rows.sort(key=lambda row: row[duration_column])
+        for batch in batched(bucket_rows, size):
+            yield bucket, batch
+
+
+def bucket_shards(groups):
+    """
+    Names the (bucket, rows) groups of bucketed after their bucket and their rank in it.
+
+    Yields:
+        tuple: (shard name, bucket index, rows).
+    """
+    counts = {}
+    for bucket, batch in groups:
+        counts[bucket] = counts.get(bucket, -1) + 1
+        yield f"bucket-{bucket:02d}-shard-{counts[bucket]:05d}", bucket, batch
+
+
+def write_shards(rows, output_dir, features, shard_size=DEFAULT_SHARD_SIZE, num_workers=1, shard_format="parquet",
+                 duration_column=None, duration_buckets=None):
+    """
+    Writes a dataset as fixed-size shards with embedded audio, consuming its rows as a stream.
+
+    Rows are pulled from the iterable one shard at a time and at most two shards per
+    worker are in flight, so memory is bounded by the shard size whatever the size of
+    the corpus. Audio files are read and embedded by the workers. An index of the
+    shards is written last, and shards of a previous build that are not listed in it
+    are removed.
+
+    The index records a digest of the rows of every shard (see rows_digest): a shard
+    whose rows and audio files did not change since the previous build in `output_dir`
+    is kept as it is instead of being written again. Shards hold consecutive rows, so a
+    changed row only rewrites its own shard, but adding or removing rows also rewrites
+    the shards after it (in its bucket, with `duration_buckets`).
+
+    With `duration_buckets`, rows are routed to duration buckets, and every bucket is
+    sorted by duration (holding the rows, not their audio, in memory) and cut into
+    `bucket-XX-shard-XXXXX` shards, so the shards of a bucket cover consecutive
+    duration ranges. The index records the bounds of every bucket and the duration
+    range of every shard, and lists the shards in bucket order, so a training loader can batch clips of similar length, or load a
+    single bucket with load_shards, without scanning the dataset.
+
+    Args:
+        rows (Iterable[dict]): Rows of the dataset, with audio columns holding file paths (or audio dicts).
+        output_dir (str): Directory of the shards and their index.
+        features (Features): Features of the dataset.
+        shard_size (int): Number of rows per shard.
+        num_workers (int): Number of processes writing shards in parallel.
+        shard_format (str): 'parquet' or 'arrow'.
+        duration_column (str): Column holding the duration of each row in seconds (required with `duration_buckets`).
+        duration_buckets (list): Upper bounds in seconds of the duration buckets, e.g. [5, 10, 15, 20]
+            (None writes the rows in their order).
+
+    Returns:
+        dict: The shard index.
+    """
+    if shard_format not in SHARD_FORMATS:
+        raise ValueError(f"Unsupported shard format: {shard_format}")
+    if duration_buckets and not duration_column:
+        raise ValueError("Duration buckets need the duration column of the rows")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if duration_buckets:
+        duration_buckets = sorted(duration_buckets)
+        batches = bucket_shards(bucketed(rows, shard_size, duration_column, duration_buckets))
+    else:
+        duration_column = None
+        batches = ((f"shard-{i:05d}", None, batch) for i, batch in enumerate(batched(rows, shard_size)))
+
+    previous = previous_shards(output_dir, features)
+    # Until the new index is written, an interrupted build must not vouch for shards it may have rewritten
+    if os.path.exists(os.path.join(output_dir, SHARD_INDEX_NAME)):
+        os.remove(os.path.join(output_dir, SHARD_INDEX_NAME))
+    shards = []
+    with ProcessPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+        pending = deque()
+        for name, bucket, batch in batches:
+            file_name = f"{name}.{shard_format}"
+            digest = rows_digest(batch, features)
+            if file_name in previous and previous[file_name]["rows_sha256"] == digest:
+                # Same rows as the shard of the previous build: keep it
+                pending.append((bucket, digest, previous[file_name]))
+                continue
+            future = executor.submit(
+                write_shard, batch, os.path.join(output_dir, file_name), features, shard_format, duration_column
+            )
+            pending.append((bucket, digest, future))
+            if len(pending) >= 2 * max(num_workers, 1):
+                shards.append(shard_entry(*pending.popleft()))
+        shards.extend(shard_entry(*shard) for shard in pending)
+
+    index = {
+        "format": shard_format,
+        "shard_size": shard_size,
+        "features": features.to_dict(),
+        "num_rows": sum(shard["num_rows"] for shard in shards),
+        "shards": shards,
+    }
+    if duration_buckets:
+        bounds = [0.0] + duration_buckets + [None]
+        index["duration_column"] = duration_column
+        index["duration_buckets"] = [
+            {
+                "bucket": bucket,
+                "min_duration": bounds[bucket],
+                "max_duration": bounds[bucket + 1],
+                "num_rows": sum(shard["num_rows"] for shard in shards if shard["bucket"] == bucket),
+            }
+            for bucket in range(len(duration_buckets) + 1)
+        ]
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, os.path.join(output_dir, SHARD_INDEX_NAME))
+
+    # Drop the shards a previous, larger build left behind
+    current = {shard["file"] for shard in shards}
+    for name in os.listdir(output_dir):
+        if name.startswith(("shard-", "bucket-")) and name.endswith(SHARD_FORMATS) and name not in current:
+            os.remove(os.path.join(output_dir, name))
+
+    return index
+
+
+def shard_entry(bucket, digest, shard):
+    """
+    Returns the index entry of a submitted (or kept) shard, with the digest of its rows and its duration bucket (if any).
+    """
+    entry = dict(shard) if isinstance(shard, dict) else shard.result()
+    entry["rows_sha256"] = digest
+    if bucket is not None:
+        entry["bucket"] = bucket
+    return entry
+
+
+def same_layout(dataset_path, shard_size, shard_format="parquet", duration_buckets=None):
+    """
+    Tells whether a folder holds shards written by write_shards with the given size, format and duration buckets.
+    """
+    if not is_sharded(dataset_path):
+        return False
+    with open(os.path.join(dataset_path, SHARD_INDEX_NAME), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    buckets = [bucket["max_duration"] for bucket in index.get("duration_buckets", [])][:-1]
+    return (
+        index.get("shard_size") == shard_size and index["format"] == shard_format
+        and buckets == sorted(duration_buckets or [])
+    )
+
+
+def is_sharded(dataset_path):
+    """
+    Tells whether a folder holds a dataset written by write_shards.
+    """
+    return os.path.exists(os.path.join(dataset_path, SHARD_INDEX_NAME))
+
+
+def load_shards(dataset_path, buckets=None):
+    """
+    Loads a dataset written by write_shards, memory-mapping its shards.
+
+    Args:
+        dataset_path (str): Directory of the shards and their index.
+        buckets (list): Indices of the duration buckets to load (None loads every shard).
+
+    Returns:
+        Dataset: The dataset, with its audio columns decoded on access.
+    """
+    with open(os.path.join(dataset_path, SHARD_INDEX_NAME), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    features = Features.from_dict(index["features"])
+    paths = [
+        os.path.join(dataset_path, shard["file"]) for shard in index["shards"]
+        if buckets is None or shard.get("bucket") in buckets
+    ]
+
+    if not paths:
+        return Dataset.from_dict({name: [] for name in features}, features=features)
+    if index["format"] == "parquet":
+        return Dataset.from_parquet(paths, features=features)
+    # Arrow shards carry their features in their schema metadata
+    return concatenate_datasets([Dataset.from_file(path) for path in paths])
@@ -1,53 +1,95 @@
-import os
 import argparse
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
 import numpy as np
-import nltk
-from datasets import load_dataset, Dataset, Audio
-from huggingface_hub import login 
-
-nltk.download('punkt')  # tokenizer for sentence splitting
-nltk.download('punkt_tab')
-
-def split_audio_on_silence(audio, silence_thresh=-50, min_silence_len=500, output_folder="segments"):
-    # Split the audio based on silence
-    audio_chunks = split_on_silence(
-        audio, 
-        min_silence_len=min_silence_len,  # Minimum length of silence (in ms)
-        silence_thresh=silence_thresh     # Silence threshold (in dBFS)
+from silence_detection import audiosegment_to_array, split_on_silence, stream_split_on_silence
+from audio_io import DEFAULT_BLOCK_DURATION, audio_source, open_audio_stream
+from segment_alignment import DEFAULT_MIN_CONFIDENCE
+from row_segmentation import export_chunks, process_dataset
+from run_report import add_report_arguments, report_from_args, save_report, stage, timed
+
+# datasets, pydub and huggingface_hub are imported where they are used, so that the
+# CLI starts (and --help answers) without loading them
+
+def split_audio_on_silence(audio, silence_thresh=-50, min_silence_len=500, output_folder="segments", report=None,
+                           writer=None):
+    samples = audiosegment_to_array(audio)
+
+    # Find the (start, end) sample offsets of the chunks between silences
+    with stage(report, "detect_silence"):
+        chunk_offsets = split_on_silence(
+            samples,
+            audio.frame_rate,
+            min_silence_len=min_silence_len,  # Minimum length of silence (in ms)
+            silence_thresh=silence_thresh     # Silence threshold (in dBFS)
+        )
+    audio_chunks = ((samples[start:end], audio.frame_rate) for start, end in chunk_offsets)
+
+    return export_chunks(audio_chunks, output_folder, report=report, writer=writer)
+
+
+def split_audio_stream_on_silence(source, silence_thresh=-50, min_silence_len=500, output_folder="segments",
+                                  block_duration=DEFAULT_BLOCK_DURATION, report=None, writer=None):
+    """
+    Splits an encoded audio file on silence while decoding it block by block.
+
+    Each segment is exported as soon as the silence that ends it has been read, so
+    memory stays constant however long the recording is.
+
+    Args:
+        source (str or file-like): Audio file to decode.
+        silence_thresh (int): Silence threshold in dBFS.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        output_folder (str): Folder to store the segmented audio files.
+        block_duration (float): Duration in seconds of each decoded block.
+        report (RunReport): Run report the 'decode', 'detect_silence' and 'encode' stages are timed in.
+        writer (ClipWriter): Writer shared with the other recordings (None writes the segments before returning).
+
+    Returns:
+        list: A list of file paths to the segmented audio chunks.
+    """
+    sample_rate, blocks = open_audio_stream(source, block_duration)
+    audio_chunks = (
+        (samples, sample_rate)
+        for _, _, samples in timed(report, "detect_silence", stream_split_on_silence(
+            timed(report, "decode", blocks),
+            sample_rate,
+            min_silence_len=min_silence_len,  # Minimum length of silence (in ms)
+            silence_thresh=silence_thresh     # Silence threshold (in dBFS)
+        ))
     )
-    
-    # Ensure output folder exists
-    os.makedirs(output_folder, exist_ok=True)
-    
-    # Save each audio segment and store their file paths
-    segment_paths = []
-    for i, chunk in enumerate(audio_chunks):
-        segment_name = f"segment_{i}.mp3"
-        segment_path = os.path.join(output_folder, segment_name)
-        chunk.export(segment_path, format="mp3")
-        segment_paths.append(segment_path)
-    
-    return segment_paths
+
+    return export_chunks(audio_chunks, output_folder, report=report, writer=writer)
 
 
-def process_row(row, silence_thresh, min_silence_len, output_folder):
+def split_row_audio(row, source_folder, silence_thresh, min_silence_len, streaming, block_duration, cache_dir=None,
+                    max_cache_bytes=None, report=None, writer=None):
     """
-    Processes a single row of the dataset by segmenting its audio based on silence,
-    and splitting its transcription by sentences.
-    
+    Exports the silence segments of a row, decoded block by block or from its decoded 'audio' entry:
+    the split_audio hook of row_segmentation (this script has no decoded-audio cache).
+    """
+    if streaming:
+        return split_audio_stream_on_silence(
+            audio_source(row["audio"]), silence_thresh, min_silence_len, source_folder, block_duration, report, writer
+        )
+    return split_audio_array_on_silence(row["audio"], silence_thresh, min_silence_len, source_folder, report, writer)
+
+
+def split_audio_array_on_silence(audio, silence_thresh, min_silence_len, output_folder, report=None, writer=None):
+    """
+    Splits a decoded Hugging Face audio entry on silence.
+
     Args:
-        row (dict): A single row of the dataset, containing 'audio' and 'transcription' fields.
+        audio (dict): Decoded audio with 'array' and 'sampling_rate' keys.
         silence_thresh (int): Silence threshold in dBFS.
         min_silence_len (int): Minimum length of silence in milliseconds.
         output_folder (str): Folder to store the segmented audio files.
-    
+        report (RunReport): Run report the 'detect_silence' and 'encode' stages are timed in.
+        writer (ClipWriter): Writer shared with the other recordings (None writes the segments before returning).
+
     Returns:
-        dict: A dictionary with segmented audio paths and corresponding transcription parts.
+        list: A list of file paths to the segmented audio chunks.
     """
-    audio_data = row['audio']['array']  # Get the raw audio array
-    sample_rate = row['audio']['sampling_rate']  # Get the sample rate
+    audio_data = audio['array']  # Get the raw audio array
+    sample_rate = audio['sampling_rate']  # Get the sample rate
 
     #print(f"==================DEBUGGING===================> array size {audio_data.shape}")
     #print(f"==================DEBUGGING===================> array type {audio_data.dtype}")
@@ -65,6 +107,8 @@ def process_row(row, silence_thresh, min_silence_len, output_folder):
     #if audio_data.dtype == np.float32:
     #    audio_data = np.int16(audio_data / np.max(np.abs(audio_data)) * 32767)
 
+    from pydub import AudioSegment
+
     # Create an AudioSegment from the array and sample rate
     audio_segment = AudioSegment(
         audio_data.tobytes(), 
@@ -75,35 +119,7 @@ def process_row(row, silence_thresh, min_silence_len, output_folder):
     
     # Split the audio into segments based on silence
     #print(f"==================DEBUGGING===================> Splitting the audio into segments")
-    audio_segments = split_audio_on_silence(audio_segment, silence_thresh, min_silence_len, output_folder)
-    
-    # Split the transcription into sentences
-    transcription_segments = nltk.tokenize.sent_tokenize(row["transcript"])  # Split transcription into sentences
-    
-    # If the number of audio segments and transcription segments don't match, we can flag it for manual review
-    if len(audio_segments) != len(transcription_segments):
-        print(f"Warning: Mismatch between number of audio segments and transcription segments for {row['audio']['path']}")
-    
-    return {
-        "audio_segments": audio_segments,
-        "segment_transcriptions": transcription_segments
-    }
-
-
-def process_dataset(dataset, output_folder, silence_thresh, min_silence_len):
-    """
-    Processes the entire dataset by segmenting all audio files based on silence.
-    
-    Args:
-        dataset (Dataset): Hugging Face dataset containing 'audio' and 'transcription' columns.
-        output_folder (str): Folder where segmented audio files will be saved.
-        silence_thresh (int): Silence threshold in dBFS.
-        min_silence_len (int): Minimum length of silence in milliseconds.
-    
-    Returns:
-        Dataset: A processed dataset with additional columns for segmented audio paths and corresponding transcriptions.
-    """
-    return dataset.map(lambda row: process_row(row, silence_thresh, min_silence_len, output_folder))
+    return split_audio_on_silence(audio_segment, silence_thresh, min_silence_len, output_folder, report, writer)
 
 
 def main():
@@ -123,22 +139,56 @@ def main():
     parser.add_argument("--silence_thresh", type=int, default=-50, help="Silence threshold in dBFS (default: -50)")
     parser.add_argument("--min_silence_len", type=int, default=500, help="Minimum silence length in milliseconds (default: 500)")
 
+    # Optional arguments for bounded-memory processing of long recordings
+    parser.add_argument("--streaming", action="store_true", help="Decode and segment audio block by block with constant memory")
+    parser.add_argument("--block_duration", type=float, default=DEFAULT_BLOCK_DURATION, help=f"Duration in seconds of each decoded block in streaming mode (default: {DEFAULT_BLOCK_DURATION})")
+
+    # Optional argument for parallel processing
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes segmenting recordings in parallel (default: 1)")
+
+    # Optional argument to keep segments as offsets into the source recordings
+    parser.add_argument("--output_mode", type=str, default="mp3", choices=["mp3", "offsets"], help="Export segments to MP3 files, or only store their sample offsets (default: mp3)")
+
+    # Optional arguments for the segment-to-sentence alignment
+    parser.add_argument("--align", action="store_true", help="Merge or split segments to get exactly one per sentence, with a confidence score")
+    parser.add_argument("--min_confidence", type=float, default=DEFAULT_MIN_CONFIDENCE, help=f"Alignments scoring below this are flagged for manual labeling (default: {DEFAULT_MIN_CONFIDENCE})")
+
+    # Optional arguments bounding the segment durations for training
+    parser.add_argument("--max_duration", type=float, default=None, help="Split segments longer than this (in seconds) at their lowest-energy point (default: no limit)")
+    parser.add_argument("--min_duration", type=float, default=None, help="Merge segments shorter than this (in seconds) with a neighbour (default: keep them)")
+
+    # Optional run report and profiling
+    add_report_arguments(parser)
+
     args = parser.parse_args()
+    report = report_from_args(args)
+
+    from datasets import load_dataset
+    from huggingface_hub import login
 
     # Log in to Hugging Face using the provided token
     login(args.hf_token)
     
     # Load the dataset from Hugging Face Hub
     print(f"Loading dataset {args.dataset_name} from Hugging Face Hub...")
-    dataset = load_dataset(args.dataset_name)
+    with stage(report, "load_dataset"):
+        dataset = load_dataset(args.dataset_name)
     
     # Process the dataset by applying silence-based segmentation to each audio file
     print("Processing dataset and segmenting audio files...")
-    processed_dataset = process_dataset(dataset["train"], args.output_folder, args.silence_thresh, args.min_silence_len)
+    processed_dataset = process_dataset(
+        dataset["train"], args.output_folder, args.silence_thresh, args.min_silence_len, split_row_audio,
+        transcription_column="transcript",
+        streaming=args.streaming, block_duration=args.block_duration, num_workers=args.num_workers, output_mode=args.output_mode,
+        align=args.align, min_confidence=args.min_confidence,
+        max_duration=args.max_duration, min_duration=args.min_duration, report=report
+    )
     
     # Save the processed dataset
     print(f"Saving processed dataset to {args.output_dataset}...")
-    processed_dataset.to_json(args.output_dataset)
+    with stage(report, "write_dataset"):
+        processed_dataset.to_json(args.output_dataset)
+    save_report(report, args)
     
     print("Audio segmentation completed and dataset saved successfully!")
 
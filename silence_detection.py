@@ -0,0 +1,512 @@
+import numpy as np
+
+
+# Number of milliseconds of audio squared and summed per NumPy chunk when building the energy envelope
+ENERGY_CHUNK_MS = 60_000
+
+
+def audiosegment_to_array(audio_segment):
+    """
+    Returns a zero-copy (frames, channels) view on the raw samples of a pydub AudioSegment.
+
+    Args:
+        audio_segment (AudioSegment): Segment to view.
+
+    Returns:
+        np.ndarray: Integer sample array, one row per frame.
+    """
+    dtypes = {1: np.int8, 2: np.int16, 4: np.int32}
+    if audio_segment.sample_width not in dtypes:
+        raise ValueError(f"Unsupported sample width: {audio_segment.sample_width}")
+
+    samples = np.frombuffer(audio_segment.raw_data, dtype=dtypes[audio_segment.sample_width])
+    return samples.reshape(-1, audio_segment.channels)
+
+
+def max_possible_amplitude(samples):
+    """
+    Returns the full-scale amplitude of a sample array, used as the 0 dBFS reference.
+
+    Integer arrays follow pydub (2 ** (bits - 1)), floating point arrays are assumed to be in [-1, 1].
+    """
+    if np.issubdtype(samples.dtype, np.integer):
+        return float(2 ** (samples.dtype.itemsize * 8 - 1))
+    return 1.0
+
+
+def ms_to_frame(ms, sample_rate):
+    """
+    Converts millisecond positions to frame offsets exactly like pydub's AudioSegment slicing does.
+    """
+    return (np.asarray(ms, dtype=np.int64) * (sample_rate / 1000.0)).astype(np.int64)
+
+
+def audio_length_ms(num_frames, sample_rate):
+    """
+    Returns the length of an audio array in milliseconds, rounded like len(AudioSegment).
+    """
+    return round(1000 * (num_frames / sample_rate))
+
+
+def ms_energy(samples, sample_rate, chunk_ms=ENERGY_CHUNK_MS):
+    """
+    Computes the sum of squared samples for every millisecond of audio.
+
+    The array is processed in chunks of `chunk_ms` so that the squared copy never holds
+    more than a minute of audio, whatever the length of the recording.
+
+    Args:
+        samples (np.ndarray): Audio samples, shape (frames,) or (frames, channels).
+        sample_rate (int): Sampling rate of the audio.
+        chunk_ms (int): Number of milliseconds squared per chunk.
+
+    Returns:
+        np.ndarray: Energy of each millisecond (int64 for integer input, float64 otherwise).
+    """
+    samples = samples.reshape(len(samples), -1)
+    num_frames = len(samples)
+    length_ms = audio_length_ms(num_frames, sample_rate)
+    bounds = np.minimum(ms_to_frame(np.arange(length_ms + 1), sample_rate), num_frames)
+
+    acc_dtype = np.int64 if np.issubdtype(samples.dtype, np.integer) else np.float64
+    energy = np.empty(length_ms, dtype=acc_dtype)
+
+    for first_ms in range(0, length_ms, chunk_ms):
+        last_ms = min(first_ms + chunk_ms, length_ms)
+        start, end = bounds[first_ms], bounds[last_ms]
+
+        energy[first_ms:last_ms] = block_energy(samples[start:end], bounds[first_ms:last_ms + 1] - start, acc_dtype)
+
+    return energy
+
+
+def block_energy(samples, offsets, acc_dtype):
+    """
+    Sums squared samples between consecutive frame `offsets` of a (frames, channels) block.
+
+    Each span is summed on its own (np.add.reduceat), which is much faster than differencing a running sum.
+    """
+    chunk = samples.astype(acc_dtype)
+    # A plain square is several times faster than einsum on mono audio
+    frame_energy = np.square(chunk[:, 0]) if chunk.shape[1] == 1 else np.einsum("ij,ij->i", chunk, chunk)
+    starts, ends = offsets[:-1], offsets[1:]
+    if len(frame_energy) == 0:
+        return np.zeros(len(starts), dtype=acc_dtype)
+
+    # reduceat returns the frame at the start of an empty span instead of 0
+    energy = np.add.reduceat(frame_energy, np.minimum(starts, len(frame_energy) - 1))
+    energy[ends <= starts] = 0
+    return energy
+
+
+def silent_window_starts(energy, sample_rate, channels, integer_samples, full_scale,
+                         min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    """
+    Returns the start (in ms) of every `min_silence_len` window whose RMS is at or below `silence_thresh`.
+
+    Windows are evaluated at the same positions as pydub.silence.detect_silence, from a
+    per-millisecond energy envelope instead of re-slicing the audio for every position.
+    """
+    starts = window_starts(len(energy), min_silence_len, seek_step)
+    if len(starts) == 0:
+        return starts
+
+    cumulative = np.concatenate(([0], np.cumsum(energy)))
+    silent = silent_windows(
+        cumulative, starts, sample_rate, channels, integer_samples, full_scale, min_silence_len, silence_thresh
+    )
+    return starts[silent]
+
+
+def window_starts(length_ms, min_silence_len=1000, seek_step=1):
+    """
+    Returns the start (in ms) of every window pydub.silence.detect_silence tests, including the extra last one it adds off the seek_step grid.
+    """
+    last_slice_start = length_ms - min_silence_len
+    if last_slice_start < 0:
+        return np.empty(0, dtype=np.int64)
+
+    starts = np.arange(0, last_slice_start + 1, seek_step, dtype=np.int64)
+    if last_slice_start % seek_step:
+        starts = np.append(starts, last_slice_start)
+    return starts
+
+
+def silent_windows(cumulative, starts, sample_rate, channels, integer_samples, full_scale,
+                   min_silence_len, silence_thresh, first_ms=0):
+    """
+    Tests which `min_silence_len` windows starting at `starts` (in ms) are silent.
+
+    Args:
+        cumulative (np.ndarray): Cumulative per-millisecond energy, with cumulative[k] the energy of ms [first_ms, first_ms + k).
+        starts (np.ndarray): Window starts in milliseconds.
+        sample_rate (int): Sampling rate of the audio.
+        channels (int): Number of interleaved channels.
+        integer_samples (bool): Whether the samples are integers (RMS is then truncated like audioop.rms).
+        full_scale (float): Amplitude corresponding to 0 dBFS.
+        min_silence_len (int): Window length in milliseconds.
+        silence_thresh (float): Silence threshold in dBFS.
+        first_ms (int): Millisecond corresponding to cumulative[0].
+
+    Returns:
+        np.ndarray: Boolean mask over `starts`.
+    """
+    rms = window_rms(cumulative, starts, sample_rate, channels, integer_samples, min_silence_len, first_ms)
+    return rms <= dbfs_to_amplitude(silence_thresh, full_scale)
+
+
+def window_rms(cumulative, starts, sample_rate, channels, integer_samples, min_silence_len, first_ms=0):
+    """
+    Computes the RMS of the `min_silence_len` windows starting at `starts` (in ms), like audioop.rms on pydub slices.
+
+    See silent_windows for the arguments.
+
+    Returns:
+        np.ndarray: RMS amplitude of each window.
+    """
+    window_energy = cumulative[starts - first_ms + min_silence_len] - cumulative[starts - first_ms]
+
+    # Count the frames pydub expects in each slice (missing trailing frames are zero-padded)
+    frame_counts = ms_to_frame(starts + min_silence_len, sample_rate) - ms_to_frame(starts, sample_rate)
+    sample_counts = frame_counts * channels
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rms = np.where(sample_counts > 0, np.sqrt(window_energy / np.maximum(sample_counts, 1)), 0.0)
+    if integer_samples:
+        # audioop.rms truncates to an integer
+        rms = np.floor(rms)
+    return rms
+
+
+def dbfs_to_amplitude(silence_thresh, full_scale):
+    """
+    Converts a threshold in dBFS (scalar or array) to an amplitude, like pydub's db_to_float.
+    """
+    return 10 ** (np.asarray(silence_thresh, dtype=np.float64) / 20) * full_scale
+
+
+def group_silent_ranges(silence_starts, min_silence_len=1000, seek_step=1):
+    """
+    Combines silent window starts into [start, end] silent ranges in milliseconds, following pydub.
+    """
+    if len(silence_starts) == 0:
+        return []
+
+    gaps = np.diff(silence_starts)
+    breaks = np.flatnonzero((gaps != seek_step) & (gaps > min_silence_len))
+
+    range_starts = np.concatenate((silence_starts[:1], silence_starts[breaks + 1]))
+    range_ends = np.concatenate((silence_starts[breaks], silence_starts[-1:])) + min_silence_len
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+
+def nonsilent_from_silent(silent_ranges, length_ms):
+    """
+    Inverts silent ranges into nonsilent [start, end] ranges in milliseconds, following pydub.
+    """
+    if not silent_ranges:
+        return [[0, length_ms]]
+
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == length_ms:
+        return []
+
+    prev_end = 0
+    nonsilent_ranges = []
+    for start, end in silent_ranges:
+        nonsilent_ranges.append([prev_end, start])
+        prev_end = end
+
+    if end != length_ms:
+        nonsilent_ranges.append([prev_end, length_ms])
+
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+
+    return nonsilent_ranges
+
+
+def apply_keep_silence(nonsilent_ranges, keep_silence, length_ms):
+    """
+    Pads nonsilent ranges by `keep_silence` ms, sharing the silence between neighbours like pydub.
+
+    Returns:
+        list: [start, end] ranges in milliseconds clipped to the audio.
+    """
+    if isinstance(keep_silence, bool):
+        keep_silence = length_ms if keep_silence else 0
+
+    output_ranges = [[start - keep_silence, end + keep_silence] for start, end in nonsilent_ranges]
+
+    for range_i, range_ii in zip(output_ranges, output_ranges[1:]):
+        if range_ii[0] < range_i[1]:
+            range_i[1] = (range_i[1] + range_ii[0]) // 2
+            range_ii[0] = range_i[1]
+
+    return [[max(start, 0), min(end, length_ms)] for start, end in output_ranges]
+
+
+def detect_silence(samples, sample_rate, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    """
+    Vectorized equivalent of pydub.silence.detect_silence on a NumPy array.
+
+    Args:
+        samples (np.ndarray): Audio samples, shape (frames,) or (frames, channels).
+        sample_rate (int): Sampling rate of the audio.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        silence_thresh (float): Silence threshold in dBFS.
+        seek_step (int): Step size in milliseconds between tested windows.
+
+    Returns:
+        list: Silent [start, end] ranges in milliseconds.
+    """
+    samples = samples.reshape(len(samples), -1)
+    energy = ms_energy(samples, sample_rate)
+    starts = silent_window_starts(
+        energy, sample_rate, samples.shape[1], np.issubdtype(samples.dtype, np.integer),
+        max_possible_amplitude(samples), min_silence_len, silence_thresh, seek_step
+    )
+    return group_silent_ranges(starts, min_silence_len, seek_step)
+
+
+def detect_nonsilent(samples, sample_rate, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    """
+    Vectorized equivalent of pydub.silence.detect_nonsilent on a NumPy array.
+
+    Returns:
+        list: Nonsilent [start, end] ranges in milliseconds.
+    """
+    silent_ranges = detect_silence(samples, sample_rate, min_silence_len, silence_thresh, seek_step)
+    return nonsilent_from_silent(silent_ranges, audio_length_ms(len(samples), sample_rate))
+
+
+def split_on_silence(samples, sample_rate, min_silence_len=1000, silence_thresh=-16, keep_silence=100,
+                     seek_step=1):
+    """
+    Finds the chunks pydub.silence.split_on_silence would return, as sample offsets.
+
+    Frame RMS is computed once over the whole array, so this runs in a fraction of
+    the time pydub needs to re-slice the audio at every millisecond. Boundaries are
+    identical to pydub's, except that the last chunk is never zero-padded past the
+    end of the array.
+
+    Args:
+        samples (np.ndarray): Audio samples, shape (frames,) or (frames, channels).
+        sample_rate (int): Sampling rate of the audio.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        silence_thresh (float): Silence threshold in dBFS.
+        keep_silence (int or bool): Milliseconds of silence kept around each chunk (True keeps all of it).
+        seek_step (int): Step size in milliseconds between tested windows.
+
+    Returns:
+        list: (start_sample, end_sample) frame offsets of each chunk.
+    """
+    length_ms = audio_length_ms(len(samples), sample_rate)
+    nonsilent_ranges = detect_nonsilent(samples, sample_rate, min_silence_len, silence_thresh, seek_step)
+    output_ranges = apply_keep_silence(nonsilent_ranges, keep_silence, length_ms)
+    return ranges_to_samples(output_ranges, sample_rate, len(samples))
+
+
+def ranges_to_samples(ranges_ms, sample_rate, num_frames):
+    """
+    Converts [start, end] millisecond ranges into (start_sample, end_sample) frame offsets.
+    """
+    if not ranges_ms:
+        return []
+    frames = np.minimum(ms_to_frame(ranges_ms, sample_rate), num_frames)
+    return [(int(start), int(end)) for start, end in frames]
+
+
+# Stand-in for keep_silence=True in streaming mode, where the total length is not known upfront
+KEEP_ALL_SILENCE_MS = 10 ** 15
+
+
+class _SampleBuffer:
+    """
+    Holds the decoded frames that may still belong to a chunk, as a list of blocks.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.start = 0  # Frame offset of the first buffered frame
+        self.end = 0    # Frame offset just past the last buffered frame
+
+    def append(self, block):
+        self.blocks.append(block)
+        self.end += len(block)
+
+    def slice(self, start, end):
+        """Returns frames [start, end) as one contiguous array."""
+        parts = []
+        offset = self.start
+        for block in self.blocks:
+            block_end = offset + len(block)
+            if block_end > start and offset < end:
+                parts.append(block[max(start - offset, 0):min(end, block_end) - offset])
+            offset = block_end
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return self.blocks[0][:0] if self.blocks else np.empty((0, 1))
+        return np.concatenate(parts)
+
+    def drop_before(self, frame):
+        """Releases every frame before `frame`."""
+        while self.blocks and self.start + len(self.blocks[0]) <= frame:
+            self.start += len(self.blocks.pop(0))
+        if self.blocks and frame > self.start:
+            self.blocks[0] = self.blocks[0][frame - self.start:]
+            self.start = frame
+
+
+def stream_split_on_silence(blocks, sample_rate, min_silence_len=1000, silence_thresh=-16, keep_silence=100,
+                            seek_step=1):
+    """
+    Streaming equivalent of split_on_silence that consumes audio block by block.
+
+    The per-millisecond energy envelope, the silent window search and the grouping of
+    silent ranges all carry their state across block boundaries, and each chunk is
+    yielded as soon as the silence that closes it is known. Only the audio of the chunk
+    being built (plus the silence that follows it) is kept in memory, so memory does
+    not grow with the length of the recording. Boundaries are identical to split_on_silence.
+
+    Args:
+        blocks (Iterable[np.ndarray]): Consecutive audio blocks, shape (frames,) or (frames, channels).
+        sample_rate (int): Sampling rate of the audio.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        silence_thresh (float): Silence threshold in dBFS.
+        keep_silence (int or bool): Milliseconds of silence kept around each chunk (True keeps all of it).
+        seek_step (int): Step size in milliseconds between tested windows.
+
+    Yields:
+        tuple: (start_sample, end_sample, samples) for each chunk, in order.
+    """
+    if isinstance(keep_silence, bool):
+        keep_silence = KEEP_ALL_SILENCE_MS if keep_silence else 0
+
+    buffer = _SampleBuffer()
+    channels = integer_samples = full_scale = acc_dtype = None
+
+    # Per-millisecond energy of ms [energy_start, ms_done)
+    energy = np.empty(0)
+    energy_start = ms_done = 0
+    next_pos = 0  # Next window start (in ms) on the seek_step grid
+
+    # Silent range being grown, and the state of the chunk that follows the last closed range
+    range_start = prev_start = None
+    prev_end = 0
+    chunk_start = 0
+    found_silence = False
+
+    def evaluate(starts):
+        mask = silent_windows(
+            np.concatenate(([0], np.cumsum(energy))), starts, sample_rate, channels, integer_samples,
+            full_scale, min_silence_len, silence_thresh, energy_start
+        )
+        return starts[mask]
+
+    def close_range(start, end, length_ms=None):
+        # Returns the chunk before silent range [start, end] (None for leading silence) and where the next one starts
+        nonlocal prev_end, chunk_start
+        chunk = None
+        next_start = end - keep_silence
+        if not (prev_end == 0 and start == 0):
+            chunk_end = start + keep_silence
+            if next_start < chunk_end and end != length_ms:
+                chunk_end = next_start = (chunk_end + next_start) // 2
+            chunk = (max(chunk_start, 0), chunk_end)
+        prev_end, chunk_start = end, next_start
+        return chunk, next_start
+
+    def group(silence_starts, length_ms=None):
+        # Feeds silent window starts to the range grouping of pydub.silence.detect_silence
+        nonlocal range_start, prev_start, found_silence
+        chunks = []
+        for silence_start in silence_starts.tolist():
+            found_silence = True
+            if prev_start is None:
+                range_start = silence_start
+            elif silence_start != prev_start + seek_step and silence_start > prev_start + min_silence_len:
+                chunks.append(close_range(range_start, prev_start + min_silence_len, length_ms))
+                range_start = silence_start
+            prev_start = silence_start
+        return chunks
+
+    def emit(chunks, length_ms):
+        # Cuts the closed chunks out of the buffer, releasing the audio no later chunk needs
+        for chunk_ms, next_start in chunks:
+            if chunk_ms is not None:
+                start = int(min(ms_to_frame(chunk_ms[0], sample_rate), buffer.end))
+                end = int(min(ms_to_frame(min(chunk_ms[1], length_ms), sample_rate), buffer.end))
+                yield start, end, buffer.slice(start, end)
+            if next_start is not None:
+                buffer.drop_before(int(min(ms_to_frame(max(next_start, 0), sample_rate), buffer.end)))
+
+    for block in blocks:
+        if len(block) == 0:
+            continue
+        block = block.reshape(len(block), -1)
+        if channels is None:
+            channels = block.shape[1]
+            integer_samples = np.issubdtype(block.dtype, np.integer)
+            full_scale = max_possible_amplitude(block)
+            acc_dtype = np.int64 if integer_samples else np.float64
+            energy = energy.astype(acc_dtype)
+        buffer.append(block)
+
+        # Milliseconds whose frames have all been received
+        new_done = int(buffer.end * 1000 / sample_rate) + 2
+        while new_done > ms_done and ms_to_frame(new_done, sample_rate) > buffer.end:
+            new_done -= 1
+        if new_done > ms_done:
+            bounds = ms_to_frame(np.arange(ms_done, new_done + 1), sample_rate)
+            new_energy = block_energy(buffer.slice(bounds[0], bounds[-1]), bounds - bounds[0], acc_dtype)
+            energy = np.concatenate((energy, new_energy))
+            ms_done = new_done
+
+        # Windows entirely inside completed audio, keeping a 1 ms margin for the final length rounding
+        last_pos = ms_done - 1 - min_silence_len
+        if last_pos >= next_pos:
+            starts = np.arange(next_pos, last_pos + 1, seek_step, dtype=np.int64)
+            next_pos = int(starts[-1]) + seek_step
+            chunks = group(evaluate(starts))
+
+            # No later window can join the current range once the grid is past its reach
+            if prev_start is not None and next_pos - seek_step >= prev_start + max(min_silence_len, seek_step):
+                chunks.append(close_range(range_start, prev_start + min_silence_len))
+                range_start = prev_start = None
+
+            yield from emit(chunks, audio_length_ms(buffer.end, sample_rate))
+
+            # Keep one step behind the grid for the extra last window pydub adds off-grid
+            keep_from = max(next_pos - seek_step, energy_start)
+            energy = energy[keep_from - energy_start:]
+            energy_start = keep_from
+
+    if channels is None:
+        return
+
+    # Flush: the last partial millisecond and the windows that needed the final length
+    length_ms = audio_length_ms(buffer.end, sample_rate)
+    if length_ms > ms_done:
+        bounds = np.minimum(ms_to_frame(np.arange(ms_done, length_ms + 1), sample_rate), buffer.end)
+        energy = np.concatenate((energy, block_energy(buffer.slice(bounds[0], bounds[-1]), bounds - bounds[0], acc_dtype)))
+    energy = energy[:max(length_ms - energy_start, 0)]
+
+    chunks = []
+    last_slice_start = length_ms - min_silence_len
+    if last_slice_start >= next_pos:
+        starts = np.arange(next_pos, last_slice_start + 1, seek_step, dtype=np.int64)
+        if last_slice_start % seek_step:
+            starts = np.append(starts, last_slice_start)
+        chunks.extend(group(evaluate(starts), length_ms))
+    elif last_slice_start >= 0 and last_slice_start % seek_step and last_slice_start > next_pos - seek_step:
+        chunks.extend(group(evaluate(np.array([last_slice_start], dtype=np.int64)), length_ms))
+    if prev_start is not None:
+        chunks.append(close_range(range_start, prev_start + min_silence_len, length_ms))
+
+    if not found_silence:
+        chunks.append(((0, length_ms), None))
+    elif prev_end != length_ms:
+        chunks.append(((max(chunk_start, 0), length_ms), None))
+
+    yield from emit(chunks, length_ms)
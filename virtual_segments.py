@@ -0,0 +1,247 @@
+import os
+import argparse
+import numpy as np
+import soundfile as sf
+
+from audio_io import DEFAULT_BLOCK_DURATION, open_audio_stream
+from audio_cache import DEFAULT_MAX_CACHE_BYTES, load_audio
+from clip_stats import clip_stats
+from silence_detection import split_on_silence, stream_split_on_silence
+from run_report import stage, timed
+
+
+# Columns describing a virtual segment: a slice of a source recording that is never written to disk
+SEGMENT_COLUMNS = ["source_id", "source_path", "start_sample", "end_sample", "sampling_rate"]
+
+# Per-segment lists of the segmentation scripts, and the column each one becomes once exploded to one row per segment
+PER_SEGMENT_COLUMNS = {"segment_transcriptions": "transcription", "segment_confidences": "confidence"}
+
+
+def find_segment_offsets(source, silence_thresh=-50, min_silence_len=500, streaming=False,
+                         block_duration=DEFAULT_BLOCK_DURATION, cache_dir=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES,
+                         report=None):
+    """
+    Finds silence-delimited segments of an audio file without exporting any audio.
+
+    The file is decoded with soundfile, the same decoder read_segment uses, so the
+    offsets address exactly the samples that will be read back.
+
+    Args:
+        source (str or file-like): Audio file to segment.
+        silence_thresh (int): Silence threshold in dBFS.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        streaming (bool): Decode the file block by block instead of all at once.
+        block_duration (float): Duration in seconds of each decoded block in streaming mode.
+        cache_dir (str): Decoded-audio cache directory, used instead of decoding when not streaming.
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+        report (RunReport): Run report the 'decode' and 'detect_silence' stages are timed in.
+
+    Returns:
+        tuple: (sample_rate, list of (start_sample, end_sample) offsets).
+    """
+    if streaming:
+        sample_rate, blocks = open_audio_stream(source, block_duration)
+        offsets = [
+            (start, end) for start, end, _ in timed(report, "detect_silence", stream_split_on_silence(
+                timed(report, "decode", blocks), sample_rate, min_silence_len=min_silence_len, silence_thresh=silence_thresh
+            ))
+        ]
+        return sample_rate, offsets
+
+    with stage(report, "decode"):
+        if cache_dir:
+            samples, sample_rate = load_audio(source, cache_dir, max_cache_bytes=max_cache_bytes)
+        else:
+            samples, sample_rate = sf.read(source, dtype="int16", always_2d=True)
+    with stage(report, "detect_silence"):
+        offsets = split_on_silence(samples, sample_rate, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+
+    return sample_rate, offsets
+
+
+def local_source_path(audio, folder):
+    """
+    Returns a local file holding the encoded audio of a Hugging Face audio entry (loaded with Audio(decode=False)).
+
+    Embedded bytes are written once, as they are, so virtual segments can point to them.
+    """
+    if not audio.get("bytes"):
+        return os.path.abspath(audio["path"])
+
+    os.makedirs(folder, exist_ok=True)
+    source_path = os.path.abspath(os.path.join(folder, "source" + os.path.splitext(audio.get("path") or "")[1]))
+    with open(source_path, "wb") as f:
+        f.write(audio["bytes"])
+    return source_path
+
+
+def read_segment(source_path, start_sample, end_sample, cache_dir=None, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Decodes only the [start_sample, end_sample) frames of a source recording.
+
+    With a cache, the frames are sliced from the memory-mapped decoded recording, so
+    exporting the segments of a cached recording decodes nothing.
+
+    Args:
+        source_path (str): Path to the source audio file.
+        start_sample (int): First frame of the segment.
+        end_sample (int): Frame just past the end of the segment.
+        cache_dir (str): Decoded-audio cache directory (None decodes the frames from the source).
+        max_cache_bytes (int): Size limit of the decoded-audio cache.
+
+    Returns:
+        tuple: (float32 array of shape (frames,) or (frames, channels), sampling rate).
+    """
+    if cache_dir:
+        samples, sample_rate = load_audio(source_path, cache_dir, max_cache_bytes=max_cache_bytes)
+        # Same scaling as libsndfile's int16 to float32 conversion
+        samples = samples[start_sample:end_sample].astype(np.float32) / 32768
+        return (samples[:, 0] if samples.shape[1] == 1 else samples), sample_rate
+
+    samples, sample_rate = sf.read(source_path, start=start_sample, stop=end_sample, dtype="float32")
+    return samples, sample_rate
+
+
+def decode_segments(batch):
+    """
+    Dataset transform adding an 'audio' entry decoded from the offsets of each virtual segment.
+    """
+    batch["audio"] = []
+    for source_path, start, end in zip(batch["source_path"], batch["start_sample"], batch["end_sample"]):
+        samples, sample_rate = read_segment(source_path, start, end)
+        batch["audio"].append({"path": None, "array": samples, "sampling_rate": sample_rate})
+    return batch
+
+
+def with_segment_audio(dataset):
+    """
+    Returns a view of a virtual segment dataset whose rows carry a lazily decoded 'audio' entry.
+
+    Nothing is decoded until a row is accessed, and only the samples of that segment are read.
+
+    Args:
+        dataset (Dataset): Dataset with the SEGMENT_COLUMNS columns.
+
+    Returns:
+        Dataset: The same dataset with an on-the-fly 'audio' column.
+    """
+    return dataset.with_transform(decode_segments)
+
+
+def explode_segments(dataset, offsets_column="segment_offsets"):
+    """
+    Turns a dataset with one row per recording and a list of offsets into one row per virtual segment.
+
+    The per-segment lists of the segmentation scripts become columns of their own
+    (PER_SEGMENT_COLUMNS), and the other per-recording columns (e.g. 'alignment_confidence')
+    are repeated on every segment of the recording. The recording-level 'audio' and
+    'transcription' are dropped: each segment has its own.
+
+    Args:
+        dataset (Dataset): Dataset with 'source_id', 'source_path', 'sampling_rate' and `offsets_column` columns.
+        offsets_column (str): Column holding the [start_sample, end_sample] pairs of each recording.
+
+    Returns:
+        Dataset: Dataset with the SEGMENT_COLUMNS columns, a 'segment_index' column and the carried-over columns.
+    """
+    from datasets import Dataset
+
+    lists = {column: name for column, name in PER_SEGMENT_COLUMNS.items() if column in dataset.column_names}
+    dropped = set(SEGMENT_COLUMNS) | {offsets_column, "audio", "transcription", "audio_segments"} | set(lists)
+    carried = [column for column in dataset.column_names if column not in dropped]
+
+    rows = {column: [] for column in SEGMENT_COLUMNS + ["segment_index", *lists.values(), *carried]}
+    for row in dataset.select_columns(["source_id", "source_path", "sampling_rate", offsets_column, *lists, *carried]):
+        for i, (start, end) in enumerate(row[offsets_column]):
+            rows["source_id"].append(row["source_id"])
+            rows["source_path"].append(row["source_path"])
+            rows["start_sample"].append(start)
+            rows["end_sample"].append(end)
+            rows["sampling_rate"].append(row["sampling_rate"])
+            rows["segment_index"].append(i)
+            for column, name in lists.items():
+                rows[name].append(row[column][i] if i < len(row[column]) else None)
+            for column in carried:
+                rows[column].append(row[column])
+    return Dataset.from_dict(rows)
+
+
+def materialize_row(row, output_dir, audio_format, sampling_rate=None):
+    """
+    Writes the audio of a single virtual segment to its own file (resampled to `sampling_rate`, if given),
+    and computes its audio statistics.
+    """
+    samples, sample_rate = read_segment(row["source_path"], row["start_sample"], row["end_sample"])
+    if sampling_rate and sampling_rate != sample_rate:
+        import librosa
+
+        samples = librosa.resample(samples, orig_sr=sample_rate, target_sr=sampling_rate, axis=0)
+        sample_rate = sampling_rate
+    clip_path = os.path.join(output_dir, f"{row['source_id']}_{row['start_sample']}_{row['end_sample']}.{audio_format}")
+    sf.write(clip_path, samples, sample_rate)
+    return {"audio": clip_path, **clip_stats([samples], sample_rate, row.get("transcription"))}
+
+
+def materialize_segments(dataset, output_dir, audio_format="wav", num_workers=1, sampling_rate=None):
+    """
+    Writes every virtual segment to a standalone clip, e.g. before publishing a dataset.
+
+    Clips are cut from the source with soundfile and written losslessly, so there is no
+    MP3 to MP3 generation loss. With `sampling_rate`, each clip is resampled once as it is
+    written, so loading it for training never resamples.
+
+    Args:
+        dataset (Dataset): Dataset with the SEGMENT_COLUMNS columns.
+        output_dir (str): Directory where the clips are written.
+        audio_format (str): Clip format supported by soundfile ('wav' or 'flac').
+        num_workers (int): Number of processes writing clips in parallel.
+        sampling_rate (int): Sampling rate the clips are written at (None keeps the source rate).
+
+    Returns:
+        Dataset: The dataset with an 'audio' column pointing to the clips and the clip_stats columns,
+            without the offset columns.
+    """
+    from datasets import Audio
+
+    os.makedirs(output_dir, exist_ok=True)
+    dataset = dataset.map(
+        materialize_row,
+        fn_kwargs={"output_dir": output_dir, "audio_format": audio_format, "sampling_rate": sampling_rate},
+        num_proc=num_workers if num_workers > 1 else None,
+    )
+    dataset = dataset.remove_columns(["source_path", "start_sample", "end_sample", "sampling_rate"])
+    return dataset.cast_column("audio", Audio(sampling_rate=sampling_rate))
+
+
+def main():
+    """
+    Materializes a saved virtual segment dataset into standalone clips.
+    """
+    parser = argparse.ArgumentParser(description="Write the clips of a virtual segment dataset to disk")
+    parser.add_argument("--dataset_path", type=str, required=True, help="Path of the virtual segment dataset (save_to_disk folder, or JSON output of the segmentation scripts)")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the clips")
+    parser.add_argument("--output_dataset_path", type=str, required=True, help="Path to save the materialized dataset")
+    parser.add_argument("--format", type=str, default="wav", choices=["wav", "flac"], help="Clip format (default: wav)")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes writing clips (default: 1)")
+    parser.add_argument("--sampling_rate", type=int, default=None, help="Resample the clips to this rate as they are written, e.g. 16000 (default: source rate)")
+
+    args = parser.parse_args()
+
+    from datasets import Dataset
+
+    if os.path.isfile(args.dataset_path):
+        dataset = Dataset.from_json(args.dataset_path)
+    else:
+        dataset = Dataset.load_from_disk(args.dataset_path)
+    if "segment_offsets" in dataset.column_names:
+        dataset = explode_segments(dataset)
+
+    print(f"Materializing {len(dataset)} segments to '{args.output_dir}'...")
+    dataset = materialize_segments(dataset, args.output_dir, args.format, args.num_workers, args.sampling_rate)
+
+    dataset.save_to_disk(args.output_dataset_path)
+    print(f"Materialized dataset saved to {args.output_dataset_path}")
+
+
+if __name__ == "__main__":
+    main()